@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from app.config import (
+    CHALLENGE_CACHE_MAX_SIZE,
+    CHALLENGE_CACHE_TTL_SECONDS,
+    POINT_SHARDS_CACHE_MAX_SIZE,
+    POINT_SHARDS_CACHE_TTL_SECONDS,
+    POINTS_CACHE_MAX_SIZE,
+    POINTS_CACHE_TTL_SECONDS,
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Caché LRU en memoria con expiración por entrada, segura entre hilos.
+
+    Con ttl <= 0 la caché queda deshabilitada y todas las lecturas son fallos.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Documentos de 'challenges' por ID y, bajo ALL_CHALLENGES_KEY, el catálogo completo
+challenge_cache = TTLCache(CHALLENGE_CACHE_MAX_SIZE, CHALLENGE_CACHE_TTL_SECONDS)
+ALL_CHALLENGES_KEY = ("challenges", "*")
+
+# Total de puntos de cada usuario sumado de sus shards (modo "sharded")
+points_cache = TTLCache(POINTS_CACHE_MAX_SIZE, POINTS_CACHE_TTL_SECONDS)
+
+# Cantidad de shards del contador de puntos de cada usuario (modo "sharded")
+point_shards_cache = TTLCache(POINT_SHARDS_CACHE_MAX_SIZE, POINT_SHARDS_CACHE_TTL_SECONDS)
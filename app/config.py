@@ -0,0 +1,131 @@
+import os
+
+# Configuración de la aplicación leída de variables de entorno
+
+# Estrategia para calcular el ranking de un usuario:
+#   "index" - índice en memoria (cae a "count" si aún no está cargado)
+#   "count" - consultas de agregación count() en Firestore
+#   "scan"  - lectura completa de la colección ordenada
+RANK_STRATEGY = os.getenv("RANK_STRATEGY", "index")
+
+# Cada cuántos segundos se reconstruye la foto del ranking que sirve los
+# endpoints de top y vecinos
+LEADERBOARD_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL_SECONDS", "30"))
+
+# Antigüedad a partir de la cual la respuesta marca la foto como desactualizada
+LEADERBOARD_SNAPSHOT_MAX_STALENESS_SECONDS = float(
+    os.getenv("LEADERBOARD_SNAPSHOT_MAX_STALENESS_SECONDS", str(2 * LEADERBOARD_SNAPSHOT_INTERVAL_SECONDS))
+)
+
+# Mantener el índice de ranking con listeners on_snapshot sobre 'user_points' y 'users'
+LEADERBOARD_LISTENERS = os.getenv("LEADERBOARD_LISTENERS", "false").lower() in ("1", "true", "yes")
+LEADERBOARD_LISTENER_CHECK_INTERVAL_SECONDS = float(os.getenv("LEADERBOARD_LISTENER_CHECK_INTERVAL_SECONDS", "10"))
+LEADERBOARD_LISTENER_SYNC_TIMEOUT_SECONDS = float(os.getenv("LEADERBOARD_LISTENER_SYNC_TIMEOUT_SECONDS", "30"))
+
+# Caché en memoria del catálogo de challenges. Con TTL 0 se deshabilita
+CHALLENGE_CACHE_TTL_SECONDS = float(os.getenv("CHALLENGE_CACHE_TTL_SECONDS", "60"))
+CHALLENGE_CACHE_MAX_SIZE = int(os.getenv("CHALLENGE_CACHE_MAX_SIZE", "10000"))
+
+# Hilos para el trabajo bloqueante que se delega fuera del event loop (ordenar el ranking, listeners)
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "40"))
+
+# Canal gRPC del cliente de Firestore
+FIRESTORE_KEEPALIVE_TIME_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIME_MS", "30000"))
+FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIMEOUT_MS", "10000"))
+FIRESTORE_MAX_MESSAGE_BYTES = int(os.getenv("FIRESTORE_MAX_MESSAGE_BYTES", str(32 * 1024 * 1024)))
+
+# Usuarios por página en GET /usuarios cuando no se indica 'limit'
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+
+# Retos y recompensas por página en GET /retos y GET /recompensas
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "100"))
+
+# Forma de actualizar el progreso de un reto y los puntos del usuario:
+#   "transaction" - transacción que lee y escribe instancia y puntos
+#   "increment"   - firestore.Increment sin transacción y escritura condicional al completar
+PROGRESS_UPDATE_MODE = os.getenv("PROGRESS_UPDATE_MODE", "transaction")
+PROGRESS_COMPLETION_MAX_ATTEMPTS = int(os.getenv("PROGRESS_COMPLETION_MAX_ATTEMPTS", "5"))
+
+# Cola write-behind del progreso: los eventos se confirman al recibirlos y se
+# aplican en segundo plano al juntar FLUSH_SIZE instancias o cada FLUSH_INTERVAL
+PROGRESS_WRITE_BEHIND = os.getenv("PROGRESS_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+PROGRESS_BUFFER_FLUSH_SIZE = int(os.getenv("PROGRESS_BUFFER_FLUSH_SIZE", "500"))
+PROGRESS_BUFFER_FLUSH_INTERVAL_SECONDS = float(os.getenv("PROGRESS_BUFFER_FLUSH_INTERVAL_SECONDS", "1"))
+
+# Contador de puntos por usuario:
+#   "single"  - un solo documento user_points/{user_id}
+#   "sharded" - los créditos van a un shard al azar en user_points/{user_id}/shards
+POINTS_COUNTER_MODE = os.getenv("POINTS_COUNTER_MODE", "single")
+
+
+def _parse_point_shards(raw: str) -> dict:
+    shards = {}
+    for item in raw.split(","):
+        tier, _, count = item.partition(":")
+        tier, count = tier.strip(), count.strip()
+        if not tier or not count.isdigit() or int(count) < 1:
+            raise ValueError(
+                f"POINT_SHARDS_BY_TIER inválido: {item.strip()!r}. Formato: nivel:cantidad con cantidad >= 1, "
+                f"por ejemplo default:1,power:10"
+            )
+        shards[tier] = int(count)
+    return shards
+
+
+# Shards por nivel del usuario (campo 'tier' de 'users'), como "default:1,power:10"
+POINT_SHARDS_BY_TIER = _parse_point_shards(os.getenv("POINT_SHARDS_BY_TIER", "default:1,power:10"))
+# Cada cuánto se recalcula como máximo el total en el documento padre, y
+# cuánto vive en memoria el total sumado de los shards (0 lo deshabilita)
+POINTS_ROLLUP_INTERVAL_SECONDS = float(os.getenv("POINTS_ROLLUP_INTERVAL_SECONDS", "5"))
+POINTS_CACHE_TTL_SECONDS = float(os.getenv("POINTS_CACHE_TTL_SECONDS", "5"))
+POINTS_CACHE_MAX_SIZE = int(os.getenv("POINTS_CACHE_MAX_SIZE", "100000"))
+# Cuánto se recuerda la cantidad de shards de cada usuario; al vencer se
+# vuelve a leer su nivel y, si subió, se agregan shards
+POINT_SHARDS_CACHE_TTL_SECONDS = float(os.getenv("POINT_SHARDS_CACHE_TTL_SECONDS", "300"))
+POINT_SHARDS_CACHE_MAX_SIZE = int(os.getenv("POINT_SHARDS_CACHE_MAX_SIZE", "100000"))
+
+# Respuestas guardadas por Idempotency-Key en las escrituras que los clientes reintentan:
+#   "firestore" - un documento por llave en 'idempotency_keys', compartido por todos los workers
+#   "memory"    - en la memoria del proceso; solo sirve con un único worker
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "firestore")
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+# Cuánto puede durar una solicitud con la llave reservada; pasado ese tiempo
+# se da por abandonada (el worker se cayó) y otra solicitud puede tomarla
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# Shards del contador de usuarios asignados de cada challenge; los cupos de
+# max_users se reparten entre ellos para no escribir siempre el mismo documento
+CHALLENGE_ASSIGNMENT_SHARDS = int(os.getenv("CHALLENGE_ASSIGNMENT_SHARDS", "10"))
+if not 1 <= CHALLENGE_ASSIGNMENT_SHARDS <= 100:
+    raise ValueError(
+        f"CHALLENGE_ASSIGNMENT_SHARDS inválido: {CHALLENGE_ASSIGNMENT_SHARDS}. Opciones: un entero entre 1 y 100"
+    )
+
+# Desactivar cada challenge al llegar su max_date desde un programador en memoria
+CHALLENGE_EXPIRY_SCHEDULER = os.getenv("CHALLENGE_EXPIRY_SCHEDULER", "true").lower() in ("1", "true", "yes")
+
+# Batches de desactivación de challenges expirados que se confirman a la vez
+EXPIRED_CHALLENGES_COMMIT_CONCURRENCY = int(os.getenv("EXPIRED_CHALLENGES_COMMIT_CONCURRENCY", "4"))
+
+# Contar lecturas, escrituras y RPC de Firestore por solicitud (cabeceras
+# Server-Timing / X-Firestore-* y GET /metricas/firestore)
+FIRESTORE_OP_ACCOUNTING = os.getenv("FIRESTORE_OP_ACCOUNTING", "true").lower() in ("1", "true", "yes")
+
+# Métricas de Prometheus en GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Trazas de OpenTelemetry (opcionales; requieren opentelemetry-sdk)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+# otlp (destino en OTEL_EXPORTER_OTLP_ENDPOINT), file (JSON por línea) o console
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "otlp")
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "traces.jsonl")
+# Fracción de las solicitudes nuevas que se trazan
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.1"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "user-rewards")
+
+# Motor de almacenamiento: "firestore" o "memory" (en memoria, para CI y benchmarks)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+# Latencia simulada de cada RPC del motor en memoria, para comparar en
+# benchmarks cómo se comporta la aplicación esperando a la red
+MEMORY_STORE_LATENCY_MS = float(os.getenv("MEMORY_STORE_LATENCY_MS", "0"))
@@ -0,0 +1,26 @@
+import threading
+from collections import defaultdict
+
+
+class Counters:
+    """Contadores enteros agrupados por nombre, seguros entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(lambda: defaultdict(int))
+
+    def increment(self, group: str, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._values[group][name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {group: dict(values) for group, values in self._values.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+# Reintentos y abortos de las dos formas de actualizar el progreso de un reto
+progress_counters = Counters()
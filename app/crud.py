@@ -1,13 +1,76 @@
+import asyncio
+import bisect
+import random
+import threading
+import time
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import _helpers
 from datetime import datetime
 import pytz
 from fastapi import HTTPException
-
-def get_user_points(user_id: str) -> dict:
-    db = firestore.client()
+from fastapi.concurrency import run_in_threadpool
+from app.cache import ALL_CHALLENGES_KEY, challenge_cache, point_shards_cache, points_cache
+from app.config import (
+    CATALOG_PAGE_SIZE,
+    CHALLENGE_ASSIGNMENT_SHARDS,
+    EXPIRED_CHALLENGES_COMMIT_CONCURRENCY,
+    POINT_SHARDS_BY_TIER,
+    POINTS_COUNTER_MODE,
+    POINTS_ROLLUP_INTERVAL_SECONDS,
+    PROGRESS_COMPLETION_MAX_ATTEMPTS,
+    PROGRESS_UPDATE_MODE,
+    RANK_STRATEGY,
+    USERS_PAGE_SIZE,
+)
+from app.counters import progress_counters
+from app.expiry import deadline_timestamp, expiry_scheduler
+from app.leaderboard import LOCATION_FIELDS, LeaderboardSnapshot, leaderboard_index, location_fields, publish_snapshot
+from app.metrics import metrics
+from app.tracing import traced
+
+# Límite de escrituras por batch de Firestore
+MAX_BATCH_WRITES = 500
+
+
+def _users_query(db, start_after: str = None, limit: int = None):
+    # Orden por ID del documento para que el cursor sea estable
+    query = db.collection("users").order_by("__name__")
+    if start_after:
+        query = query.start_after({"__name__": start_after})
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+@metrics.timed("crud_function_duration_seconds", function="list_users")
+@traced("crud.list_users")
+async def list_users(db, limit: int = USERS_PAGE_SIZE, start_after: str = None) -> dict:
+    """Página de usuarios ordenada por ID.
+
+    'next_cursor' es el ID a enviar como 'start_after' para pedir la página
+    siguiente, o None si ya no hay más usuarios.
+    """
+    docs = await _users_query(db, start_after, limit).get()
+    return {
+        "users": [doc.to_dict() for doc in docs],
+        "count": len(docs),
+        "next_cursor": docs[-1].id if len(docs) == limit else None,
+    }
+
+
+async def iter_users(db, start_after: str = None, limit: int = None):
+    """Recorre los usuarios a medida que llegan de Firestore, sin cargarlos en memoria"""
+    async for doc in _users_query(db, start_after, limit).stream():
+        yield doc.to_dict()
+
+
+@metrics.timed("crud_function_duration_seconds", function="get_user_points")
+@traced("crud.get_user_points")
+async def get_user_points(db, user_id: str) -> dict:
     doc_ref = db.collection("user_points").document(user_id)
-    doc = doc_ref.get()
+    doc = await doc_ref.get()
     
     if not doc.exists:
         raise HTTPException(
@@ -15,21 +78,341 @@ def get_user_points(user_id: str) -> dict:
             detail=f"El usuario con ID {user_id} no tiene registro de puntos"
         )
     
-    return doc.to_dict()
+    points_data = doc.to_dict()
+    if POINTS_COUNTER_MODE == "sharded" and points_data.get("shards"):
+        points_data["points"] = await _cached_point_total(db, user_id)
+    return points_data
+
+# Contadores de puntos distribuidos (POINTS_COUNTER_MODE = "sharded").
+#
+# Cada crédito suma en un shard al azar user_points/{user_id}/shards/{n} y
+# así las escrituras de un mismo usuario se reparten entre varios documentos.
+# El campo 'points' del documento padre queda como acumulado: se recalcula
+# con una agregación sum() como mucho cada POINTS_ROLLUP_INTERVAL_SECONDS y
+# es el que siguen usando las consultas del ranking.
+
+POINTS_COUNTER_MODES = ("single", "sharded")
+
+if POINTS_COUNTER_MODE not in POINTS_COUNTER_MODES:
+    raise ValueError(
+        f"POINTS_COUNTER_MODE inválido: {POINTS_COUNTER_MODE}. Opciones: {', '.join(POINTS_COUNTER_MODES)}"
+    )
+
+_rollup_lock = threading.Lock()
+_last_rollup = {}
+_pending_rollups = set()
+
+
+def _shards_for_tier(tier) -> int:
+    return POINT_SHARDS_BY_TIER.get(tier or "default", POINT_SHARDS_BY_TIER.get("default", 1))
+
+
+async def _point_shards(db, user_id: str) -> int:
+    """Shards del usuario; crea el documento padre o migra el de un solo contador.
+
+    Si el nivel del usuario pide más shards que los guardados se amplía la
+    cantidad: los shards nuevos se crean con el primer crédito y la suma no
+    cambia. Nunca se reduce, para no dejar puntos en shards fuera de rango.
+    """
+    shard_count = point_shards_cache.get(user_id)
+    if shard_count:
+        return shard_count
+
+    user_doc = await db.collection("users").document(user_id).get()
+    user_data = user_doc.to_dict() or {} if user_doc.exists else {}
+    points_ref = db.collection("user_points").document(user_id)
+
+    @firestore.async_transactional
+    async def prepare_shards(transaction):
+        points_doc = await points_ref.get(transaction=transaction)
+        points_data = points_doc.to_dict() if points_doc.exists else None
+        new_count = _shards_for_tier(user_data.get("tier"))
+        if points_data and points_data.get("shards"):
+            if points_data["shards"] >= new_count:
+                return points_data["shards"]
+            transaction.update(points_ref, {"shards": new_count})
+            return new_count
+
+        # Los puntos que ya tenía el documento pasan al shard 0
+        current_points = (points_data or {}).get("points", 0)
+        parent = {"user_id": user_id, "points": current_points, "shards": new_count}
+        if points_data is None:
+            parent["last_updated"] = firestore.SERVER_TIMESTAMP
+            parent.update(location_fields(user_data))
+        transaction.set(points_ref, parent, merge=True)
+        transaction.set(points_ref.collection("shards").document("0"), {"points": current_points})
+        return new_count
+
+    shard_count = await prepare_shards(db.transaction())
+    point_shards_cache.set(user_id, shard_count)
+    return shard_count
+
+
+async def _resolve_point_shards(db, user_ids) -> dict:
+    """Shards de varios usuarios sin una ida y vuelta por cada uno.
+
+    Los que no están en caché se leen juntos con get_all; solo los que no
+    tienen contador distribuido o necesitan más shards pasan por la
+    transacción de _point_shards, y esas transacciones corren a la vez.
+    """
+    counts = {}
+    missing = []
+    for user_id in user_ids:
+        shard_count = point_shards_cache.get(user_id)
+        if shard_count:
+            counts[user_id] = shard_count
+        else:
+            missing.append(user_id)
+    if not missing:
+        return counts
+
+    users, points = await asyncio.gather(
+        _get_documents(db, "users", missing, field_paths=["tier"]),
+        _get_documents(db, "user_points", missing, field_paths=["shards"]),
+    )
+    to_prepare = []
+    for user_id in missing:
+        stored = (points[user_id].to_dict() or {}).get("shards") if user_id in points else None
+        tier = (users[user_id].to_dict() or {}).get("tier") if user_id in users else None
+        if stored and stored >= _shards_for_tier(tier):
+            counts[user_id] = stored
+            point_shards_cache.set(user_id, stored)
+        else:
+            to_prepare.append(user_id)
+    prepared = await asyncio.gather(*(_point_shards(db, user_id) for user_id in to_prepare))
+    counts.update(zip(to_prepare, prepared))
+    return counts
+
+
+async def _sum_point_shards(db, user_id: str) -> int:
+    shards = db.collection("user_points").document(user_id).collection("shards")
+    total = (await shards.sum("points", alias="total").get())[0][0].value
+    return int(total or 0)
+
+
+async def _cached_point_total(db, user_id: str) -> int:
+    total = points_cache.get(user_id)
+    if total is None:
+        total = await _sum_point_shards(db, user_id)
+        points_cache.set(user_id, total)
+    return total
+
+
+async def _rollup_points(db, user_id: str) -> int:
+    """Suma los shards y guarda el total en el documento padre"""
+    total = await _sum_point_shards(db, user_id)
+    points_cache.set(user_id, total)
+    await db.collection("user_points").document(user_id).update({
+        "points": total,
+        "last_updated": firestore.SERVER_TIMESTAMP
+    })
+    return total
+
+
+async def _credit_points_sharded(db, batches: list) -> dict:
+    points_by_user = {}
+    for credits in batches:
+        for user_id, points, _ in credits:
+            points_by_user[user_id] = points_by_user.get(user_id, 0) + points
+    shard_counts = await _resolve_point_shards(db, points_by_user)
+    shard_refs = {
+        user_id: db.collection("user_points").document(user_id)
+                   .collection("shards").document(str(random.randrange(shard_counts[user_id])))
+        for user_id in points_by_user
+    }
+    committed = []
+    try:
+        for credits in batches:
+            batch = db.batch()
+            for user_id, points, marks in credits:
+                batch.set(shard_refs[user_id], {"points": firestore.Increment(points)}, merge=True)
+                _mark_points_credited(db, batch, marks)
+            await batch.commit()
+            committed.extend(user_id for user_id, _, _ in credits)
+    except Exception:
+        # Los créditos ya confirmados llegan al padre y al índice con el próximo rollup
+        with _rollup_lock:
+            _pending_rollups.update(committed)
+        points_cache.invalidate(*committed)
+        raise
+
+    totals = {}
+    due_ids = []
+    uncached_ids = []
+    now = time.monotonic()
+    with _rollup_lock:
+        for user_id, points in points_by_user.items():
+            if now - _last_rollup.get(user_id, float("-inf")) >= POINTS_ROLLUP_INTERVAL_SECONDS:
+                _last_rollup[user_id] = now
+                _pending_rollups.discard(user_id)
+                due_ids.append(user_id)
+                continue
+            _pending_rollups.add(user_id)
+            cached = points_cache.get(user_id)
+            if cached is None:
+                uncached_ids.append(user_id)
+            else:
+                totals[user_id] = cached + points
+                points_cache.set(user_id, totals[user_id])
+
+    # Las sumas de los usuarios que lo necesitan se piden a la vez
+    sums = await asyncio.gather(
+        *(_rollup_points(db, user_id) for user_id in due_ids),
+        *(_cached_point_total(db, user_id) for user_id in uncached_ids),
+    )
+    totals.update(zip(due_ids + uncached_ids, sums))
+    return totals
+
+
+@metrics.timed("crud_function_duration_seconds", function="rollup_pending_points")
+@traced("crud.rollup_pending_points")
+async def rollup_pending_points(db) -> int:
+    """Recalcula el total de los usuarios con créditos que aún no llegaron al documento padre"""
+    with _rollup_lock:
+        now = time.monotonic()
+        user_ids = [
+            user_id for user_id in _pending_rollups
+            if now - _last_rollup.get(user_id, float("-inf")) >= POINTS_ROLLUP_INTERVAL_SECONDS
+        ]
+        for user_id in user_ids:
+            _pending_rollups.discard(user_id)
+            _last_rollup[user_id] = now
+    for user_id in user_ids:
+        leaderboard_index.set_points(user_id, await _rollup_points(db, user_id))
+    return len(user_ids)
+
+
+@metrics.timed("crud_function_duration_seconds", function="init_user_points")
+@traced("crud.init_user_points")
+async def init_user_points(db, user_id: str):
+    user_doc = await db.collection("users").document(user_id).get()
+    user_data = user_doc.to_dict() or {} if user_doc.exists else {}
+    location = location_fields(user_data)
 
-def init_user_points(user_id: str):
-    db = firestore.client()
     doc_ref = db.collection("user_points").document(user_id)
-    doc_ref.set({
+    points_data = {
         "user_id": user_id,
         "points": 0,
-        "last_updated": datetime.datetime.now()
+        "last_updated": datetime.now(),
+        **location
+    }
+    if POINTS_COUNTER_MODE == "sharded":
+        # Reiniciar también los shards que pudiera tener
+        batch = db.batch()
+        async for shard_ref in doc_ref.collection("shards").list_documents():
+            batch.delete(shard_ref)
+        points_data["shards"] = _shards_for_tier(user_data.get("tier"))
+        batch.set(doc_ref, points_data)
+        batch.set(doc_ref.collection("shards").document("0"), {"points": 0})
+        await batch.commit()
+        point_shards_cache.set(user_id, points_data["shards"])
+        points_cache.set(user_id, 0)
+    else:
+        await doc_ref.set(points_data)
+    leaderboard_index.set_points(user_id, 0, location)
+
+
+@metrics.timed("crud_function_duration_seconds", function="sync_user_points_location")
+@traced("crud.sync_user_points_location")
+async def sync_user_points_location(db, user_id: str) -> dict:
+    """Copia la ciudad y el departamento actuales del usuario en 'user_points'"""
+    user_doc = await db.collection("users").document(user_id).get()
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    points_ref = db.collection("user_points").document(user_id)
+    if not (await points_ref.get()).exists:
+        raise HTTPException(
+            status_code=404,
+            detail=f"El usuario con ID {user_id} no tiene registro de puntos"
+        )
+
+    user_data = user_doc.to_dict()
+    location = location_fields(user_data)
+    # Los campos que el usuario ya no tiene se eliminan de 'user_points'
+    await points_ref.update({
+        field: user_data.get(field) or firestore.DELETE_FIELD
+        for field in LOCATION_FIELDS
     })
+    leaderboard_index.set_location(user_id, location)
+    return location
+
+
+@metrics.timed("crud_function_duration_seconds", function="backfill_user_points_location")
+@traced("crud.backfill_user_points_location")
+async def backfill_user_points_location(db, page_size: int = 500) -> dict:
+    """Copia ciudad y departamento en todos los documentos de 'user_points'.
+
+    Recorre la colección por páginas con cursor y escribe un batch por página
+    solo con los documentos cuya ubicación no coincide con la del usuario.
+    """
+    points_query = db.collection("user_points") \
+        .order_by("__name__") \
+        .select(list(LOCATION_FIELDS)) \
+        .limit(page_size)
+
+    scanned = 0
+    updated = 0
+    last_doc = None
+    while True:
+        page_query = points_query.start_after(last_doc) if last_doc else points_query
+        page = await page_query.get()
+        if not page:
+            break
+
+        user_refs = [db.collection("users").document(doc.id) for doc in page]
+        users = {
+            doc.id: doc.to_dict()
+            async for doc in db.get_all(user_refs, field_paths=list(LOCATION_FIELDS))
+            if doc.exists
+        }
+
+        batch = db.batch()
+        pending = 0
+        for points_doc in page:
+            if points_doc.id not in users:
+                continue
+            location = location_fields(users[points_doc.id])
+            if location_fields(points_doc.to_dict() or {}) == location:
+                continue
+            batch.update(points_doc.reference, {
+                field: location.get(field, firestore.DELETE_FIELD)
+                for field in LOCATION_FIELDS
+            })
+            leaderboard_index.set_location(points_doc.id, location)
+            pending += 1
+        if pending:
+            await batch.commit()
 
+        scanned += len(page)
+        updated += pending
+        last_doc = page[-1]
 
-def create_challenge(challenge_data: dict) -> dict:
-    db = firestore.client()
-    
+    return {"scanned": scanned, "updated": updated}
+
+
+async def _get_challenge(db, challenge_id: str):
+    """Datos del challenge desde la caché o Firestore; None si no existe"""
+    challenge_data = challenge_cache.get(challenge_id)
+    if challenge_data is not None:
+        return challenge_data
+
+    challenge_doc = await db.collection("challenges").document(challenge_id).get()
+    if not challenge_doc.exists:
+        return None
+    challenge_data = challenge_doc.to_dict()
+    challenge_cache.set(challenge_id, challenge_data)
+    return challenge_data
+
+
+def _invalidate_challenges(*challenge_ids: str) -> None:
+    # Toda escritura en 'challenges' invalida también el catálogo completo
+    challenge_cache.invalidate(ALL_CHALLENGES_KEY, *challenge_ids)
+
+
+@metrics.timed("crud_function_duration_seconds", function="create_challenge")
+@traced("crud.create_challenge")
+async def create_challenge(db, challenge_data: dict) -> dict:
     # Validar que el reward_id exista (implementación opcional)
     # if not reward_exists(challenge_data["reward_id"]):
     #     raise HTTPException(status_code=400, detail="El reward_id no existe")
@@ -51,11 +434,23 @@ def create_challenge(challenge_data: dict) -> dict:
     firestore_data.update({
         "challenge_id": challenge_id,
         "date_creation": firestore.SERVER_TIMESTAMP,
-        "status": challenge_data.get("status", "active")
+        "status": challenge_data.get("status", "active"),
+        # Usuarios asignados antes de los shards de asignación
+        "assigned_count": 0
     })
+    capacities = _assignment_shard_capacities(challenge_data.get("max_users"), 0)
+    firestore_data["assignment_shards"] = len(capacities)
     
     try:
-        challenge_ref.set(firestore_data)
+        # El challenge y sus shards de asignación se crean juntos
+        batch = db.batch()
+        batch.set(challenge_ref, firestore_data)
+        for number, capacity in enumerate(capacities):
+            batch.set(_assignment_shard_ref(challenge_ref, number), {"assigned": 0, "capacity": capacity})
+        await batch.commit()
+        _invalidate_challenges(challenge_id)
+        if firestore_data["status"] == "active":
+            expiry_scheduler.schedule(challenge_id, challenge_data.get("max_date"))
 
         response_data = challenge_data.copy()
         response_data.update({
@@ -72,61 +467,308 @@ def create_challenge(challenge_data: dict) -> dict:
             detail=f"Error al crear challenge: {str(e)}"
         )
 
-def reward_exists(reward_id: str) -> bool:
+@metrics.timed("crud_function_duration_seconds", function="reward_exists")
+@traced("crud.reward_exists")
+async def reward_exists(db, reward_id: str) -> bool:
     """Validar que el reward exista en otra colección"""
-    db = firestore.client()
     # reward_ref = db.collection("rewards").document(reward_id).get()
     # return reward_ref.exists
     return True  # Implementación temporal
 
 # traer todos los challenges
 
-def get_all_challenges() -> list:
-    db = firestore.client()
+async def _challenge_catalog(db) -> list:
+    """Pares (ID del documento, datos) de todos los challenges, en el orden de Firestore"""
+    # Con la caché caliente el catálogo se responde sin leer Firestore
+    catalog = challenge_cache.get(ALL_CHALLENGES_KEY)
+    if catalog is not None:
+        return catalog
+
+    catalog = []
+    async for doc in db.collection("challenges").stream():
+        challenge_data = doc.to_dict()
+        challenge_cache.set(doc.id, challenge_data)
+        catalog.append((doc.id, challenge_data))
+    challenge_cache.set(ALL_CHALLENGES_KEY, catalog)
+    return catalog
+
+
+@metrics.timed("crud_function_duration_seconds", function="get_all_challenges")
+@traced("crud.get_all_challenges")
+async def get_all_challenges(db) -> list:
     try:
-        challenges_ref = db.collection("challenges").stream()
-        return [doc.to_dict() for doc in challenges_ref]
+        return [challenge_data for _, challenge_data in await _challenge_catalog(db)]
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al obtener challenges: {str(e)}"
         )
 
-def disable_expired_challenges() -> dict:
-    db = firestore.client()
-    now = datetime.now(pytz.utc)
-    
-    # Query for active challenges where max_date has passed
-    expired_challenges_query = db.collection("challenges") \
-        .where("status", "==", "active") \
-        .where("max_date", "<", now)
-        
-    challenges_to_disable = list(expired_challenges_query.stream())
-    
-    if not challenges_to_disable:
-        return {"disabled_count": 0, "message": "No hay challenges expirados para desactivar."}
-        
-    # Use a batch to update all expired challenges at once
-    batch = db.batch()
-    for challenge_doc in challenges_to_disable:
-        batch.update(challenge_doc.reference, {"status": "disabled"})
-        
+# Campos que se pueden pedir con 'fields' en los listados
+CHALLENGE_FIELDS = (
+    "challenge_id", "name", "description", "max_limit", "reward_id",
+    "max_users", "status", "max_date", "date_creation", "puntos",
+)
+REWARD_FIELDS = ("reward_id", "type", "value", "metadata", "created_at")
+
+
+def _projection(fields, allowed: tuple, id_field: str):
+    """Campos para select(), siempre con el ID; None si se piden todos"""
+    if not fields:
+        return None
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no válidos: {', '.join(unknown)}. Opciones: {', '.join(allowed)}"
+        )
+    return [id_field] + [field for field in dict.fromkeys(fields) if field != id_field]
+
+
+def _page(docs: list, limit: int) -> dict:
+    return {
+        "items": [doc.to_dict() for doc in docs],
+        "next_cursor": docs[-1].id if len(docs) == limit else None,
+    }
+
+
+@metrics.timed("crud_function_duration_seconds", function="list_challenges")
+@traced("crud.list_challenges")
+async def list_challenges(
+    db,
+    limit: int = CATALOG_PAGE_SIZE,
+    start_after: str = None,
+    status: str = None,
+    reward_id: str = None,
+    max_date_from: datetime = None,
+    max_date_to: datetime = None,
+    fields: list = None,
+) -> dict:
+    """Página de challenges con los filtros resueltos en Firestore.
+
+    Sin filtros ni proyección la página se corta del catálogo en caché. Con
+    rango de 'max_date' el orden es (max_date, ID), así que el cursor se
+    completa con la fecha del último challenge, que suele estar en caché.
+    """
+    projection = _projection(fields, CHALLENGE_FIELDS, "challenge_id")
+    has_filters = status or reward_id or max_date_from or max_date_to
+
+    if not has_filters and projection is None:
+        # El catálogo viene ordenado por nombre de documento, igual que el
+        # cursor '__name__' de las consultas con filtros
+        try:
+            catalog = await _challenge_catalog(db)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al obtener challenges: {str(e)}"
+            )
+        start = 0
+        if start_after:
+            start = bisect.bisect_right([doc_id for doc_id, _ in catalog], start_after)
+        page = catalog[start:start + limit]
+        return {
+            "items": [challenge_data for _, challenge_data in page],
+            "next_cursor": page[-1][0] if len(page) == limit else None,
+        }
+
+    query = db.collection("challenges")
+    if status:
+        query = query.where("status", "==", status)
+    if reward_id:
+        query = query.where("reward_id", "==", reward_id)
+    if max_date_from:
+        query = query.where("max_date", ">=", max_date_from)
+    if max_date_to:
+        query = query.where("max_date", "<=", max_date_to)
+
+    by_date = bool(max_date_from or max_date_to)
+    if by_date:
+        query = query.order_by("max_date")
+    query = query.order_by("__name__")
+
+    if start_after:
+        cursor = {"__name__": start_after}
+        if by_date:
+            last_challenge = await _get_challenge(db, start_after)
+            if last_challenge is None:
+                raise HTTPException(status_code=400, detail="Cursor 'start_after' inválido")
+            cursor = {"max_date": last_challenge.get("max_date"), "__name__": start_after}
+        query = query.start_after(cursor)
+
+    if projection is not None:
+        query = query.select(projection)
+
     try:
-        batch.commit()
-        disabled_count = len(challenges_to_disable)
-        return {"disabled_count": disabled_count, "message": f"{disabled_count} challenge(s) han sido desactivados."}
+        return _page(await query.limit(limit).get(), limit)
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error al desactivar challenges expirados: {str(e)}"
+            detail=f"Error al obtener challenges: {str(e)}"
         )
 
-def disable_challenge(challenge_id: str) -> dict:
-    db = firestore.client()
+
+async def _commit_expired_chunk(db, number: int, docs: list) -> dict:
+    started = time.monotonic()
+    report = {
+        "chunk": number,
+        "size": len(docs),
+        "first_id": docs[0].id,
+        "last_id": docs[-1].id,
+        "seconds": None,
+        "error": None,
+    }
+    batch = db.batch()
+    for doc in docs:
+        batch.update(doc.reference, {"status": "disabled"})
+    try:
+        await batch.commit()
+    except Exception as e:
+        report["error"] = str(e)
+    else:
+        challenge_ids = [doc.id for doc in docs]
+        _invalidate_challenges(*challenge_ids)
+        for challenge_id in challenge_ids:
+            expiry_scheduler.unschedule(challenge_id)
+    report["seconds"] = round(time.monotonic() - started, 4)
+    return report
+
+
+@metrics.timed("crud_function_duration_seconds", function="disable_expired_challenges")
+@traced("crud.disable_expired_challenges")
+async def disable_expired_challenges(db, chunk_size: int = MAX_BATCH_WRITES,
+                               concurrency: int = EXPIRED_CHALLENGES_COMMIT_CONCURRENCY) -> dict:
+    """Desactiva los challenges activos con max_date vencida.
+
+    La consulta se recorre por páginas de `chunk_size` (máximo 500, el
+    límite de un batch) con cursor, y cada página se confirma en su propio
+    batch con hasta `concurrency` batches en vuelo. Un batch fallido no
+    detiene a los demás; sus challenges siguen activos, así que volver a
+    llamar la función retoma solo lo que faltó.
+    """
+    now = datetime.now(pytz.utc)
+    chunk_size = max(1, min(chunk_size, MAX_BATCH_WRITES))
+
+    expired_challenges_query = db.collection("challenges") \
+        .where("status", "==", "active") \
+        .where("max_date", "<", now) \
+        .order_by("max_date") \
+        .select(["max_date"]) \
+        .limit(chunk_size)
+
+    reports = []
+    started = time.monotonic()
+    concurrency = max(1, concurrency)
+    pending = set()
+    last_doc = None
+    number = 0
+    try:
+        while True:
+            page_query = expired_challenges_query
+            if last_doc is not None:
+                page_query = page_query.start_after(last_doc)
+            docs = await page_query.get()
+            if not docs:
+                break
+
+            number += 1
+            # La tarea copia el contexto, así que cada batch se cuenta en la
+            # solicitud que pidió la desactivación
+            pending.add(asyncio.create_task(_commit_expired_chunk(db, number, docs)))
+            last_doc = docs[-1]
+            if len(docs) < chunk_size:
+                break
+
+            # No se leen más páginas mientras todos los batches estén ocupados
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                reports.extend(task.result() for task in done)
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            reports.extend(task.result() for task in done)
+    finally:
+        # Si la solicitud se cancela o falla una lectura, los batches en vuelo se cancelan
+        for task in pending:
+            task.cancel()
+
+    reports.sort(key=lambda report: report["chunk"])
+    disabled_count = sum(report["size"] for report in reports if report["error"] is None)
+    failed_count = sum(report["size"] for report in reports if report["error"] is not None)
+    elapsed = round(time.monotonic() - started, 4)
+
+    if not reports:
+        message = "No hay challenges expirados para desactivar."
+    elif failed_count:
+        message = (
+            f"{disabled_count} challenge(s) han sido desactivados; {failed_count} fallaron "
+            "y se pueden reintentar volviendo a llamar el endpoint."
+        )
+    else:
+        message = f"{disabled_count} challenge(s) han sido desactivados."
+    return {
+        "disabled_count": disabled_count,
+        "failed_count": failed_count,
+        "seconds": elapsed,
+        "chunks": reports,
+        "message": message,
+    }
+
+def _is_past_deadline(challenge_data: dict) -> bool:
+    # El programador los desactiva a tiempo, pero hasta que lo haga (o si
+    # está apagado) el progreso de un challenge vencido se rechaza igual
+    deadline = deadline_timestamp(challenge_data.get("max_date"))
+    return deadline is not None and deadline <= time.time()
+
+
+async def active_challenge_deadlines(db):
+    """Pares (challenge_id, max_date) de los challenges activos con fecha límite"""
+    active_query = db.collection("challenges") \
+        .where("status", "==", "active") \
+        .select(["max_date"])
+    async for doc in active_query.stream():
+        max_date = (doc.to_dict() or {}).get("max_date")
+        if max_date is not None:
+            yield doc.id, max_date
+
+
+@metrics.timed("crud_function_duration_seconds", function="expire_challenges")
+@traced("crud.expire_challenges")
+async def expire_challenges(db, challenge_ids) -> list:
+    """Desactiva los challenges indicados que sigan activos y ya vencieron.
+
+    Se releen antes de escribir porque pudieron reactivarse o cambiar de
+    fecha después de programarse; los activos con una fecha posterior se
+    vuelven a programar. Devuelve los IDs desactivados.
+    """
+    challenge_docs = await _get_documents(db, "challenges", challenge_ids, field_paths=["status", "max_date"])
+    expired = []
+    for doc in challenge_docs.values():
+        challenge_data = doc.to_dict() or {}
+        if challenge_data.get("status") != "active":
+            continue
+        if _is_past_deadline(challenge_data):
+            expired.append(doc)
+        else:
+            # Otra instancia o una edición directa movió la fecha sin reprogramarla aquí
+            expiry_scheduler.schedule(doc.id, challenge_data.get("max_date"))
+    for start in range(0, len(expired), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for doc in expired[start:start + MAX_BATCH_WRITES]:
+            batch.update(doc.reference, {"status": "disabled"}, option=db.write_option(last_update_time=doc.update_time))
+        await batch.commit()
+    disabled_ids = [doc.id for doc in expired]
+    if disabled_ids:
+        _invalidate_challenges(*disabled_ids)
+    return disabled_ids
+
+
+@metrics.timed("crud_function_duration_seconds", function="disable_challenge")
+@traced("crud.disable_challenge")
+async def disable_challenge(db, challenge_id: str) -> dict:
     challenge_ref = db.collection("challenges").document(challenge_id)
 
     # Verificar que el challenge existe
-    challenge_doc = challenge_ref.get()
+    challenge_doc = await challenge_ref.get()
     if not challenge_doc.exists:
         raise HTTPException(status_code=404, detail="Challenge no encontrado")
 
@@ -135,7 +777,9 @@ def disable_challenge(challenge_id: str) -> dict:
         raise HTTPException(status_code=400, detail="El challenge ya se estaba desactivado")
 
     try:
-        challenge_ref.update({"status": "disabled"})
+        await challenge_ref.update({"status": "disabled"})
+        _invalidate_challenges(challenge_id)
+        expiry_scheduler.unschedule(challenge_id)
         return {"message": "Challenge desactivado exitosamente"}
     except Exception as e:
         raise HTTPException(
@@ -143,12 +787,13 @@ def disable_challenge(challenge_id: str) -> dict:
             detail=f"Error al desactivar el challenge: {str(e)}"
         )
 
-def reactivate_challenge(challenge_id: str) -> dict:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="reactivate_challenge")
+@traced("crud.reactivate_challenge")
+async def reactivate_challenge(db, challenge_id: str) -> dict:
     challenge_ref = db.collection("challenges").document(challenge_id)
 
     # Verificar que el challenge existe
-    challenge_doc = challenge_ref.get()
+    challenge_doc = await challenge_ref.get()
     if not challenge_doc.exists:
         raise HTTPException(status_code=404, detail="Challenge no encontrado")
 
@@ -157,7 +802,9 @@ def reactivate_challenge(challenge_id: str) -> dict:
         raise HTTPException(status_code=400, detail="El challenge ya se estaba activo")
 
     try:
-        challenge_ref.update({"status": "active"})
+        await challenge_ref.update({"status": "active"})
+        _invalidate_challenges(challenge_id)
+        expiry_scheduler.schedule(challenge_id, challenge_data.get("max_date"))
         return {"message": "Challenge reactivado exitosamente"}
     except Exception as e:
         raise HTTPException(
@@ -168,8 +815,9 @@ def reactivate_challenge(challenge_id: str) -> dict:
 
 # Crear Recompensas 
 
-def create_reward(reward_data: dict) -> dict:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="create_reward")
+@traced("crud.create_reward")
+async def create_reward(db, reward_data: dict) -> dict:
     reward_ref = db.collection("rewards").document()
     reward_id = reward_ref.id
     
@@ -180,7 +828,7 @@ def create_reward(reward_data: dict) -> dict:
     })
     
     try:
-        reward_ref.set(firestore_data)
+        await reward_ref.set(firestore_data)
 
         response_data = reward_data.copy()
         response_data["reward_id"] = reward_id
@@ -197,11 +845,12 @@ def create_reward(reward_data: dict) -> dict:
 
 # Obtener las listas de Recompensas
 
-def get_all_rewards() -> list:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="get_all_rewards")
+@traced("crud.get_all_rewards")
+async def get_all_rewards(db) -> list:
     try:
         rewards_ref = db.collection("rewards").stream()
-        return [doc.to_dict() for doc in rewards_ref]
+        return [doc.to_dict() async for doc in rewards_ref]
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -209,23 +858,141 @@ def get_all_rewards() -> list:
         )
 
 
+@metrics.timed("crud_function_duration_seconds", function="list_rewards")
+@traced("crud.list_rewards")
+async def list_rewards(
+    db,
+    limit: int = CATALOG_PAGE_SIZE,
+    start_after: str = None,
+    reward_type: str = None,
+    fields: list = None,
+) -> dict:
+    """Página de recompensas ordenada por ID, filtrada por tipo en Firestore.
+
+    Con limit=None se devuelven todas en una sola consulta.
+    """
+    projection = _projection(fields, REWARD_FIELDS, "reward_id")
+
+    query = db.collection("rewards")
+    if reward_type:
+        query = query.where("type", "==", reward_type)
+    query = query.order_by("__name__")
+    if start_after:
+        query = query.start_after({"__name__": start_after})
+    if projection is not None:
+        query = query.select(projection)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    try:
+        return _page(await query.get(), limit)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al obtener recompensas: {str(e)}"
+        )
+
+
+# Contador de asignaciones distribuido
+#
+# Cada asignación suma en un shard challenges/{id}/assignment_shards/{n} y no
+# en el documento del challenge, que Firestore solo sostiene a alrededor de
+# una escritura por segundo. Con max_users, los cupos que quedaban al crear
+# los shards se reparten entre ellos ('capacity') y ningún shard pasa del
+# suyo, así que la suma tampoco pasa de max_users. 'assigned_count' del
+# challenge queda como la base asignada antes de los shards.
+
+def _assignment_shard_ref(challenge_ref, number: int):
+    return challenge_ref.collection("assignment_shards").document(str(number))
+
+
+def _assignment_shard_capacities(max_users, assigned: int, shard_count: int = None) -> list:
+    """Reparte los cupos que quedan de max_users entre los shards (None sin límite)"""
+    if shard_count is None:
+        shard_count = CHALLENGE_ASSIGNMENT_SHARDS
+        if max_users is not None:
+            # No hacen falta más shards que cupos
+            shard_count = max(1, min(shard_count, max_users - assigned))
+    if max_users is None:
+        return [None] * shard_count
+    remaining = max(0, max_users - assigned)
+    return [remaining // shard_count + (1 if number < remaining % shard_count else 0) for number in range(shard_count)]
+
+
+async def _assignment_shards(db, challenge_ref, challenge_data: dict) -> int:
+    """Shards de asignación del challenge; crea los de los challenges anteriores a ellos.
+
+    Devuelve 0 si el challenge ya no existe.
+    """
+    if challenge_data.get("assignment_shards"):
+        return challenge_data["assignment_shards"]
+
+    @firestore.async_transactional
+    async def prepare_shards(transaction):
+        challenge_doc = await challenge_ref.get(transaction=transaction)
+        if not challenge_doc.exists:
+            return 0
+        current = challenge_doc.to_dict()
+        if current.get("assignment_shards"):
+            return current["assignment_shards"]
+        capacities = _assignment_shard_capacities(current.get("max_users"), current.get("assigned_count", 0))
+        for number, capacity in enumerate(capacities):
+            transaction.set(_assignment_shard_ref(challenge_ref, number), {"assigned": 0, "capacity": capacity})
+        transaction.update(challenge_ref, {"assignment_shards": len(capacities)})
+        return len(capacities)
+
+    shard_count = await prepare_shards(db.transaction())
+    _invalidate_challenges(challenge_ref.id)
+    return shard_count
+
+
+async def _take_assignment_slots(db, transaction, challenge_ref, shard_count: int, wanted: int) -> int:
+    """Toma hasta `wanted` cupos de los shards dentro de la transacción y devuelve cuántos.
+
+    Empieza por un shard al azar para repartir las escrituras. Una asignación
+    suelta lee solo ese shard y los demás únicamente si está lleno; un bloque
+    los lee todos con un get_all.
+    """
+    start = random.randrange(shard_count)
+    refs = [_assignment_shard_ref(challenge_ref, (start + offset) % shard_count) for offset in range(shard_count)]
+    groups = [refs[:1], refs[1:]] if wanted == 1 else [refs]
+    updates = []
+    taken = 0
+    for group in groups:
+        if taken == wanted or not group:
+            break
+        async for shard in db.get_all(group, transaction=transaction):
+            if not shard.exists or taken == wanted:
+                continue
+            shard_data = shard.to_dict()
+            assigned, capacity = shard_data.get("assigned", 0), shard_data.get("capacity")
+            take = wanted - taken if capacity is None else max(0, min(wanted - taken, capacity - assigned))
+            if take:
+                updates.append((shard.reference, assigned + take))
+                taken += take
+
+    # Las escrituras van después de todas las lecturas de la transacción
+    for shard_ref, assigned in updates:
+        transaction.update(shard_ref, {"assigned": assigned})
+    return taken
+
+
 # Crear Instancias de Challenge 
 
-def assign_challenge_to_user(instance_data: dict) -> dict:
-    db = firestore.client()
-    
+@metrics.timed("crud_function_duration_seconds", function="assign_challenge_to_user")
+@traced("crud.assign_challenge_to_user")
+async def assign_challenge_to_user(db, instance_data: dict) -> dict:
     # Verificar que el usuario existe
-    user_ref = db.collection("users").document(instance_data["user_id"]).get()
+    user_ref = await db.collection("users").document(instance_data["user_id"]).get()
     if not user_ref.exists:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     # Verificar que el challenge existe
-    challenge_doc = db.collection("challenges").document(instance_data["challenge_id"]).get()
-    if not challenge_doc.exists:
+    challenge_data = await _get_challenge(db, instance_data["challenge_id"])
+    if challenge_data is None:
         raise HTTPException(status_code=404, detail="Challenge no encontrado")
     
-    challenge_data = challenge_doc.to_dict()
-    
     # Verificar que el challenge esté activo
     if challenge_data.get("status") != "active":
         raise HTTPException(status_code=400, detail="El challenge no se encuentra activo")
@@ -246,57 +1013,282 @@ def assign_challenge_to_user(instance_data: dict) -> dict:
         "date_started": now  # Usamos datetime.now() para la respuesta
     })
     
+    # Aquí usamos SERVER_TIMESTAMP para Firestore
+    firestore_data = instance_data.copy()
+    firestore_data["date_started"] = firestore.SERVER_TIMESTAMP
+    challenge_ref = db.collection("challenges").document(instance_data["challenge_id"])
+
+    # El cupo se toma de un shard de asignación en la misma transacción que
+    # crea la instancia; el documento del challenge solo se lee
+    @firestore.async_transactional
+    async def assign_in_transaction(transaction, shard_count):
+        challenge_doc = await challenge_ref.get(transaction=transaction)
+        if not challenge_doc.exists:
+            return {'error': 404, 'message': 'Challenge no encontrado'}
+        current = challenge_doc.to_dict()
+        if current.get("status") != "active":
+            return {'error': 400, 'message': 'El challenge no se encuentra activo'}
+
+        if not await _take_assignment_slots(db, transaction, challenge_ref, shard_count, 1):
+            return {'error': 409, 'message': 'El challenge alcanzó el máximo de usuarios'}
+
+        transaction.set(instance_ref, firestore_data)
+        return {}
+
     try:
-        # Aquí usamos SERVER_TIMESTAMP para Firestore
-        firestore_data = instance_data.copy()
-        firestore_data["date_started"] = firestore.SERVER_TIMESTAMP
-        instance_ref.set(firestore_data)
-        
-        return instance_data  # Devuelve los datos con datetime.now()
+        shard_count = await _assignment_shards(db, challenge_ref, challenge_data)
+        if not shard_count:
+            raise HTTPException(status_code=404, detail="Challenge no encontrado")
+        result = await assign_in_transaction(db.transaction(), shard_count)
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al asignar challenge: {str(e)}"
         )
+    if 'error' in result:
+        raise HTTPException(status_code=result['error'], detail=result['message'])
+
+    return instance_data  # Devuelve los datos con datetime.now()
+
+
+async def assign_challenge_to_users(db, challenge_id: str, user_ids=None, user_filters: dict = None):
+    """Asigna un challenge a muchos usuarios y devuelve un generador asíncrono de avance.
+
+    Los usuarios llegan como lista de IDs (se verifican con get_all en lotes)
+    o como filtros de igualdad sobre 'users' (p. ej. {"city": "Cali"}). El
+    challenge se valida una sola vez antes de empezar; luego cada bloque se
+    crea en una transacción que también toma sus cupos de los shards de
+    asignación, así que max_users se respeta aunque haya asignaciones
+    simultáneas. Un bloque tiene tantos usuarios como quepan en un commit de
+    500 escrituras junto con la de cada shard. Cada elemento del generador
+    resume un bloque y el último trae los totales.
+    """
+    challenge_data = await _get_challenge(db, challenge_id)
+    if challenge_data is None:
+        raise HTTPException(status_code=404, detail="Challenge no encontrado")
+    if challenge_data.get("status") != "active":
+        raise HTTPException(status_code=400, detail="El challenge no se encuentra activo")
+
+    challenge_ref = db.collection("challenges").document(challenge_id)
+    shard_count = await _assignment_shards(db, challenge_ref, challenge_data)
+    if not shard_count:
+        raise HTTPException(status_code=404, detail="Challenge no encontrado")
+    return _assign_in_chunks(
+        db, challenge_id, challenge_data.get("max_limit", 0), shard_count, user_ids, user_filters
+    )
+
+
+async def _user_id_chunks(db, user_ids, user_filters, chunk_size: int):
+    # Devuelve (usuarios existentes, usuarios inexistentes) por bloque
+    if user_ids is not None:
+        user_ids = list(dict.fromkeys(user_ids))
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            existing = await _get_documents(db, "users", chunk, field_paths=["user_id"])
+            yield [user_id for user_id in chunk if user_id in existing], len(chunk) - len(existing)
+        return
+
+    query = db.collection("users")
+    for field, value in (user_filters or {}).items():
+        query = query.where(field, "==", value)
+    chunk = []
+    async for doc in query.select(["user_id"]).stream():
+        chunk.append(doc.id)
+        if len(chunk) == chunk_size:
+            yield chunk, 0
+            chunk = []
+    if chunk:
+        yield chunk, 0
+
+
+async def _assign_in_chunks(db, challenge_id: str, max_limit: int, shard_count: int, user_ids, user_filters):
+    challenge_ref = db.collection("challenges").document(challenge_id)
+    instances = db.collection("challenge_instances")
+    started = time.monotonic()
+    totals = {"requested": 0, "created": 0, "missing_users": 0, "over_capacity": 0}
+
+    @firestore.async_transactional
+    async def create_chunk(transaction, chunk):
+        challenge_doc = await challenge_ref.get(transaction=transaction)
+        current = challenge_doc.to_dict() if challenge_doc.exists else {}
+        if current.get("status") != "active":
+            return None
+        available = await _take_assignment_slots(db, transaction, challenge_ref, shard_count, len(chunk))
+        for user_id in chunk[:available]:
+            instance_ref = instances.document()
+            transaction.set(instance_ref, {
+                "user_id": user_id,
+                "challenge_id": challenge_id,
+                "instance_id": instance_ref.id,
+                "progress": max_limit,
+                "completed": False,
+                "date_started": firestore.SERVER_TIMESTAMP
+            })
+        return available
+
+    # Cada shard puede sumar una escritura al commit del bloque
+    chunks = _user_id_chunks(db, user_ids, user_filters, MAX_BATCH_WRITES - shard_count)
+    chunk_number = 0
+    while True:
+        # La respuesta ya empezó a enviarse: los errores se informan en una línea
+        try:
+            chunk, missing = await anext(chunks)
+            chunk_number += 1
+            created = await create_chunk(db.transaction(), chunk) if chunk else 0
+        except StopAsyncIteration:
+            break
+        except Exception as e:
+            yield {"error": f"Error al asignar challenge: {str(e)}", **totals}
+            return
+
+        totals["requested"] += len(chunk) + missing
+        totals["missing_users"] += missing
+        if created is None:
+            yield {"error": "El challenge dejó de estar activo durante la asignación", **totals}
+            return
+        totals["created"] += created
+        totals["over_capacity"] += len(chunk) - created
+        yield {
+            "chunk": chunk_number,
+            **totals,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }
+
+    yield {"done": True, **totals, "elapsed_seconds": round(time.monotonic() - started, 3)}
+
+
+@metrics.timed("crud_function_duration_seconds", function="backfill_challenge_assigned_counts")
+@traced("crud.backfill_challenge_assigned_counts")
+async def backfill_challenge_assigned_counts(db) -> dict:
+    """Calcula 'assigned_count' de los challenges creados antes del contador.
+
+    Cuenta las instancias de cada challenge con una agregación count(), así
+    que cuesta una lectura por cada 1000 instancias. En los challenges con
+    shards de asignación 'assigned_count' es la base que los shards no
+    cuentan; si cambia, los cupos que quedan se reparten de nuevo entre ellos.
+    """
+    updated = 0
+    challenge_docs = await db.collection("challenges").select(
+        ["assigned_count", "assignment_shards", "max_users"]
+    ).get()
+    for challenge_doc in challenge_docs:
+        current = challenge_doc.to_dict() or {}
+        assigned_count = await _count(
+            db.collection("challenge_instances").where("challenge_id", "==", challenge_doc.id)
+        )
+        if not current.get("assignment_shards"):
+            if current.get("assigned_count") != assigned_count:
+                await challenge_doc.reference.update({"assigned_count": assigned_count})
+                updated += 1
+            continue
+
+        shard_docs = await challenge_doc.reference.collection("assignment_shards").get()
+        shard_assigned = {int(doc.id): (doc.to_dict() or {}).get("assigned", 0) for doc in shard_docs}
+        base = assigned_count - sum(shard_assigned.values())
+        if current.get("assigned_count") == base:
+            continue
+        batch = db.batch()
+        batch.update(challenge_doc.reference, {"assigned_count": base})
+        if current.get("max_users") is not None:
+            shard_count = current["assignment_shards"]
+            capacities = _assignment_shard_capacities(current["max_users"], assigned_count, shard_count)
+            for number, capacity in enumerate(capacities):
+                batch.set(
+                    _assignment_shard_ref(challenge_doc.reference, number),
+                    {"capacity": shard_assigned.get(number, 0) + capacity},
+                    merge=True,
+                )
+        await batch.commit()
+        updated += 1
+    _invalidate_challenges(*(doc.id for doc in challenge_docs))
+    return {"scanned": len(challenge_docs), "updated": updated}
+
+
+# Documentos por llamada a get_all
+GET_ALL_CHUNK_SIZE = 100
+
+
+async def _get_challenges_by_ids(db, challenge_ids) -> tuple:
+    """Lee los challenges indicados desde la caché y los faltantes con get_all en lotes.
+
+    Devuelve un diccionario {challenge_id: datos} con los que existen y la
+    cantidad de llamadas hechas a Firestore.
+    """
+    challenges = {}
+    missing_ids = []
+    for challenge_id in dict.fromkeys(challenge_ids):
+        challenge_data = challenge_cache.get(challenge_id)
+        if challenge_data is None:
+            missing_ids.append(challenge_id)
+        else:
+            challenges[challenge_id] = challenge_data
+
+    round_trips = 0
+    for start in range(0, len(missing_ids), GET_ALL_CHUNK_SIZE):
+        refs = [
+            db.collection("challenges").document(challenge_id)
+            for challenge_id in missing_ids[start:start + GET_ALL_CHUNK_SIZE]
+        ]
+        round_trips += 1
+        async for doc in db.get_all(refs):
+            if doc.exists:
+                challenges[doc.id] = doc.to_dict()
+                challenge_cache.set(doc.id, challenges[doc.id])
+    return challenges, round_trips
+
+
+async def _get_user_challenges(db, user_id: str, completed: bool) -> dict:
+    # Verificar que el usuario existe
+    user_doc = await db.collection("users").document(user_id).get()
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    instances = [
+        (instance.id, instance.to_dict())
+        async for instance in db.collection("challenge_instances")
+            .where("user_id", "==", user_id)
+            .where("completed", "==", completed)
+            .stream()
+    ]
+
+    # Obtener los detalles de todos los challenges en lotes y unirlos en memoria
+    challenges_by_id, round_trips = await _get_challenges_by_ids(
+        db, [instance_data["challenge_id"] for _, instance_data in instances]
+    )
+
+    challenges = []
+    for instance_id, instance_data in instances:
+        challenge_data = challenges_by_id.get(instance_data["challenge_id"])
+        if challenge_data is None:
+            continue
+        # Los retos pendientes solo se muestran si el challenge sigue activo
+        if not completed and challenge_data.get("status") != "active":
+            continue
+        challenges.append({
+            "instance_id": instance_id,
+            **instance_data,
+            **challenge_data
+        })
+
+    return {
+        "challenges": challenges,
+        # Antes se hacía una lectura por instancia
+        "round_trips_saved": max(0, len(instances) - round_trips)
+    }
 
 
 # Challenge Instances por usuario
 
-def get_user_assigned_challenges(user_id: str) -> list:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="get_user_assigned_challenges")
+@traced("crud.get_user_assigned_challenges")
+async def get_user_assigned_challenges(db, user_id: str) -> dict:
     try:
-        # Verificar que el usuario existe
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
         # Obtener instancias del usuario que no estén completadas
-        instances = db.collection("challenge_instances")\
-                    .where("user_id", "==", user_id)\
-                    .where("completed", "==", False)\
-                    .stream()
-        
-        challenges = []
-        for instance in instances:
-            instance_data = instance.to_dict()
-            # Obtener detalles del challenge
-            challenge_ref = db.collection("challenges").document(instance_data["challenge_id"])
-            challenge_doc = challenge_ref.get()
-            
-            if challenge_doc.exists:
-                challenge_data = challenge_doc.to_dict()
-                # Asegurarse de que el challenge esté activo
-                if challenge_data.get("status") == "active":
-                    merged_data = {
-                        "instance_id": instance.id,
-                        **instance_data,
-                        **challenge_data
-                    }
-                    challenges.append(merged_data)
-        
-        return challenges
+        return await _get_user_challenges(db, user_id, completed=False)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -306,79 +1298,63 @@ def get_user_assigned_challenges(user_id: str) -> list:
 
 # Challenge Instances completados por usuario
 
-def get_user_completed_challenges(user_id: str) -> list:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="get_user_completed_challenges")
+@traced("crud.get_user_completed_challenges")
+async def get_user_completed_challenges(db, user_id: str) -> dict:
     try:
-        # Verificar que el usuario existe
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
         # Obtener instancias del usuario que estén completadas
-        instances = db.collection("challenge_instances")\
-                    .where("user_id", "==", user_id)\
-                    .where("completed", "==", True)\
-                    .stream()
-        
-        challenges = []
-        for instance in instances:
-            instance_data = instance.to_dict()
-            # Obtener detalles del challenge
-            challenge_ref = db.collection("challenges").document(instance_data["challenge_id"])
-            challenge_doc = challenge_ref.get()
-            
-            if challenge_doc.exists:
-                challenge_data = challenge_doc.to_dict()
-                merged_data = {
-                    "instance_id": instance.id,
-                    **instance_data,
-                    **challenge_data
-                }
-                challenges.append(merged_data)
-        
-        return challenges
+        return await _get_user_challenges(db, user_id, completed=True)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al obtener challenges completados del usuario: {str(e)}"
         )
 
-def update_challenge_progress(instance_id: str) -> dict:
-    db = firestore.client()
-    instance_ref = db.collection("challenge_instances").document(instance_id)
+async def _update_progress_in_transaction(db, instance_ref) -> dict:
+    progress_counters.increment("transaction", "requests")
+    attempts = 0
+
+    @firestore.async_transactional
+    async def update_in_transaction(transaction, instance_ref):
+        nonlocal attempts
+        attempts += 1
+        if attempts > 1:
+            progress_counters.increment("transaction", "retries")
 
-    @firestore.transactional
-    def update_in_transaction(transaction, instance_ref):
         # --- 1. Realizar todas las lecturas primero ---
-        instance_doc = instance_ref.get(transaction=transaction)
+        instance_doc = await instance_ref.get(transaction=transaction)
         if not instance_doc.exists:
             return {'error': 'not_found', 'message': 'Instancia de challenge no encontrada'}
         
         instance_data = instance_doc.to_dict()
 
-        challenge_id = instance_data.get('challenge_id')
-        challenge_ref = db.collection('challenges').document(challenge_id)
-        challenge_doc = challenge_ref.get(transaction=transaction)
-        
-        if not challenge_doc.exists:
+        # El challenge solo aporta estado y puntos; se lee de la caché fuera de la transacción
+        challenge_data = await _get_challenge(db, instance_data.get('challenge_id'))
+        if challenge_data is None:
             return {'error': 'challenge_not_found', 'message': 'Challenge asociado no encontrado'}
         
-        challenge_data = challenge_doc.to_dict()
-        
         user_id = instance_data.get('user_id')
         points_ref = None
         points_doc = None
-        if user_id:
+        location = {}
+        # Con contadores distribuidos los puntos se acreditan después del commit
+        if user_id and POINTS_COUNTER_MODE != "sharded":
             points_ref = db.collection('user_points').document(user_id)
-            points_doc = points_ref.get(transaction=transaction)
+            points_doc = await points_ref.get(transaction=transaction)
+            if not points_doc.exists:
+                # El registro de puntos nuevo lleva la ubicación del usuario
+                user_doc = await db.collection('users').document(user_id).get(transaction=transaction)
+                if user_doc.exists:
+                    location = location_fields(user_doc.to_dict())
 
         # --- 2. Realizar todas las validaciones ---
-        if instance_data.get('completed', False):
+        # Con progreso en 0 otra escritura ya está completando la instancia
+        if instance_data.get('completed', False) or instance_data.get('progress', 0) <= 0:
             return {'error': 'already_completed', 'message': 'El challenge ya esta completado'}
 
-        if challenge_data.get('status') != 'active':
+        if challenge_data.get('status') != 'active' or _is_past_deadline(challenge_data):
             return {'error': 'challenge_expired', 'message': 'El challenge ya expiro'}
 
         # --- 3. Realizar todas las escrituras al final ---
@@ -391,6 +1367,12 @@ def update_challenge_progress(instance_id: str) -> dict:
             })
 
             points_to_add = challenge_data.get('puntos', 0)
+            if user_id and points_to_add > 0 and POINTS_COUNTER_MODE == "sharded":
+                return {
+                    'status': 'completed',
+                    'message': 'completaste el challenge',
+                    'credit': (user_id, points_to_add)
+                }
             if user_id and points_to_add > 0 and points_ref:
                 if points_doc and points_doc.exists:
                     current_points = points_doc.to_dict().get('points', 0)
@@ -400,11 +1382,21 @@ def update_challenge_progress(instance_id: str) -> dict:
                         'last_updated': firestore.SERVER_TIMESTAMP
                     })
                 else:
+                    new_total_points = points_to_add
                     transaction.set(points_ref, {
                         'user_id': user_id,
                         'points': points_to_add,
-                        'last_updated': firestore.SERVER_TIMESTAMP
+                        'last_updated': firestore.SERVER_TIMESTAMP,
+                        **location
                     })
+
+                return {
+                    'status': 'completed',
+                    'message': 'completaste el challenge',
+                    'user_id': user_id,
+                    'points': new_total_points,
+                    'location': location or None
+                }
             
             return {'status': 'completed', 'message': 'completaste el challenge'}
         else:
@@ -413,134 +1405,585 @@ def update_challenge_progress(instance_id: str) -> dict:
             })
             return {'status': 'updated', 'message': 'Progreso actualizado'}
 
-    transaction = db.transaction()
-    result = update_in_transaction(transaction, instance_ref)
+    try:
+        result = await update_in_transaction(db.transaction(), instance_ref)
+    except ValueError as e:
+        # firestore.async_transactional agotó los intentos por conflictos
+        if isinstance(e.__cause__, exceptions.Aborted):
+            progress_counters.increment("transaction", "aborts")
+            raise HTTPException(
+                status_code=409,
+                detail="Conflicto al actualizar el progreso, intente de nuevo"
+            )
+        raise
+    finally:
+        metrics.observe("progress_update_attempts", attempts, mode="transaction")
+
+    credit = result.pop('credit', None)
+    if credit is not None:
+        user_id, points = credit
+        result.update(user_id=user_id, points=(await _credit_points(db, [credit]))[user_id])
+    return result
+
+
+def _transform_values(db, write_result, transform_fields) -> dict:
+    # Firestore devuelve el resultado de cada transformación ordenado por campo
+    return {
+        field: _helpers.decode_value(value, db)
+        for field, value in zip(sorted(transform_fields), write_result.transform_results)
+    }
+
+
+async def _mark_instance_completed(db, instance_ref, update_time):
+    """Marca la instancia como completada con una escritura condicional.
+
+    La condición es que nadie haya escrito después del incremento que llevó
+    el progreso a 0; si otro evento escribió en medio se relee y se reintenta.
+    Devuelve la hora de actualización de la escritura que la completó.
+    """
+    for attempt in range(1, PROGRESS_COMPLETION_MAX_ATTEMPTS + 1):
+        try:
+            write_result = await instance_ref.update(
+                {'progress': 0, 'completed': True},
+                option=db.write_option(last_update_time=update_time)
+            )
+            metrics.observe("progress_update_attempts", attempt, mode="increment")
+            return write_result.update_time
+        except exceptions.FailedPrecondition:
+            progress_counters.increment("increment", "retries")
+            update_time = (await instance_ref.get()).update_time
+
+    # El progreso nunca vuelve a subir, así que escribir sin condición es seguro
+    progress_counters.increment("increment", "aborts")
+    write_result = await instance_ref.update({'progress': 0, 'completed': True})
+    metrics.observe("progress_update_attempts", PROGRESS_COMPLETION_MAX_ATTEMPTS + 1, mode="increment")
+    return write_result.update_time
+
+
+async def _update_progress_with_increments(db, instance_ref) -> dict:
+    progress_counters.increment("increment", "requests")
+
+    instance_doc = await instance_ref.get()
+    if not instance_doc.exists:
+        return {'error': 'not_found', 'message': 'Instancia de challenge no encontrada'}
+    instance_data = instance_doc.to_dict()
+
+    challenge_data = await _get_challenge(db, instance_data.get('challenge_id'))
+    if challenge_data is None:
+        return {'error': 'challenge_not_found', 'message': 'Challenge asociado no encontrado'}
+
+    if instance_data.get('completed', False) or instance_data.get('progress', 0) <= 0:
+        return {'error': 'already_completed', 'message': 'El challenge ya esta completado'}
+
+    if challenge_data.get('status') != 'active' or _is_past_deadline(challenge_data):
+        return {'error': 'challenge_expired', 'message': 'El challenge ya expiro'}
+
+    write_result = await instance_ref.update({'progress': firestore.Increment(-1)})
+    new_progress = _transform_values(db, write_result, ['progress'])['progress']
+
+    if new_progress > 0:
+        return {'status': 'updated', 'message': 'Progreso actualizado'}
+
+    if new_progress < 0:
+        # Otro evento llevó el progreso a 0 entre la lectura y el incremento;
+        # se devuelve a 0 solo si nadie más escribió después
+        progress_counters.increment("increment", "overshoots")
+        try:
+            await instance_ref.update(
+                {'progress': 0},
+                option=db.write_option(last_update_time=write_result.update_time)
+            )
+        except exceptions.FailedPrecondition:
+            pass
+        return {'error': 'already_completed', 'message': 'El challenge ya esta completado'}
+
+    # Solo un incremento puede dejar el progreso exactamente en 0
+    await _mark_instance_completed(db, instance_ref, write_result.update_time)
+
+    user_id = instance_data.get('user_id')
+    points_to_add = challenge_data.get('puntos', 0)
+    if not user_id or points_to_add <= 0:
+        return {'status': 'completed', 'message': 'completaste el challenge'}
+
+    totals = await _credit_points(db, [(user_id, points_to_add)])
+    return {
+        'status': 'completed',
+        'message': 'completaste el challenge',
+        'user_id': user_id,
+        'points': totals[user_id]
+    }
+
+
+PROGRESS_UPDATERS = {
+    "transaction": _update_progress_in_transaction,
+    "increment": _update_progress_with_increments,
+}
+
+if PROGRESS_UPDATE_MODE not in PROGRESS_UPDATERS:
+    raise ValueError(
+        f"PROGRESS_UPDATE_MODE inválido: {PROGRESS_UPDATE_MODE}. Opciones: {', '.join(PROGRESS_UPDATERS)}"
+    )
+
+
+@metrics.timed("crud_function_duration_seconds", function="update_challenge_progress")
+@traced("crud.update_challenge_progress")
+async def update_challenge_progress(db, instance_id: str) -> dict:
+    instance_ref = db.collection("challenge_instances").document(instance_id)
+    result = await PROGRESS_UPDATERS[PROGRESS_UPDATE_MODE](db, instance_ref)
 
     if 'error' in result:
         status_code = 404 if result['error'] in ['not_found', 'challenge_not_found'] else 400
         raise HTTPException(status_code=status_code, detail=result['message'])
+
+    # Mantener el índice del ranking al día con los puntos ya confirmados
+    if result.get('points') is not None:
+        leaderboard_index.set_points(result['user_id'], result['points'], result.get('location'))
     
     return result
 
 
-def get_user_rank(user_id: str) -> int:
-    db = firestore.client()
-    
-    # Obtener todos los documentos de 'user_points' y ordenarlos por 'points'
-    users_query = db.collection("user_points").order_by("points", direction=firestore.Query.DESCENDING)
-    all_users = list(users_query.stream())
-    
-    # Crear una lista de user_ids en el orden del ranking
-    ranked_user_ids = [user.id for user in all_users]
-    
-    # Encontrar la posición (rank) del usuario
+_PROGRESS_ERROR_MESSAGES = {
+    'not_found': 'Instancia de challenge no encontrada',
+    'challenge_not_found': 'Challenge asociado no encontrado',
+    'already_completed': 'El challenge ya esta completado',
+    'challenge_expired': 'El challenge ya expiro',
+    'not_applied': 'No se pudo aplicar el progreso; se pueden reenviar estos eventos',
+}
+
+
+async def _get_documents(db, collection: str, doc_ids, field_paths=None) -> dict:
+    """Lee los documentos indicados con get_all en lotes; {id: snapshot} de los que existen"""
+    doc_ids = list(dict.fromkeys(doc_ids))
+    docs = {}
+    for start in range(0, len(doc_ids), GET_ALL_CHUNK_SIZE):
+        refs = [db.collection(collection).document(doc_id) for doc_id in doc_ids[start:start + GET_ALL_CHUNK_SIZE]]
+        async for doc in db.get_all(refs, field_paths=field_paths):
+            if doc.exists:
+                docs[doc.id] = doc
+    return docs
+
+
+@metrics.timed("crud_function_duration_seconds", function="update_challenge_progress_bulk")
+@traced("crud.update_challenge_progress_bulk")
+async def update_challenge_progress_bulk(db, events) -> dict:
+    """Aplica muchos eventos de progreso agrupándolos por instancia.
+
+    `events` son pares (instance_id, count). Cada instancia recibe una sola
+    escritura con firestore.Increment por el total de sus eventos (sin pasar
+    de 0), en batches de hasta 500. La escritura que cruza a 0 completa la
+    instancia y los puntos de todas las instancias completadas se acreditan
+    con un Increment por usuario.
+
+    Un fallo después de leer no se propaga: el resultado informa como
+    'not_applied' las instancias de los batches que no se confirmaron, en
+    'pending_credits' los créditos que faltan y en 'error' el motivo.
+    """
+    deltas = {}
+    for instance_id, count in events:
+        deltas[instance_id] = deltas.get(instance_id, 0) + count
+
+    instance_docs = await _get_documents(db, "challenge_instances", deltas)
+    challenges, _ = await _get_challenges_by_ids(
+        db, [(doc.to_dict() or {}).get('challenge_id') for doc in instance_docs.values()]
+    )
+
+    results = {}
+    pending = []
+    for instance_id, count in deltas.items():
+        instance_doc = instance_docs.get(instance_id)
+        instance_data = instance_doc.to_dict() if instance_doc else None
+        challenge_data = challenges.get(instance_data.get('challenge_id')) if instance_data else None
+        progress = instance_data.get('progress', 0) if instance_data else 0
+
+        if instance_data is None:
+            error = 'not_found'
+        elif challenge_data is None:
+            error = 'challenge_not_found'
+        elif instance_data.get('completed', False) or progress <= 0:
+            error = 'already_completed'
+        elif challenge_data.get('status') != 'active' or _is_past_deadline(challenge_data):
+            error = 'challenge_expired'
+        else:
+            # Los eventos que sobran después de completar no se aplican
+            pending.append((instance_id, min(count, progress), instance_data, challenge_data))
+            continue
+        results[instance_id] = {
+            'instance_id': instance_id,
+            'status': 'error',
+            'error': error,
+            'events': count,
+            'applied': 0,
+            'message': _PROGRESS_ERROR_MESSAGES[error],
+        }
+
+    # Cada chunk es un batch atómico. Si uno falla, ni él ni los siguientes
+    # se aplican y sus instancias se informan como 'not_applied'; los
+    # anteriores ya quedaron confirmados y no se deben repetir
+    chunks = [pending[start:start + MAX_BATCH_WRITES] for start in range(0, len(pending), MAX_BATCH_WRITES)]
+    completed = []
+    error = None
+    for number, chunk in enumerate(chunks):
+        batch = db.batch()
+        for instance_id, applied, instance_data, _ in chunk:
+            update = {'progress': firestore.Increment(-applied)}
+            if applied >= instance_data.get('progress', 0):
+                update['completed'] = True
+            batch.update(db.collection("challenge_instances").document(instance_id), update)
+        try:
+            write_results = await batch.commit()
+        except Exception as e:
+            error = f"Chunk {number + 1} de {len(chunks)}: {e}"
+            for instance_id, _, _, _ in (entry for rest in chunks[number:] for entry in rest):
+                results[instance_id] = {
+                    'instance_id': instance_id,
+                    'status': 'error',
+                    'error': 'not_applied',
+                    'events': deltas[instance_id],
+                    'applied': 0,
+                    'message': _PROGRESS_ERROR_MESSAGES['not_applied'],
+                }
+            break
+
+        for (instance_id, applied, instance_data, challenge_data), write_result in zip(chunk, write_results):
+            instance_ref = db.collection("challenge_instances").document(instance_id)
+            new_progress = _transform_values(db, write_result, ['progress'])['progress']
+            result = {
+                'instance_id': instance_id,
+                'events': deltas[instance_id],
+                'applied': applied,
+            }
+            results[instance_id] = result
+
+            if new_progress > 0:
+                result.update(status='updated', progress=new_progress, message='Progreso actualizado')
+                continue
+
+            if new_progress + applied <= 0:
+                # Otra escritura cruzó a 0 antes que este batch
+                try:
+                    await instance_ref.update(
+                        {'progress': 0},
+                        option=db.write_option(last_update_time=write_result.update_time)
+                    )
+                except exceptions.GoogleAPICallError:
+                    # Otra escritura ya la cambió, o queda con progreso negativo en
+                    # una instancia completada; en ambos casos no hay nada que deshacer
+                    pass
+                result.update(
+                    status='error', error='already_completed', applied=0,
+                    message=_PROGRESS_ERROR_MESSAGES['already_completed']
+                )
+                continue
+
+            # Este batch cruzó a 0; si los eventos concurrentes cambiaron el
+            # cálculo, se completa con la escritura condicional
+            update_time = write_result.update_time
+            if new_progress < 0 or applied < instance_data.get('progress', 0):
+                try:
+                    update_time = await _mark_instance_completed(db, instance_ref, update_time)
+                except Exception as e:
+                    # El decremento ya está confirmado: la instancia cuenta como
+                    # completada y el crédito de sus puntos termina de marcarla
+                    error = error or f"Instancia {instance_id}: {e}"
+                    update_time = None
+            result.update(status='completed', progress=0, message='completaste el challenge')
+            completed.append((instance_id, instance_data.get('user_id'), challenge_data.get('puntos', 0), update_time))
+
+    credits = [entry for entry in completed if entry[1] and entry[2] > 0]
+    pending_credits = [(instance_id, user_id, points) for instance_id, user_id, points, update_time in credits
+                       if update_time is None]
+    credited = {}
+    try:
+        credited = await _credit_points(db, [
+            (user_id, points, (db.collection("challenge_instances").document(instance_id), update_time))
+            for instance_id, user_id, points, update_time in credits
+            if update_time is not None
+        ])
+    except Exception as e:
+        # Cada instancia se marca junto con el crédito de su usuario, así que
+        # se puede reintentar con credit_completed_instances sin acreditar dos veces
+        error = error or f"Crédito de puntos: {e}"
+        pending_credits = [(instance_id, user_id, points) for instance_id, user_id, points, _ in credits]
+
+    return {
+        'results': [results[instance_id] for instance_id in deltas],
+        'events': sum(deltas.values()),
+        'instances': len(deltas),
+        'completed': len(completed),
+        'users_credited': len(credited),
+        'pending_credits': [
+            {'instance_id': instance_id, 'user_id': user_id, 'points': points}
+            for instance_id, user_id, points in pending_credits
+        ],
+        'error': error,
+    }
+
+
+@metrics.timed("crud_function_duration_seconds", function="credit_completed_instances")
+@traced("crud.credit_completed_instances")
+async def credit_completed_instances(db, credits) -> dict:
+    """Acredita los puntos de instancias completadas que quedaron pendientes.
+
+    `credits` son tríos (instance_id, user_id, puntos). Se releen las
+    instancias y se saltan las que ya tienen 'points_credited', así que la
+    llamada se puede repetir después de un fallo sin acreditar dos veces.
+    Devuelve el total nuevo de cada usuario acreditado.
+    """
+    credits = list(credits)
+    docs = await _get_documents(
+        db, "challenge_instances", [instance_id for instance_id, _, _ in credits], field_paths=['points_credited']
+    )
+    return await _credit_points(db, [
+        (user_id, points, (docs[instance_id].reference, docs[instance_id].update_time))
+        for instance_id, user_id, points in credits
+        if instance_id in docs and not (docs[instance_id].to_dict() or {}).get('points_credited')
+    ])
+
+
+def _credit_batches(completed) -> list:
+    """Reparte los créditos en batches de hasta MAX_BATCH_WRITES escrituras.
+
+    Cada batch es una lista de (user_id, puntos, marcas): un Increment con la
+    suma de los puntos del usuario más las marcas (instance_ref, update_time)
+    de las instancias que esa suma incluye, para que se confirmen juntos.
+    """
+    by_user = {}
+    for user_id, points, *mark in completed:
+        if user_id and points > 0:
+            by_user.setdefault(user_id, []).append((points, mark[0] if mark else None))
+
+    batches = []
+    writes = MAX_BATCH_WRITES
+    for user_id, entries in by_user.items():
+        # Un usuario con más instancias de las que caben en un batch se acredita en partes
+        for start in range(0, len(entries), MAX_BATCH_WRITES - 1):
+            part = entries[start:start + MAX_BATCH_WRITES - 1]
+            marks = [mark for _, mark in part if mark is not None]
+            if writes + 1 + len(marks) > MAX_BATCH_WRITES:
+                batches.append([])
+                writes = 0
+            batches[-1].append((user_id, sum(points for points, _ in part), marks))
+            writes += 1 + len(marks)
+    return batches
+
+
+def _mark_points_credited(db, batch, marks) -> None:
+    for instance_ref, update_time in marks:
+        # Si la instancia cambió desde que se leyó falla el batch completo y
+        # el reintento la relee. También la deja completada, por si la
+        # escritura condicional que la completaba no llegó a confirmarse
+        batch.update(
+            instance_ref,
+            {'progress': 0, 'completed': True, 'points_credited': True},
+            option=db.write_option(last_update_time=update_time)
+        )
+
+
+async def _credit_points(db, completed) -> dict:
+    """Suma con un Increment por usuario los puntos de las instancias completadas.
+
+    Recibe pares (user_id, puntos), o tríos con la marca (instance_ref,
+    update_time) de la instancia, que se escribe en el mismo batch que el
+    crédito; devuelve el total nuevo de cada usuario. Los usuarios sin
+    registro de puntos lo obtienen con su ubicación copiada.
+    """
+    batches = _credit_batches(completed)
+    if not batches:
+        return {}
+
+    if POINTS_COUNTER_MODE == "sharded":
+        totals = await _credit_points_sharded(db, batches)
+        for user_id, total in totals.items():
+            leaderboard_index.set_points(user_id, total)
+        return totals
+
+    # Los usuarios fuera del índice pueden no tener registro de puntos
+    user_ids = dict.fromkeys(user_id for credits in batches for user_id, _, _ in credits)
+    unknown_ids = [user_id for user_id in user_ids if leaderboard_index.get_points(user_id) is None]
+    users = await _get_documents(db, "users", unknown_ids, field_paths=list(LOCATION_FIELDS))
+    locations = {user_id: location_fields(doc.to_dict() or {}) for user_id, doc in users.items()}
+
+    totals = {}
+    for credits in batches:
+        batch = db.batch()
+        for user_id, points, marks in credits:
+            batch.set(db.collection('user_points').document(user_id), {
+                'user_id': user_id,
+                'points': firestore.Increment(points),
+                'last_updated': firestore.SERVER_TIMESTAMP,
+                **locations.get(user_id, {})
+            }, merge=True)
+            _mark_points_credited(db, batch, marks)
+        write_results = await batch.commit()
+
+        # El índice se actualiza por batch para que, si uno posterior falla,
+        # refleje los créditos que ya quedaron confirmados
+        position = 0
+        for user_id, _, marks in credits:
+            totals[user_id] = _transform_values(db, write_results[position], ['last_updated', 'points'])['points']
+            position += 1 + len(marks)
+            leaderboard_index.set_points(user_id, totals[user_id], locations.get(user_id) or None)
+    return totals
+
+
+async def _leaderboard_entries(db) -> list:
+    points_docs = db.collection("user_points").select(["points", *LOCATION_FIELDS]).stream()
+    entries = []
+    async for doc in points_docs:
+        data = doc.to_dict() or {}
+        entries.append((doc.id, data.get("points", 0), location_fields(data)))
+    return entries
+
+
+# Ordenar todo el ranking es trabajo de CPU; se hace en el pool de hilos
+# para no detener el event loop mientras tanto
+
+@metrics.timed("crud_function_duration_seconds", function="warm_leaderboard_index")
+@traced("crud.warm_leaderboard_index")
+async def warm_leaderboard_index(db) -> int:
+    """Carga en memoria el ranking global, por ciudad y por departamento"""
+    await run_in_threadpool(leaderboard_index.load, await _leaderboard_entries(db))
+    return len(leaderboard_index)
+
+
+@metrics.timed("crud_function_duration_seconds", function="rebuild_leaderboard_snapshot")
+@traced("crud.rebuild_leaderboard_snapshot")
+async def rebuild_leaderboard_snapshot(db) -> LeaderboardSnapshot:
+    """Reconstruye y publica la foto del ranking que sirve top y vecinos"""
+    if leaderboard_index.ready:
+        snapshot = await run_in_threadpool(leaderboard_index.snapshot)
+    else:
+        snapshot = await run_in_threadpool(LeaderboardSnapshot.from_entries, await _leaderboard_entries(db))
+    publish_snapshot(snapshot)
+    return snapshot
+
+
+# Estrategias de ranking
+#
+# Cada estrategia recibe el cliente, el usuario y opcionalmente el campo y
+# valor que delimitan el ranking ("city" / "state"), y devuelve la posición
+# del usuario o None si no tiene registro de puntos. Todas desempatan por
+# ID de usuario descendente, igual que Firestore al ordenar por puntos
+# descendentes, para que den el mismo resultado.
+
+async def _rank_by_scan(db, user_id: str, scope_field: str = None, scope_value: str = None):
+    if scope_field is None:
+        # Obtener todos los documentos de 'user_points' ordenados por 'points'
+        users_query = db.collection("user_points").order_by("points", direction=firestore.Query.DESCENDING)
+        ranked_user_ids = [user.id async for user in users_query.stream()]
+    else:
+        # Una sola consulta filtrada por la ubicación copiada en 'user_points'
+        users_query = db.collection("user_points") \
+            .where(scope_field, "==", scope_value) \
+            .order_by("points", direction=firestore.Query.DESCENDING) \
+            .select([])
+        ranked_user_ids = [user.id async for user in users_query.stream()]
+
     try:
-        rank = ranked_user_ids.index(user_id) + 1
-        return rank
+        return ranked_user_ids.index(user_id) + 1
     except ValueError:
-        # Si el usuario no está en la lista, significa que no tiene puntos
+        return None
+
+
+async def _count(query) -> int:
+    result = await query.count(alias="total").get()
+    return int(result[0][0].value)
+
+
+async def _rank_by_count(db, user_id: str, scope_field: str = None, scope_value: str = None):
+    points_ref = db.collection("user_points").document(user_id)
+    points_doc = await points_ref.get()
+    if not points_doc.exists:
+        return None
+    points_data = points_doc.to_dict()
+    points = points_data.get("points", 0)
+
+    # Un registro aún sin sincronizar no pertenece al ranking de ese ámbito
+    if scope_field is not None and points_data.get(scope_field) != scope_value:
+        return None
+
+    points_query = db.collection("user_points")
+    if scope_field is not None:
+        points_query = points_query.where(scope_field, "==", scope_value)
+
+    # 1 + usuarios con más puntos + usuarios empatados con ID mayor
+    ahead = await _count(points_query.where("points", ">", points))
+    ahead += await _count(
+        points_query.where("points", "==", points)
+                    .where("__name__", ">", points_ref)
+    )
+    return ahead + 1
+
+
+async def _rank_by_index(db, user_id: str, scope_field: str = None, scope_value: str = None):
+    # Con el índice en memoria cargado el ranking se responde sin leer Firestore
+    if leaderboard_index.ready:
+        rank = leaderboard_index.rank(user_id, scope_field, scope_value)
+        # Si la ubicación del índice no coincide con la del usuario se consulta Firestore
+        if rank is not None or scope_field is None:
+            return rank
+    return await _rank_by_count(db, user_id, scope_field, scope_value)
+
+
+RANK_STRATEGIES = {
+    "index": _rank_by_index,
+    "count": _rank_by_count,
+    "scan": _rank_by_scan,
+}
+
+if RANK_STRATEGY not in RANK_STRATEGIES:
+    raise ValueError(
+        f"RANK_STRATEGY inválida: {RANK_STRATEGY}. Opciones: {', '.join(RANK_STRATEGIES)}"
+    )
+
+
+async def _get_user_location(db, user_id: str, field: str, missing_message: str) -> str:
+    user_doc = await db.collection("users").document(user_id).get()
+    if not user_doc.exists:
+        raise HTTPException(status_code=404, detail=f"Usuario con ID {user_id} no encontrado.")
+
+    value = user_doc.to_dict().get(field)
+    if not value:
+        raise HTTPException(status_code=404, detail=f"El usuario con ID {user_id} no tiene {missing_message}.")
+    return value
+
+
+@metrics.timed("crud_function_duration_seconds", function="get_user_rank")
+@traced("crud.get_user_rank")
+async def get_user_rank(db, user_id: str) -> int:
+    rank = await RANK_STRATEGIES[RANK_STRATEGY](db, user_id)
+    if rank is None:
+        # Si el usuario no está en el ranking, significa que no tiene puntos
         raise HTTPException(
             status_code=404,
             detail=f"No se encontró un registro de puntos para el usuario con ID {user_id}"
         )
+    return rank
 
-def get_user_rank_by_city(user_id: str) -> int:
-    db = firestore.client()
 
-    # 1. Obtener la ciudad del usuario especificado
-    user_doc_ref = db.collection("users").document(user_id)
-    user_doc = user_doc_ref.get()
-    if not user_doc.exists:
-        raise HTTPException(status_code=404, detail=f"Usuario con ID {user_id} no encontrado.")
-    
-    user_data = user_doc.to_dict()
-    city = user_data.get("city")
-    if not city:
-        raise HTTPException(status_code=404, detail=f"El usuario con ID {user_id} no tiene una ciudad asignada.")
-
-    # 2. Obtener todos los usuarios de la misma ciudad
-    city_users_query = db.collection("users").where("city", "==", city)
-    city_users_docs = city_users_query.stream()
-    city_user_ids = {doc.id for doc in city_users_docs}
-
-    if not city_user_ids:
-         raise HTTPException(status_code=404, detail=f"No se encontraron usuarios en la ciudad: {city}")
-
-    # 3. Obtener los puntos de todos los usuarios
-    points_docs = db.collection("user_points").stream()
-
-    # 4. Filtrar los puntos solo para usuarios de la ciudad y construir lista para ranking
-    city_users_points = []
-    for doc in points_docs:
-        if doc.id in city_user_ids:
-            points_data = doc.to_dict()
-            city_users_points.append({
-                "user_id": doc.id,
-                "points": points_data.get("points", 0)
-            })
+@metrics.timed("crud_function_duration_seconds", function="get_user_rank_by_city")
+@traced("crud.get_user_rank_by_city")
+async def get_user_rank_by_city(db, user_id: str) -> int:
+    city = await _get_user_location(db, user_id, "city", "una ciudad asignada")
 
-    # 5. Ordenar los usuarios por puntos
-    sorted_users = sorted(city_users_points, key=lambda x: x["points"], reverse=True)
-    
-    # 6. Encontrar el ranking del usuario
-    ranked_user_ids = [user["user_id"] for user in sorted_users]
-    
-    try:
-        rank = ranked_user_ids.index(user_id) + 1
-        return rank
-    except ValueError:
+    rank = await RANK_STRATEGIES[RANK_STRATEGY](db, user_id, "city", city)
+    if rank is None:
         raise HTTPException(
             status_code=404,
             detail=f"No se encontró un registro de puntos para el usuario con ID {user_id} en su ciudad"
         )
+    return rank
 
 
-def get_user_rank_by_state(user_id: str) -> int:
-    db = firestore.client()
+@metrics.timed("crud_function_duration_seconds", function="get_user_rank_by_state")
+@traced("crud.get_user_rank_by_state")
+async def get_user_rank_by_state(db, user_id: str) -> int:
+    state = await _get_user_location(db, user_id, "state", "un departamento asignado")
 
-    # 1. Obtener el departamento del usuario especificado
-    user_doc_ref = db.collection("users").document(user_id)
-    user_doc = user_doc_ref.get()
-    if not user_doc.exists:
-        raise HTTPException(status_code=404, detail=f"Usuario con ID {user_id} no encontrado.")
-    
-    user_data = user_doc.to_dict()
-    state = user_data.get("state")
-    if not state:
-        raise HTTPException(status_code=404, detail=f"El usuario con ID {user_id} no tiene un departamento asignado.")
-
-    # 2. Obtener todos los usuarios del mismo departamento
-    state_users_query = db.collection("users").where("state", "==", state)
-    state_users_docs = state_users_query.stream()
-    state_user_ids = {doc.id for doc in state_users_docs}
-
-    if not state_user_ids:
-         raise HTTPException(status_code=404, detail=f"No se encontraron usuarios en el departamento: {state}")
-
-    # 3. Obtener los puntos de todos los usuarios
-    points_docs = db.collection("user_points").stream()
-
-    # 4. Filtrar los puntos solo para usuarios del departamento y construir lista para ranking
-    state_users_points = []
-    for doc in points_docs:
-        if doc.id in state_user_ids:
-            points_data = doc.to_dict()
-            state_users_points.append({
-                "user_id": doc.id,
-                "points": points_data.get("points", 0)
-            })
-
-    # 5. Ordenar los usuarios por puntos
-    sorted_users = sorted(state_users_points, key=lambda x: x["points"], reverse=True)
-    
-    # 6. Encontrar el ranking del usuario
-    ranked_user_ids = [user["user_id"] for user in sorted_users]
-    
-    try:
-        rank = ranked_user_ids.index(user_id) + 1
-        return rank
-    except ValueError:
+    rank = await RANK_STRATEGIES[RANK_STRATEGY](db, user_id, "state", state)
+    if rank is None:
         raise HTTPException(
             status_code=404,
             detail=f"No se encontró un registro de puntos para el usuario con ID {user_id} en su departamento"
-        )
\ No newline at end of file
+        )
+    return rank
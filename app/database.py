@@ -0,0 +1,131 @@
+import logging
+import os
+
+from firebase_admin import firestore, firestore_async
+from google.cloud.firestore_v1.services.firestore import async_client as firestore_async_client
+from google.cloud.firestore_v1.services.firestore import client as firestore_client
+from google.cloud.firestore_v1.services.firestore.transports import grpc as firestore_grpc
+from google.cloud.firestore_v1.services.firestore.transports import grpc_asyncio as firestore_grpc_asyncio
+
+from app.config import (
+    FIRESTORE_KEEPALIVE_TIME_MS,
+    FIRESTORE_KEEPALIVE_TIMEOUT_MS,
+    FIRESTORE_MAX_MESSAGE_BYTES,
+    FIRESTORE_OP_ACCOUNTING,
+    MEMORY_STORE_LATENCY_MS,
+    STORAGE_BACKEND,
+    TRACING_ENABLED,
+)
+from app.firestore_ops import instrument_client
+from app.memory_store import AsyncMemoryClient
+
+logger = logging.getLogger(__name__)
+
+# Cliente asíncrono de Firestore compartido por toda la aplicación. Se crea
+# una sola vez en el lifespan de FastAPI y los endpoints lo reciben con get_db().
+_client = None
+
+
+def _channel_options() -> list:
+    return [
+        ("grpc.keepalive_time_ms", FIRESTORE_KEEPALIVE_TIME_MS),
+        ("grpc.keepalive_timeout_ms", FIRESTORE_KEEPALIVE_TIMEOUT_MS),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.max_send_message_length", FIRESTORE_MAX_MESSAGE_BYTES),
+        ("grpc.max_receive_message_length", FIRESTORE_MAX_MESSAGE_BYTES),
+    ]
+
+
+# Atributos internos del cliente que usa _tune_channel. Existen desde
+# google-cloud-firestore 2.x; la versión probada (2.34.1, con firebase-admin
+# 7.7.0) está fijada en requirements.txt.
+_CHANNEL_ATTRIBUTES = ("_target", "_credentials", "_client_options", "_client_info", "_firestore_api_internal")
+
+
+def _tune_channel(client) -> bool:
+    # La librería crea el canal gRPC de forma perezosa con opciones fijas;
+    # se crea aquí con las opciones configuradas antes del primer uso. Si la
+    # versión instalada no tiene los atributos esperados se deja su canal.
+    if any(not hasattr(client, name) for name in _CHANNEL_ATTRIBUTES):
+        logger.warning("Versión de google-cloud-firestore no soportada; se usa el canal gRPC por defecto")
+        return False
+    if client._firestore_api_internal is not None:
+        return False
+
+    if isinstance(client, firestore.AsyncClient):
+        transport_class = firestore_grpc_asyncio.FirestoreGrpcAsyncIOTransport
+        api_class = firestore_async_client.FirestoreAsyncClient
+    else:
+        transport_class = firestore_grpc.FirestoreGrpcTransport
+        api_class = firestore_client.FirestoreClient
+    channel = transport_class.create_channel(
+        client._target,
+        credentials=client._credentials,
+        options=_channel_options(),
+    )
+    transport = transport_class(host=client._target, channel=channel, client_info=client._client_info)
+    client._firestore_api_internal = api_class(
+        transport=transport, client_options=client._client_options, client_info=client._client_info
+    )
+    return True
+
+
+def _configure(client):
+    # El emulador usa su propio canal inseguro
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        _tune_channel(client)
+    # El mismo envoltorio cuenta las operaciones y crea sus spans
+    if FIRESTORE_OP_ACCOUNTING or TRACING_ENABLED:
+        instrument_client(client)
+    return client
+
+
+def create_client():
+    """Crea el cliente asíncrono del motor configurado en STORAGE_BACKEND.
+
+    Con "firestore" usa la app de firebase_admin ya inicializada; con
+    "memory" devuelve un almacenamiento en memoria con la misma interfaz.
+    """
+    if STORAGE_BACKEND == "memory":
+        return AsyncMemoryClient(latency=MEMORY_STORE_LATENCY_MS / 1000)
+    if STORAGE_BACKEND != "firestore":
+        raise ValueError(f"STORAGE_BACKEND inválido: {STORAGE_BACKEND}. Opciones: firestore, memory")
+
+    return _configure(firestore_async.client())
+
+
+def init_client(client=None):
+    """Registra el cliente compartido; pruebas y benchmarks pueden pasar el suyo"""
+    global _client
+    _client = client if client is not None else create_client()
+    return _client
+
+
+def close_client() -> None:
+    global _client
+    if _client is not None and hasattr(_client, "close"):
+        _client.close()
+    _client = None
+
+
+def get_client():
+    if _client is None:
+        init_client()
+    return _client
+
+
+def get_sync_client():
+    """Cliente síncrono sobre los mismos datos y credenciales que el compartido.
+
+    AsyncClient no tiene on_snapshot, así que los listeners del ranking (y
+    la carga de datos de los benchmarks) usan este.
+    """
+    client = get_client()._to_sync_copy()
+    if STORAGE_BACKEND == "firestore":
+        _configure(client)
+    return client
+
+
+def get_db():
+    """Dependencia de FastAPI que entrega el cliente compartido"""
+    return get_client()
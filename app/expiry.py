@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Segundos antes de reintentar los challenges que no se pudieron desactivar
+RETRY_DELAY_SECONDS = 30
+
+
+def deadline_timestamp(max_date) -> Optional[float]:
+    """Timestamp UNIX de max_date; las fechas sin zona se toman como UTC"""
+    if not isinstance(max_date, datetime):
+        return None
+    if max_date.tzinfo is None:
+        max_date = max_date.replace(tzinfo=timezone.utc)
+    return max_date.timestamp()
+
+
+class ExpiryScheduler:
+    """Desactiva cada challenge activo al llegar su max_date.
+
+    Mantiene un min-heap (timestamp, challenge_id) con borrado perezoso: al
+    reprogramar o cancelar solo cambia el diccionario de fechas vigentes y
+    las entradas viejas del heap se descartan al salir. La tarea de fondo
+    duerme hasta la fecha más próxima y se despierta antes si se programa
+    una anterior.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._deadlines = {}
+        self._loop = None
+        self._wakeup = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, challenge_id: str, max_date) -> None:
+        deadline = deadline_timestamp(max_date)
+        if deadline is None:
+            self.unschedule(challenge_id)
+            return
+        with self._lock:
+            self._deadlines[challenge_id] = deadline
+            heapq.heappush(self._heap, (deadline, challenge_id))
+            is_next = self._heap[0] == (deadline, challenge_id)
+        if is_next and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def unschedule(self, challenge_id: str) -> None:
+        with self._lock:
+            self._deadlines.pop(challenge_id, None)
+
+    def load(self, challenges) -> None:
+        """Programa pares (challenge_id, max_date) de una sola vez"""
+        with self._lock:
+            for challenge_id, max_date in challenges:
+                deadline = deadline_timestamp(max_date)
+                if deadline is not None:
+                    self._deadlines[challenge_id] = deadline
+            self._heap = [(deadline, challenge_id) for challenge_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _seconds_until_next(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.time())
+
+    def pop_due(self, now: float = None) -> List[str]:
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, challenge_id = heapq.heappop(self._heap)
+                if self._deadlines.get(challenge_id) == deadline:
+                    del self._deadlines[challenge_id]
+                    due.append(challenge_id)
+        return due
+
+    async def run(self, expire: Callable[[List[str]], Awaitable]) -> None:
+        """Tarea de fondo; `expire` recibe los IDs vencidos y los desactiva"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            due = self.pop_due()
+            if not due:
+                continue
+            try:
+                await expire(due)
+            except Exception:
+                logger.exception("No se pudieron desactivar %d challenges vencidos; se reintentará", len(due))
+                retry_at = datetime.fromtimestamp(time.time() + RETRY_DELAY_SECONDS, timezone.utc)
+                for challenge_id in due:
+                    self.schedule(challenge_id, retry_at)
+
+    def stop(self) -> None:
+        self._loop = None
+
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,309 @@
+"""Conteo de operaciones de Firestore por solicitud.
+
+Cada solicitud HTTP abre un OperationStats en una ContextVar; el cliente de
+Firestore instrumentado (y el motor en memoria) suman ahí las lecturas de
+documentos, escrituras, consultas, transacciones y el tiempo de cada RPC.
+Las operaciones fuera de una solicitud (tareas de fondo) se suman en un
+acumulado aparte.
+"""
+import contextvars
+import inspect
+import math
+import threading
+import time
+
+from app.tracing import record_span
+
+
+class OperationStats:
+    __slots__ = ("reads", "writes", "queries", "transactions", "rpcs", "rpc_seconds", "_lock")
+
+    def __init__(self):
+        # Una solicitud puede repartir su trabajo entre varios hilos
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.transactions = 0
+        self.rpcs = 0
+        self.rpc_seconds = 0.0
+
+    def add(self, reads=0, writes=0, queries=0, transactions=0, rpcs=0, seconds=0.0) -> None:
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            self.queries += queries
+            self.transactions += transactions
+            self.rpcs += rpcs
+            self.rpc_seconds += seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "queries": self.queries,
+            "transactions": self.transactions,
+            "rpcs": self.rpcs,
+            "rpc_seconds": round(self.rpc_seconds, 4),
+        }
+
+
+_current = contextvars.ContextVar("firestore_operations", default=None)
+
+
+def begin_request():
+    """Empieza a contar las operaciones de la solicitud actual; devuelve (stats, token)"""
+    stats = OperationStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+def current_stats():
+    return _current.get()
+
+
+class RouteOperationMetrics:
+    """Acumulado de operaciones por ruta (método y plantilla de la ruta)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._background = OperationStats()
+
+    def record(self, route: str, stats: OperationStats, seconds: float) -> None:
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {"requests": 0, "seconds": 0.0, "max_reads": 0, "totals": OperationStats()}
+            entry["requests"] += 1
+            entry["seconds"] += seconds
+            entry["max_reads"] = max(entry["max_reads"], stats.reads)
+            entry["totals"].add(
+                stats.reads, stats.writes, stats.queries, stats.transactions, stats.rpcs, stats.rpc_seconds
+            )
+
+    def record_background(self, **counts) -> None:
+        self._background.add(**counts)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            routes = {}
+            for route, entry in self._routes.items():
+                totals = entry["totals"]
+                requests = entry["requests"]
+                routes[route] = {
+                    "requests": requests,
+                    **totals.as_dict(),
+                    "reads_per_request": round(totals.reads / requests, 2),
+                    "max_reads": entry["max_reads"],
+                    "avg_seconds": round(entry["seconds"] / requests, 4),
+                    "avg_rpc_seconds": round(totals.rpc_seconds / requests, 4),
+                }
+            return {"routes": routes, "background": self._background.as_dict()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._background = OperationStats()
+
+
+operation_metrics = RouteOperationMetrics()
+
+
+def aggregation_reads(entries: int) -> int:
+    """Lecturas que cobra una agregación: una por cada 1000 entradas de índice
+    recorridas, mínimo una"""
+    return max(1, math.ceil(entries / 1000))
+
+
+def record_operation(operation: str, **counts) -> None:
+    """Suma operaciones a la solicitud en curso o, sin solicitud, al acumulado
+    de fondo, y registra el span de la operación si hay una traza activa"""
+    stats = _current.get()
+    if stats is not None:
+        stats.add(**counts)
+    else:
+        operation_metrics.record_background(**counts)
+    record_span(f"firestore.{operation}", counts.get("seconds", 0.0), {
+        "db.system": "firestore",
+        "db.operation": operation,
+        "firestore.reads": counts.get("reads", 0),
+        "firestore.writes": counts.get("writes", 0),
+    })
+
+
+# --- Cliente de Firestore ----------------------------------------------------
+
+class InstrumentedFirestoreApi:
+    """Envuelve el cliente GAPIC de Firestore para contar cada RPC.
+
+    Firestore cobra una lectura por documento devuelto (y una como mínimo
+    por consulta o agregación), una por cada 1000 entradas que recorre una
+    agregación y una escritura por cada write de un commit; así se cuentan
+    aquí. Los demás métodos pasan sin cambios.
+    """
+
+    def __init__(self, api):
+        self._api = api
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    @staticmethod
+    def _counted_stream(operation: str, responses, started: float, reads_in, queries: int = 0):
+        # Las respuestas se cuentan a medida que el SDK las consume
+        reads = 0
+        try:
+            for response in responses:
+                reads += reads_in(response)
+                yield response
+        finally:
+            if queries:
+                reads = max(reads, 1)
+            record_operation(operation, reads=reads, queries=queries, rpcs=1, seconds=time.perf_counter() - started)
+
+    @staticmethod
+    def _aggregation_reads_in(args, kwargs):
+        # count() informa cuántas entradas recorrió la consulta; sum() y avg()
+        # no, y se cuentan con el mínimo de una lectura
+        request = kwargs.get("request") if "request" in kwargs else (args[0] if args else None)
+        if isinstance(request, dict):
+            query = request.get("structured_aggregation_query")
+        else:
+            query = getattr(request, "structured_aggregation_query", None)
+        aliases = []
+        if query is not None:
+            aliases = [aggregation.alias for aggregation in query.aggregations if "count" in aggregation]
+
+        def reads_in(response) -> int:
+            if "result" not in response:
+                return 0
+            fields = response.result.aggregate_fields
+            counted = max((fields[alias].integer_value for alias in aliases if alias in fields), default=0)
+            return aggregation_reads(counted)
+        return reads_in
+
+    def batch_get_documents(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = self._api.batch_get_documents(*args, **kwargs)
+        # Los documentos inexistentes también se cobran como lectura
+        return self._counted_stream("batch_get_documents", responses, started, lambda r: "found" in r or bool(r.missing))
+
+    def run_query(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = self._api.run_query(*args, **kwargs)
+        return self._counted_stream("run_query", responses, started, lambda r: "document" in r, queries=1)
+
+    def run_aggregation_query(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = self._api.run_aggregation_query(*args, **kwargs)
+        return self._counted_stream(
+            "run_aggregation_query", responses, started, self._aggregation_reads_in(args, kwargs), queries=1
+        )
+
+    def list_documents(self, *args, **kwargs):
+        started = time.perf_counter()
+        documents = self._api.list_documents(*args, **kwargs)
+        return self._counted_stream("list_documents", documents, started, lambda d: True)
+
+    def commit(self, *args, **kwargs):
+        request = kwargs.get("request") if "request" in kwargs else (args[0] if args else None)
+        writes = len(request["writes"]) if isinstance(request, dict) else len(getattr(request, "writes", []))
+        started = time.perf_counter()
+        try:
+            return self._api.commit(*args, **kwargs)
+        finally:
+            record_operation("commit", writes=writes, rpcs=1, seconds=time.perf_counter() - started)
+
+    def begin_transaction(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._api.begin_transaction(*args, **kwargs)
+        finally:
+            record_operation("begin_transaction", transactions=1, rpcs=1, seconds=time.perf_counter() - started)
+
+    def rollback(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._api.rollback(*args, **kwargs)
+        finally:
+            record_operation("rollback", rpcs=1, seconds=time.perf_counter() - started)
+
+
+class InstrumentedAsyncFirestoreApi(InstrumentedFirestoreApi):
+    """Misma cuenta para el cliente GAPIC asíncrono que usa firestore.AsyncClient.
+
+    Los métodos de streaming devuelven un awaitable con un iterable
+    asíncrono; el SDK hace ``await`` y luego ``async for``, así que aquí se
+    espera la llamada y se devuelve un generador asíncrono que cuenta.
+    """
+
+    @staticmethod
+    async def _counted_stream(operation: str, responses, started: float, reads_in, queries: int = 0):
+        reads = 0
+        try:
+            async for response in responses:
+                reads += reads_in(response)
+                yield response
+        finally:
+            if queries:
+                reads = max(reads, 1)
+            record_operation(operation, reads=reads, queries=queries, rpcs=1, seconds=time.perf_counter() - started)
+
+    async def batch_get_documents(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = await self._api.batch_get_documents(*args, **kwargs)
+        return self._counted_stream("batch_get_documents", responses, started, lambda r: "found" in r or bool(r.missing))
+
+    async def run_query(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = await self._api.run_query(*args, **kwargs)
+        return self._counted_stream("run_query", responses, started, lambda r: "document" in r, queries=1)
+
+    async def run_aggregation_query(self, *args, **kwargs):
+        started = time.perf_counter()
+        responses = await self._api.run_aggregation_query(*args, **kwargs)
+        return self._counted_stream(
+            "run_aggregation_query", responses, started, self._aggregation_reads_in(args, kwargs), queries=1
+        )
+
+    async def list_documents(self, *args, **kwargs):
+        started = time.perf_counter()
+        documents = await self._api.list_documents(*args, **kwargs)
+        return self._counted_stream("list_documents", documents, started, lambda d: True)
+
+    async def commit(self, *args, **kwargs):
+        request = kwargs.get("request") if "request" in kwargs else (args[0] if args else None)
+        writes = len(request["writes"]) if isinstance(request, dict) else len(getattr(request, "writes", []))
+        started = time.perf_counter()
+        try:
+            return await self._api.commit(*args, **kwargs)
+        finally:
+            record_operation("commit", writes=writes, rpcs=1, seconds=time.perf_counter() - started)
+
+    async def begin_transaction(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._api.begin_transaction(*args, **kwargs)
+        finally:
+            record_operation("begin_transaction", transactions=1, rpcs=1, seconds=time.perf_counter() - started)
+
+    async def rollback(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._api.rollback(*args, **kwargs)
+        finally:
+            record_operation("rollback", rpcs=1, seconds=time.perf_counter() - started)
+
+
+def instrument_client(client):
+    """Instala el conteo de operaciones en un cliente de google-cloud-firestore,
+    síncrono o asíncrono"""
+    api = client._firestore_api
+    if not isinstance(api, InstrumentedFirestoreApi):
+        wrapper = InstrumentedAsyncFirestoreApi if inspect.iscoroutinefunction(api.commit) else InstrumentedFirestoreApi
+        client._firestore_api_internal = wrapper(api)
+    return client
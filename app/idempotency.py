@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Hashable, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from google.api_core import exceptions
+
+from app.config import IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_STORE, IDEMPOTENCY_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_body(body) -> Optional[str]:
+    # Respuesta serializada como JSON compacto para ocupar poco espacio
+    return json.dumps(jsonable_encoder(body), separators=(",", ":")) if body is not None else None
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "status_code", "body", "detail", "done")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.status_code = None
+        self.body = None
+        self.detail = None
+        self.done = False
+
+
+class IdempotencyStore:
+    """Respuestas ya enviadas por Idempotency-Key, con TTL y tamaño máximo.
+
+    Una llave se reserva al empezar la solicitud y se completa con la
+    respuesta; mientras está reservada las repeticiones reciben 409. Las
+    llaves viven en la memoria del proceso: con varios workers un reintento
+    que llega a otro no las ve (IDEMPOTENCY_STORE=firestore las comparte).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.replays = 0
+        self.conflicts = 0
+
+    async def claim(self, db, key: Hashable, fingerprint: str):
+        """Devuelve (None, None) si la llave es nueva y queda reservada, o
+        ("replay" | "in_progress", entrada) si ya se había visto."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                if entry.done:
+                    self.replays += 1
+                    return "replay", entry
+                self.conflicts += 1
+                return "in_progress", entry
+
+            self._entries[key] = _Entry(fingerprint, now + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return None, None
+
+    async def complete(self, db, key: Hashable, status_code: int, body=None, detail=None) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.status_code = status_code
+            entry.body = _encode_body(body)
+            entry.detail = detail
+            entry.done = True
+
+    async def release(self, db, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "store": "memory",
+                "keys": len(self._entries),
+                "replays": self.replays,
+                "conflicts": self.conflicts,
+            }
+
+
+class FirestoreIdempotencyStore:
+    """Llaves de idempotencia compartidas entre workers e instancias.
+
+    Cada llave es un documento de 'idempotency_keys' que se reserva con
+    create(): si dos workers reciben la misma llave a la vez, solo uno lo
+    crea. El campo 'expires_at' sirve para una política TTL de Firestore que
+    borre las llaves vencidas; mientras tanto aquí también se ignoran. Una
+    reserva sin completar por más de `lock_seconds` (un worker que se cayó)
+    la puede tomar otra solicitud.
+    """
+
+    COLLECTION = "idempotency_keys"
+
+    def __init__(self, ttl: float, lock_seconds: float):
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.conflicts = 0
+
+    def _ref(self, db, key: Hashable):
+        # El scope y la llave del cliente pueden tener '/' u otros caracteres
+        # no válidos en un ID de documento
+        return db.collection(self.COLLECTION).document(hashlib.sha256(repr(key).encode()).hexdigest())
+
+    def _reservation(self, fingerprint: str, now: datetime) -> dict:
+        return {
+            "fingerprint": fingerprint,
+            "done": False,
+            "locked_until": now + timedelta(seconds=self.lock_seconds),
+            "expires_at": now + timedelta(seconds=self.ttl),
+        }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    async def claim(self, db, key: Hashable, fingerprint: str):
+        """Devuelve (None, None) si la llave es nueva y queda reservada, o
+        ("replay" | "in_progress", entrada) si ya se había visto."""
+        ref = self._ref(db, key)
+        now = datetime.now(timezone.utc)
+        try:
+            await ref.create(self._reservation(fingerprint, now))
+            return None, None
+        except exceptions.AlreadyExists:
+            pass
+
+        doc = await ref.get()
+        data = doc.to_dict() if doc.exists else None
+        if data is not None and data["expires_at"] > now:
+            if data["done"]:
+                entry = _Entry(data["fingerprint"], data["expires_at"])
+                entry.status_code = data["status_code"]
+                entry.body = data.get("body")
+                entry.detail = data.get("detail")
+                entry.done = True
+                self._count("replays")
+                return "replay", entry
+            if data["locked_until"] > now:
+                self._count("conflicts")
+                return "in_progress", _Entry(data["fingerprint"], data["expires_at"])
+
+        # Vencida, abandonada o recién borrada: se toma solo si nadie más la
+        # cambió desde la lectura
+        try:
+            if doc.exists:
+                await ref.update(
+                    self._reservation(fingerprint, now),
+                    option=db.write_option(last_update_time=doc.update_time)
+                )
+            else:
+                await ref.create(self._reservation(fingerprint, now))
+        except (exceptions.AlreadyExists, exceptions.FailedPrecondition):
+            self._count("conflicts")
+            return "in_progress", None
+        return None, None
+
+    async def complete(self, db, key: Hashable, status_code: int, body=None, detail=None) -> None:
+        await self._ref(db, key).update({
+            "done": True,
+            "status_code": status_code,
+            "body": _encode_body(body),
+            "detail": detail,
+        })
+
+    async def release(self, db, key: Hashable) -> None:
+        await self._ref(db, key).delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "store": "firestore",
+                "replays": self.replays,
+                "conflicts": self.conflicts,
+            }
+
+
+IDEMPOTENCY_STORES = ("firestore", "memory")
+
+if IDEMPOTENCY_STORE not in IDEMPOTENCY_STORES:
+    raise ValueError(
+        f"IDEMPOTENCY_STORE inválido: {IDEMPOTENCY_STORE}. Opciones: {', '.join(IDEMPOTENCY_STORES)}"
+    )
+
+if IDEMPOTENCY_STORE == "firestore":
+    idempotency_store = FirestoreIdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS)
+else:
+    idempotency_store = IdempotencyStore(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL_SECONDS)
+
+
+def request_fingerprint(payload) -> str:
+    """Huella del cuerpo de la solicitud para detectar llaves reutilizadas con otros datos"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+async def run_idempotent(
+    db,
+    idempotency_key: Optional[str],
+    scope: str,
+    fingerprint: str,
+    response: Response,
+    default_status: int,
+    handler: Callable,
+):
+    """Ejecuta y espera `handler` una sola vez por Idempotency-Key.
+
+    Las repeticiones reciben la respuesta guardada (también los errores
+    4xx) sin volver a ejecutar la operación. Los errores 409 y 5xx liberan
+    la llave para que el cliente pueda reintentar.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    key = (scope, idempotency_key)
+    state, entry = await idempotency_store.claim(db, key, fingerprint)
+    if state == "in_progress":
+        raise HTTPException(
+            status_code=409,
+            detail="Ya hay una solicitud en proceso con la misma Idempotency-Key"
+        )
+    if state == "replay":
+        if entry.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="La Idempotency-Key ya se usó con datos diferentes"
+            )
+        if entry.detail is not None:
+            raise HTTPException(
+                status_code=entry.status_code,
+                detail=entry.detail,
+                headers={"Idempotent-Replayed": "true"}
+            )
+        response.headers["Idempotent-Replayed"] = "true"
+        response.status_code = entry.status_code
+        return json.loads(entry.body)
+
+    try:
+        result = await handler()
+    except HTTPException as he:
+        # Los conflictos (409) y los 5xx son transitorios: se permite reintentar
+        if he.status_code < 500 and he.status_code != 409:
+            await idempotency_store.complete(db, key, he.status_code, detail=he.detail)
+        else:
+            await idempotency_store.release(db, key)
+        raise
+    except Exception:
+        await idempotency_store.release(db, key)
+        raise
+
+    try:
+        await idempotency_store.complete(db, key, response.status_code or default_status, body=result)
+    except Exception:
+        # La escritura ya se hizo: se responde igual. La llave queda reservada
+        # y un reintento recibe 409 hasta que venza IDEMPOTENCY_LOCK_SECONDS
+        logger.exception("No se pudo guardar la respuesta de la Idempotency-Key")
+    return result
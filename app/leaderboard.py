@@ -0,0 +1,304 @@
+import math
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+
+# Índice en memoria del ranking de puntos.
+#
+# Se implementa con una skip list indexable (cada enlace guarda cuántas
+# posiciones avanza), ordenada de forma ascendente por la llave
+# (points, user_id). El ranking se cuenta desde el final de la lista, lo
+# que coincide con el orden de Firestore para order_by("points", DESCENDING):
+# puntos descendentes y, en empate, el ID del documento descendente.
+
+_MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class _IndexableSkipList:
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVELS)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _search_chain(self, key):
+        # Devuelve el último nodo menor que la llave en cada nivel y
+        # cuántas posiciones se avanzaron en cada uno.
+        chain = [None] * _MAX_LEVELS
+        steps_at_level = [0] * _MAX_LEVELS
+        node = self._head
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps_at_level
+
+    def insert(self, key) -> None:
+        chain, steps_at_level = self._search_chain(key)
+        levels = min(_MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key) -> None:
+        chain, _ = self._search_chain(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), _MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def position(self, key) -> Optional[int]:
+        """Posición (base 1) de la llave, o None si no está."""
+        node = self._head
+        position = 0
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key <= key:
+                position += node.width[level]
+                node = node.next[level]
+        if node is self._head or node.key != key:
+            return None
+        return position
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+# Campos de ubicación copiados en 'user_points' que delimitan los rankings regionales
+LOCATION_FIELDS = ("city", "state")
+
+
+def location_fields(user_data: dict) -> dict:
+    """Ciudad y departamento del usuario que se copian en 'user_points'"""
+    return {field: user_data[field] for field in LOCATION_FIELDS if user_data.get(field)}
+
+
+class LeaderboardIndex:
+    """Ranking de usuarios por puntos con consultas de posición en O(log N).
+
+    Además del ranking global mantiene una lista por cada ciudad y
+    departamento. Es seguro para usarse desde varios hilos: la carga corre
+    en el pool de hilos y los listeners on_snapshot en hilos propios.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lists = {None: _IndexableSkipList()}
+        self._points = {}
+        self._locations = {}
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._lists[None])
+
+    @staticmethod
+    def _scopes(location: Optional[dict]):
+        scopes = [None]
+        for field in LOCATION_FIELDS:
+            value = (location or {}).get(field)
+            if value:
+                scopes.append((field, value))
+        return scopes
+
+    def _unlink(self, user_id: str) -> None:
+        current = self._points.get(user_id)
+        if current is None:
+            return
+        for scope in self._scopes(self._locations.get(user_id)):
+            self._lists[scope].remove((current, user_id))
+
+    def _link(self, user_id: str) -> None:
+        key = (self._points[user_id], user_id)
+        for scope in self._scopes(self._locations.get(user_id)):
+            skip_list = self._lists.get(scope)
+            if skip_list is None:
+                skip_list = self._lists[scope] = _IndexableSkipList()
+            skip_list.insert(key)
+
+    def load(self, entries: Iterable[Tuple[str, int, Optional[dict]]]) -> None:
+        """Reconstruye el índice a partir de tuplas (user_id, points, location)."""
+        fresh = LeaderboardIndex()
+        for user_id, user_points, location in entries:
+            fresh._unlink(user_id)
+            fresh._points[user_id] = user_points
+            fresh._locations[user_id] = location or {}
+            fresh._link(user_id)
+
+        with self._lock:
+            self._lists = fresh._lists
+            self._points = fresh._points
+            self._locations = fresh._locations
+            self.ready = True
+
+    def set_points(self, user_id: str, points: int, location: Optional[dict] = None) -> None:
+        with self._lock:
+            if self._points.get(user_id) == points and location is None:
+                return
+            self._unlink(user_id)
+            self._points[user_id] = points
+            if location is not None:
+                self._locations[user_id] = location
+            self._link(user_id)
+
+    def add_points(self, user_id: str, delta: int) -> None:
+        with self._lock:
+            self._unlink(user_id)
+            self._points[user_id] = self._points.get(user_id, 0) + delta
+            self._link(user_id)
+
+    def set_location(self, user_id: str, location: dict) -> None:
+        with self._lock:
+            if user_id not in self._points:
+                self._locations[user_id] = location
+                return
+            self._unlink(user_id)
+            self._locations[user_id] = location
+            self._link(user_id)
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._unlink(user_id)
+            self._points.pop(user_id, None)
+            self._locations.pop(user_id, None)
+
+    def get_points(self, user_id: str) -> Optional[int]:
+        return self._points.get(user_id)
+
+    def get_location(self, user_id: str) -> Optional[dict]:
+        return self._locations.get(user_id)
+
+    def snapshot(self) -> "LeaderboardSnapshot":
+        """Copia inmutable del estado actual del índice.
+
+        Bajo el lock solo se copian los puntos y las ubicaciones; ordenar y
+        repartir por ciudad y departamento se hace afuera, así las
+        escrituras y rank() no esperan a que se arme la foto.
+        """
+        with self._lock:
+            points = dict(self._points)
+            locations = dict(self._locations)
+
+        # Mismo orden que las skip lists recorridas desde el final
+        ranking = sorted(((user_points, user_id) for user_id, user_points in points.items()), reverse=True)
+        scopes = {None: []}
+        for user_points, user_id in ranking:
+            for scope in self._scopes(locations.get(user_id)):
+                scopes.setdefault(scope, []).append((user_id, user_points))
+        return LeaderboardSnapshot({scope: tuple(entries) for scope, entries in scopes.items()}, locations)
+
+    def rank(self, user_id: str, scope_field: str = None, scope_value: str = None) -> Optional[int]:
+        """Posición del usuario (1 es el primero) global o dentro de su
+        ciudad/departamento, o None si no está en ese ranking."""
+        with self._lock:
+            current = self._points.get(user_id)
+            if current is None:
+                return None
+            scope = None
+            if scope_field is not None:
+                if self._locations.get(user_id, {}).get(scope_field) != scope_value:
+                    return None
+                scope = (scope_field, scope_value)
+            skip_list = self._lists[scope]
+            return len(skip_list) - skip_list.position((current, user_id)) + 1
+
+
+class LeaderboardSnapshot:
+    """Foto inmutable del ranking global y regional.
+
+    Se reconstruye periódicamente y se publica reemplazando la referencia,
+    así que las lecturas son cortes de tuplas sin ningún lock.
+    """
+
+    def __init__(self, scopes: dict, locations: dict, built_at: datetime = None):
+        # scopes: {None | (campo, valor): ((user_id, points), ...)} ya ordenado
+        self._scopes = scopes
+        self._positions = {
+            scope: {user_id: i for i, (user_id, _) in enumerate(entries)}
+            for scope, entries in scopes.items()
+        }
+        self._locations = locations
+        self.built_at = built_at or datetime.now(timezone.utc)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Tuple[str, int, Optional[dict]]]) -> "LeaderboardSnapshot":
+        index = LeaderboardIndex()
+        index.load(entries)
+        return index.snapshot()
+
+    def __len__(self) -> int:
+        return len(self._scopes[None])
+
+    def location(self, user_id: str) -> dict:
+        return self._locations.get(user_id) or {}
+
+    @staticmethod
+    def _rows(entries, start: int) -> list:
+        return [
+            {"rank": start + i + 1, "user_id": user_id, "points": points}
+            for i, (user_id, points) in enumerate(entries)
+        ]
+
+    def top(self, limit: int, scope_field: str = None, scope_value: str = None) -> list:
+        scope = (scope_field, scope_value) if scope_field else None
+        entries = self._scopes.get(scope, ())
+        return self._rows(entries[:limit], 0)
+
+    def around(self, user_id: str, radius: int, scope_field: str = None) -> Optional[list]:
+        """Usuarios a `radius` posiciones o menos del usuario, o None si no está."""
+        scope = None
+        if scope_field:
+            scope_value = self.location(user_id).get(scope_field)
+            if not scope_value:
+                return None
+            scope = (scope_field, scope_value)
+
+        position = self._positions.get(scope, {}).get(user_id)
+        if position is None:
+            return None
+        start = max(0, position - radius)
+        return self._rows(self._scopes[scope][start:position + radius + 1], start)
+
+
+# Índice compartido por toda la aplicación
+leaderboard_index = LeaderboardIndex()
+
+# Última foto publicada del ranking; se reemplaza completa en cada reconstrucción
+_current_snapshot: Optional[LeaderboardSnapshot] = None
+
+
+def publish_snapshot(snapshot: LeaderboardSnapshot) -> None:
+    global _current_snapshot
+    _current_snapshot = snapshot
+
+
+def current_snapshot() -> Optional[LeaderboardSnapshot]:
+    return _current_snapshot
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import threading
+import time
+from functools import partial
+
+from fastapi.concurrency import run_in_threadpool
+from google.cloud.firestore_v1.watch import ChangeType
+
+from app.config import LEADERBOARD_LISTENER_CHECK_INTERVAL_SECONDS
+from app.leaderboard import LeaderboardIndex, leaderboard_index, location_fields
+
+logger = logging.getLogger(__name__)
+
+# Colecciones escuchadas: los puntos y la ubicación vigente de cada usuario
+LISTENED_COLLECTIONS = ("user_points", "users")
+
+
+class _ListenerState:
+    __slots__ = ("watch", "synced", "snapshots", "changes", "resyncs", "last_event_at")
+
+    def __init__(self):
+        self.watch = None
+        self.synced = threading.Event()
+        self.snapshots = 0
+        self.changes = 0
+        self.resyncs = 0
+        self.last_event_at = None
+
+
+class LeaderboardListeners:
+    """Mantiene el índice de ranking al día con listeners on_snapshot.
+
+    Otros workers y los scripts de administración escriben directamente en
+    'user_points'; con los listeners cada proceso recibe esos cambios como
+    deltas en vez de releer la colección. El primer snapshot de cada
+    listener trae la colección completa y reconstruye el estado; si el
+    stream se cierra, `ensure_active` vuelve a suscribirse y ese nuevo
+    snapshot inicial corrige lo que se perdió durante la desconexión.
+    """
+
+    def __init__(self, index: LeaderboardIndex):
+        self._index = index
+        self._lock = threading.Lock()
+        self._states = {collection: _ListenerState() for collection in LISTENED_COLLECTIONS}
+        # Ubicación según 'users'; tiene prioridad sobre la copia en 'user_points'
+        self._locations = {}
+        self._lag_count = 0
+        self._lag_total = 0.0
+        self._last_lag_seconds = None
+        self._max_lag_seconds = 0.0
+
+    def start(self, db) -> None:
+        for collection in LISTENED_COLLECTIONS:
+            self._subscribe(db, collection)
+
+    def _subscribe(self, db, collection: str) -> None:
+        state = self._states[collection]
+        state.synced.clear()
+        callback = partial(self._on_snapshot, collection)
+        state.watch = db.collection(collection).on_snapshot(callback)
+
+    def ensure_active(self, db) -> int:
+        """Vuelve a suscribir los listeners cuyo stream se cerró; devuelve cuántos"""
+        resubscribed = 0
+        for collection, state in self._states.items():
+            if state.watch is not None and state.watch.is_active:
+                continue
+            if state.watch is not None:
+                try:
+                    state.watch.unsubscribe()
+                except Exception:
+                    pass
+            logger.warning("Listener de '%s' desconectado; se vuelve a sincronizar", collection)
+            self._subscribe(db, collection)
+            state.resyncs += 1
+            resubscribed += 1
+        return resubscribed
+
+    async def run(self, db) -> None:
+        """Tarea de fondo que revisa periódicamente que los listeners sigan activos"""
+        while True:
+            await asyncio.sleep(LEADERBOARD_LISTENER_CHECK_INTERVAL_SECONDS)
+            try:
+                await run_in_threadpool(self.ensure_active, db)
+            except Exception:
+                logger.exception("No se pudieron volver a suscribir los listeners del ranking")
+
+    def wait_synced(self, timeout: float) -> bool:
+        """Espera el snapshot inicial de todos los listeners"""
+        deadline = time.monotonic() + timeout
+        for state in self._states.values():
+            if not state.synced.wait(max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def stop(self) -> None:
+        for state in self._states.values():
+            if state.watch is not None:
+                state.watch.unsubscribe()
+                state.watch = None
+
+    def _on_snapshot(self, collection: str, docs, changes, read_time) -> None:
+        # Se ejecuta en el hilo del listener; un error aquí no debe cortar el stream
+        state = self._states[collection]
+        initial = not state.synced.is_set()
+        try:
+            if collection == "users":
+                self._apply_users(docs, changes, initial)
+            else:
+                self._apply_points(docs, changes, initial)
+        except Exception:
+            logger.exception("No se pudo aplicar el snapshot de '%s'", collection)
+            return
+
+        with self._lock:
+            state.snapshots += 1
+            state.changes += len(changes)
+            state.last_event_at = time.time()
+            if not initial:
+                self._record_lag(changes, state.last_event_at)
+        if initial:
+            state.synced.set()
+
+    def _record_lag(self, changes, now: float) -> None:
+        # Tiempo entre el commit en Firestore y su aplicación en este proceso
+        for change in changes:
+            # Un documento eliminado llega con su última versión, no con la hora del borrado
+            update_time = change.document.update_time
+            if change.type == ChangeType.REMOVED or update_time is None:
+                continue
+            lag = max(0.0, now - update_time.timestamp())
+            self._lag_count += 1
+            self._lag_total += lag
+            self._last_lag_seconds = round(lag, 4)
+            self._max_lag_seconds = max(self._max_lag_seconds, lag)
+
+    def _location_for(self, user_id: str, points_data: dict) -> dict:
+        with self._lock:
+            location = self._locations.get(user_id)
+        return location if location is not None else location_fields(points_data)
+
+    def _apply_points(self, docs, changes, initial: bool) -> None:
+        if initial:
+            entries = []
+            for doc in docs:
+                data = doc.to_dict() or {}
+                entries.append((doc.id, data.get("points", 0), self._location_for(doc.id, data)))
+            self._index.load(entries)
+            return
+
+        for change in changes:
+            user_id = change.document.id
+            if change.type == ChangeType.REMOVED:
+                self._index.remove(user_id)
+                continue
+            data = change.document.to_dict() or {}
+            self._index.set_points(user_id, data.get("points", 0), self._location_for(user_id, data))
+
+    def _apply_users(self, docs, changes, initial: bool) -> None:
+        if initial:
+            with self._lock:
+                self._locations = {}
+            updates = [(doc.id, doc.to_dict() or {}) for doc in docs]
+        else:
+            updates = [
+                (change.document.id, None if change.type == ChangeType.REMOVED else change.document.to_dict() or {})
+                for change in changes
+            ]
+
+        for user_id, data in updates:
+            if data is None:
+                with self._lock:
+                    self._locations.pop(user_id, None)
+                continue
+            location = location_fields(data)
+            with self._lock:
+                self._locations[user_id] = location
+            if self._index.get_points(user_id) is not None and self._index.get_location(user_id) != location:
+                self._index.set_location(user_id, location)
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            listeners = {
+                collection: {
+                    "active": state.watch is not None and state.watch.is_active,
+                    "synced": state.synced.is_set(),
+                    "snapshots": state.snapshots,
+                    "changes": state.changes,
+                    "resyncs": state.resyncs,
+                    "seconds_since_last_event": (
+                        round(now - state.last_event_at, 3) if state.last_event_at is not None else None
+                    ),
+                }
+                for collection, state in self._states.items()
+            }
+            return {
+                "listeners": listeners,
+                "lag": {
+                    "changes": self._lag_count,
+                    "avg_seconds": round(self._lag_total / self._lag_count, 4) if self._lag_count else None,
+                    "last_seconds": self._last_lag_seconds,
+                    "max_seconds": round(self._max_lag_seconds, 4),
+                },
+            }
+
+
+leaderboard_listeners = LeaderboardListeners(leaderboard_index)
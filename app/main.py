@@ -1,4 +1,16 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import logging
+import time
+import anyio
+from contextlib import asynccontextmanager
+from functools import partial
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.crud import *
 from firebase_admin import credentials
 from fastapi import FastAPI, HTTPException, Path
@@ -8,30 +20,190 @@ from fastapi import FastAPI, HTTPException, status
 from app.schemas import ChallengeCreate, ChallengeResponse, ChallengeStatusResponse, ExpiredChallengesResponse
 from app.crud import create_challenge
 from fastapi import FastAPI, HTTPException, status
-from app.schemas import RewardCreate, RewardResponse
+from app.schemas import RewardCreate, RewardListItem, RewardResponse
 from app.schemas import ChallengeInstanceCreate, ChallengeInstanceResponse, ChallengeProgressResponse
+from app.schemas import BulkProgressRequest, BulkProgressResponse, BulkAssignmentRequest
 from app.crud import assign_challenge_to_user
 from app.schemas import ChallengesResponse
 from app.schemas import UserAssignedChallengesResponse
-from app.schemas import UserRankingResponse
+from app.schemas import UserRankingResponse, LeaderboardResponse, LeaderboardNeighborsResponse
+from app.config import BLOCKING_POOL_SIZE, CATALOG_PAGE_SIZE, CHALLENGE_EXPIRY_SCHEDULER, FIRESTORE_OP_ACCOUNTING, METRICS_ENABLED, TRACING_ENABLED, LEADERBOARD_LISTENERS, LEADERBOARD_LISTENER_SYNC_TIMEOUT_SECONDS, POINTS_COUNTER_MODE, POINTS_ROLLUP_INTERVAL_SECONDS, PROGRESS_UPDATE_MODE, PROGRESS_WRITE_BEHIND, STORAGE_BACKEND, USERS_PAGE_SIZE, LEADERBOARD_SNAPSHOT_INTERVAL_SECONDS, LEADERBOARD_SNAPSHOT_MAX_STALENESS_SECONDS
+from app.leaderboard import current_snapshot, leaderboard_index
+from app.listeners import leaderboard_listeners
+from app.cache import challenge_cache
+from app.counters import progress_counters
+from app.write_behind import progress_buffer
+from app.expiry import expiry_scheduler
+from app.firestore_ops import operation_metrics
+from app.tracing import record_span, setup_tracing, shutdown_tracing
+from app.middleware import RequestInstrumentation
+from app.metrics import metrics
+from app.idempotency import idempotency_store, request_fingerprint, run_idempotent
+from app.database import close_client, get_client, get_db, get_sync_client
+
+# Configuración Firebase (el motor en memoria no necesita credenciales)
+if STORAGE_BACKEND == "firestore":
+    cred = credentials.Certificate("app/firebase-key.json")
+    firebase_admin.initialize_app(cred)
+
+logger = logging.getLogger(__name__)
+
+
+async def refresh_leaderboard_snapshot():
+    # Reconstruir periódicamente la foto del ranking que sirve top y vecinos
+    while True:
+        try:
+            await rebuild_leaderboard_snapshot(get_client())
+        except Exception:
+            logger.exception("No se pudo reconstruir la foto del ranking")
+        await asyncio.sleep(LEADERBOARD_SNAPSHOT_INTERVAL_SECONDS)
+
+
+async def expire_due_challenges(db, challenge_ids):
+    disabled = await expire_challenges(db, challenge_ids)
+    if disabled:
+        logger.info("Challenges desactivados por vencimiento: %s", ", ".join(disabled))
+
+
+async def rollup_points_periodically():
+    # Llevar al documento padre los créditos en shards que aún no se sumaron
+    while True:
+        await asyncio.sleep(POINTS_ROLLUP_INTERVAL_SECONDS)
+        try:
+            await rollup_pending_points(get_client())
+        except Exception:
+            logger.exception("No se pudo recalcular el total de puntos de los shards")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los endpoints esperan a Firestore en el event loop con el cliente
+    # asíncrono; este pool de hilos queda para el trabajo bloqueante que
+    # aún se delega (ordenar el ranking, listeners on_snapshot)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = BLOCKING_POOL_SIZE
+
+    if TRACING_ENABLED and setup_tracing():
+        logger.info("Trazas de OpenTelemetry activas")
+
+    # Un solo cliente de Firestore (y su canal gRPC) para toda la aplicación;
+    # si pruebas o benchmarks ya registraron uno con init_client() se reutiliza
+    db = get_client()
+
+    # Con listeners el snapshot inicial de 'user_points' carga el índice y
+    # los cambios posteriores llegan como deltas
+    listeners_task = None
+    if LEADERBOARD_LISTENERS:
+        try:
+            # El cliente asíncrono no tiene on_snapshot; los listeners usan su copia síncrona
+            sync_db = get_sync_client()
+            await run_in_threadpool(leaderboard_listeners.start, sync_db)
+            listeners_task = asyncio.create_task(leaderboard_listeners.run(sync_db))
+        except Exception:
+            logger.exception("No se pudieron iniciar los listeners del ranking")
+
+    # Cargar el ranking en memoria una sola vez al iniciar
+    try:
+        if listeners_task is not None and await run_in_threadpool(
+            leaderboard_listeners.wait_synced, LEADERBOARD_LISTENER_SYNC_TIMEOUT_SECONDS
+        ):
+            logger.info("Índice de ranking cargado por los listeners con %d usuarios", len(leaderboard_index))
+        else:
+            loaded = await warm_leaderboard_index(db)
+            logger.info("Índice de ranking cargado con %d usuarios", loaded)
+    except Exception:
+        logger.exception("No se pudo cargar el índice de ranking; se usará la consulta completa")
+
+    # Programar la desactivación de los challenges activos con fecha límite
+    expiry_task = None
+    if CHALLENGE_EXPIRY_SCHEDULER:
+        try:
+            expiry_scheduler.load([deadline async for deadline in active_challenge_deadlines(db)])
+            logger.info("Programador de vencimientos con %d challenges", len(expiry_scheduler))
+        except Exception:
+            logger.exception("No se pudieron cargar las fechas límite de los challenges")
+        expiry_task = asyncio.create_task(expiry_scheduler.run(partial(expire_due_challenges, db)))
+
+    snapshot_task = asyncio.create_task(refresh_leaderboard_snapshot())
+    flush_task = asyncio.create_task(progress_buffer.run(db)) if PROGRESS_WRITE_BEHIND else None
+    rollup_task = asyncio.create_task(rollup_points_periodically()) if POINTS_COUNTER_MODE == "sharded" else None
+    yield
+    snapshot_task.cancel()
+    if flush_task is not None:
+        flush_task.cancel()
+        # Esperar a que la tarea termine de cancelarse para que el drain no
+        # se solape con un flush en curso
+        await asyncio.gather(flush_task, return_exceptions=True)
+        # Aplicar lo que quedó en la cola antes de cerrar el cliente
+        try:
+            applied = await progress_buffer.drain(db)
+            logger.info("Cola de progreso vaciada: %d eventos aplicados", applied)
+        except Exception:
+            logger.exception("No se pudo vaciar la cola de progreso")
+    if rollup_task is not None:
+        rollup_task.cancel()
+    if expiry_task is not None:
+        expiry_task.cancel()
+        expiry_scheduler.stop()
+    if listeners_task is not None:
+        listeners_task.cancel()
+        leaderboard_listeners.stop()
+    close_client()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Conteo de operaciones de Firestore, métricas y trazas de cada solicitud
+app.add_middleware(
+    RequestInstrumentation,
+    op_accounting=FIRESTORE_OP_ACCOUNTING,
+    metrics_enabled=METRICS_ENABLED,
+)
+
+
+async def _timed_stream(items, function: str):
+    """Mide el consumo de un generador asíncrono de crud como una llamada a `function`.
+
+    El trabajo de los generadores ocurre al enviar la respuesta, no al
+    llamarlos, así que la duración y el span se registran al terminar.
+    """
+    started = time.perf_counter()
+    try:
+        async for item in items:
+            yield item
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("crud_function_duration_seconds", elapsed, function=function)
+        record_span(f"crud.{function}", elapsed, {}, kind="INTERNAL")
+
 
-# Configuración Firebase
-cred = credentials.Certificate("app/firebase-key.json")
-firebase_admin.initialize_app(cred)
+async def _ndjson_lines(users):
+    async for user in users:
+        yield json.dumps(jsonable_encoder(user), ensure_ascii=False) + "\n"
 
-app = FastAPI()
 
-@app.get("/usuarios", summary="Obtener todos los usuarios", tags=["Usuarios"])
-async def get_all_users():
+@app.get("/usuarios", summary="Obtener usuarios por páginas", tags=["Usuarios"])
+async def get_all_users(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Usuarios por página (en modo stream, máximo a enviar)"),
+    start_after: Optional[str] = Query(None, description="ID del último usuario recibido (next_cursor de la página anterior)"),
+    stream: bool = Query(False, description="Enviar los usuarios como NDJSON a medida que se leen"),
+    db=Depends(get_db)
+):
     try:
-        db = firestore.client()
-        users_ref = db.collection("users")
-        users = [doc.to_dict() for doc in users_ref.stream()]
-        
-        if not users:
+        if stream:
+            return StreamingResponse(
+                _ndjson_lines(_timed_stream(iter_users(db, start_after, limit), "iter_users")),
+                media_type="application/x-ndjson"
+            )
+
+        page = await list_users(db, limit or USERS_PAGE_SIZE, start_after)
+        if not page["users"] and not start_after:
             raise HTTPException(status_code=404, detail="No se encontraron usuarios")
-            
-        return {"users": users, "count": len(users)}
+
+        return page
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -43,10 +215,11 @@ async def get_all_users():
          tags=["Puntos de Usuario"],
          summary="Obtener los puntos de un usuario")
 async def get_points(
-    user_id: str = Path(..., description="ID del usuario a consultar", min_length=1)
+    user_id: str = Path(..., description="ID del usuario a consultar", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        points_data = get_user_points(user_id)
+        points_data = await get_user_points(db, user_id)
         return {
             "success": True,
             "data": points_data
@@ -63,9 +236,9 @@ async def get_points(
 # Endpoint para inicializar puntos de un usuario
 
 @app.post("/usuarios/{user_id}/puntos/iniciar", tags=["Puntos de Usuario"], summary="Inicializar los puntos de un usuario a cero")
-async def init_points(user_id: str):
+async def init_points(user_id: str, db=Depends(get_db)):
     try:
-        init_user_points(user_id)
+        await init_user_points(db, user_id)
         return {"success": True, "message": "Puntos inicializados a 0"}
     except Exception as e:
         raise HTTPException(
@@ -73,6 +246,26 @@ async def init_points(user_id: str):
             detail=f"Error al inicializar puntos: {str(e)}"
         )
 
+# Endpoint para copiar la ciudad y el departamento del usuario en sus puntos
+
+@app.post("/usuarios/{user_id}/puntos/sincronizar-ubicacion",
+          tags=["Puntos de Usuario"],
+          summary="Sincronizar la ciudad y el departamento del usuario en sus puntos")
+async def sync_points_location(
+    user_id: str = Path(..., description="ID del usuario a sincronizar", min_length=1),
+    db=Depends(get_db)
+):
+    try:
+        location = await sync_user_points_location(db, user_id)
+        return {"success": True, "location": location, "message": "Ubicación sincronizada"}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al sincronizar la ubicación: {str(e)}"
+        )
+
 # Endpoint para crear un nuevo challenge
 
 @app.post("/retos",
@@ -80,10 +273,10 @@ async def init_points(user_id: str):
          status_code=status.HTTP_201_CREATED,
          tags=["Retos"],
          summary="Crear un nuevo reto")
-async def create_new_challenge(challenge: ChallengeCreate):
+async def create_new_challenge(challenge: ChallengeCreate, db=Depends(get_db)):
     try:
         challenge_data = challenge.dict()
-        created_challenge = create_challenge(challenge_data)
+        created_challenge = await create_challenge(db, challenge_data)
         return created_challenge
     except HTTPException as he:
         raise he
@@ -95,17 +288,42 @@ async def create_new_challenge(challenge: ChallengeCreate):
 
 # Endpoint para obtener todos los challenges
 
+def _split_fields(fields: Optional[str]) -> Optional[list]:
+    # "name,status" -> ["name", "status"]
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
 @app.get("/retos",
          response_model=ChallengesResponse,
+         response_model_exclude_unset=True,
          tags=["Retos"],
-         summary="Obtener todos los retos")
-async def get_challenges():
+         summary="Obtener retos por páginas")
+async def get_challenges(
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=1000, description="Retos por página"),
+    start_after: Optional[str] = Query(None, description="ID del último reto recibido (next_cursor de la página anterior)"),
+    status: Optional[str] = Query(None, pattern="^(active|inactive|completed|disabled)$", description="Filtrar por estado"),
+    reward_id: Optional[str] = Query(None, description="Filtrar por recompensa"),
+    max_date_from: Optional[datetime] = Query(None, description="Fecha límite desde (inclusive)"),
+    max_date_to: Optional[datetime] = Query(None, description="Fecha límite hasta (inclusive)"),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por coma, p. ej. name,status"),
+    db=Depends(get_db)
+):
     try:
-        challenges = get_all_challenges()
+        page = await list_challenges(
+            db, limit, start_after,
+            status=status,
+            reward_id=reward_id,
+            max_date_from=max_date_from,
+            max_date_to=max_date_to,
+            fields=_split_fields(fields),
+        )
         return {
             "success": True,
-            "challenges": challenges,
-            "count": len(challenges)
+            "challenges": page["items"],
+            "count": len(page["items"]),
+            "next_cursor": page["next_cursor"]
         }
     except HTTPException as he:
         raise he
@@ -119,13 +337,16 @@ async def get_challenges():
           response_model=ExpiredChallengesResponse,
           tags=["Retos"],
           summary="Desactivar challenges con fecha expirada")
-async def disable_expired_challenges_endpoint():
+async def disable_expired_challenges_endpoint(db=Depends(get_db)):
     try:
-        result = disable_expired_challenges()
+        result = await disable_expired_challenges(db)
         return {
-            "success": True, 
-            "message": result.get("message"), 
-            "disabled_count": result.get("disabled_count")
+            "success": result["failed_count"] == 0,
+            "message": result["message"],
+            "disabled_count": result["disabled_count"],
+            "failed_count": result["failed_count"],
+            "seconds": result["seconds"],
+            "chunks": result["chunks"]
         }
     except HTTPException as he:
         raise he
@@ -140,10 +361,11 @@ async def disable_expired_challenges_endpoint():
          tags=["Retos"],
          summary="Desactivar un reto")
 async def disable_challenge_endpoint(
-    challenge_id: str = Path(..., description="ID del challenge a desactivar")
+    challenge_id: str = Path(..., description="ID del challenge a desactivar"),
+    db=Depends(get_db)
 ):
     try:
-        result = disable_challenge(challenge_id)
+        result = await disable_challenge(db, challenge_id)
         return {"success": True, "message": result.get("message")}
     except HTTPException as he:
         raise he
@@ -158,10 +380,11 @@ async def disable_challenge_endpoint(
          tags=["Retos"],
          summary="Reactivar un reto")
 async def reactivate_challenge_endpoint(
-    challenge_id: str = Path(..., description="ID del challenge a reactivar")
+    challenge_id: str = Path(..., description="ID del challenge a reactivar"),
+    db=Depends(get_db)
 ):
     try:
-        result = reactivate_challenge(challenge_id)
+        result = await reactivate_challenge(db, challenge_id)
         return {"success": True, "message": result.get("message")}
     except HTTPException as he:
         raise he
@@ -172,6 +395,54 @@ async def reactivate_challenge_endpoint(
         )
 
 
+@app.get("/metricas/cache",
+         tags=["Métricas"],
+         summary="Obtener las métricas de la caché de retos")
+async def get_cache_metrics():
+    return {"success": True, "challenge_cache": challenge_cache.stats(), "idempotency": idempotency_store.stats()}
+
+
+@app.get("/metricas/progreso",
+         tags=["Métricas"],
+         summary="Obtener reintentos y abortos al actualizar el progreso")
+async def get_progress_metrics():
+    return {
+        "success": True,
+        "mode": PROGRESS_UPDATE_MODE,
+        "counters": progress_counters.snapshot(),
+        "write_behind": progress_buffer.stats() if PROGRESS_WRITE_BEHIND else None
+    }
+
+
+@app.get("/metrics",
+         tags=["Métricas"],
+         summary="Métricas en formato de Prometheus",
+         response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Las métricas están deshabilitadas")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/metricas/firestore",
+         tags=["Métricas"],
+         summary="Obtener las operaciones de Firestore acumuladas por ruta")
+async def get_firestore_metrics():
+    return {"success": True, "enabled": FIRESTORE_OP_ACCOUNTING, **operation_metrics.snapshot()}
+
+
+@app.get("/metricas/ranking",
+         tags=["Métricas"],
+         summary="Obtener el estado y el retraso de los listeners del ranking")
+async def get_leaderboard_metrics():
+    return {
+        "success": True,
+        "indexed_users": len(leaderboard_index),
+        "listeners_enabled": LEADERBOARD_LISTENERS,
+        **(leaderboard_listeners.stats() if LEADERBOARD_LISTENERS else {})
+    }
+
+
 # Endpoint para obtener todas las recompensas y Crear nuevas recompensas
 
 @app.post("/recompensas",
@@ -179,10 +450,10 @@ async def reactivate_challenge_endpoint(
          status_code=status.HTTP_201_CREATED,
          tags=["Recompensas"],
          summary="Crear una nueva recompensa")
-async def create_new_reward(reward: RewardCreate):
+async def create_new_reward(reward: RewardCreate, db=Depends(get_db)):
     try:
         reward_data = reward.dict()
-        created_reward = create_reward(reward_data)
+        created_reward = await create_reward(db, reward_data)
         return created_reward
     except HTTPException as he:
         raise he
@@ -193,12 +464,24 @@ async def create_new_reward(reward: RewardCreate):
         )
 
 @app.get("/recompensas",
-        response_model=list[RewardResponse],
+        response_model=List[RewardListItem],
+        response_model_exclude_unset=True,
         tags=["Recompensas"],
-        summary="Obtener todas las recompensas")
-async def get_rewards():
+        summary="Obtener las recompensas, completas o por páginas")
+async def get_rewards(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Recompensas por página; sin él se devuelven todas"),
+    start_after: Optional[str] = Query(None, description="ID de la última recompensa recibida (cabecera X-Next-Cursor de la página anterior)"),
+    type: Optional[str] = Query(None, description="Filtrar por tipo de recompensa"),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por coma, p. ej. type,value"),
+    db=Depends(get_db)
+):
     try:
-        return get_all_rewards()
+        page = await list_rewards(db, limit, start_after, reward_type=type, fields=_split_fields(fields))
+        # La respuesta sigue siendo la lista de siempre; el cursor va en una cabecera
+        if page["next_cursor"] is not None:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return page["items"]
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -214,11 +497,19 @@ async def get_rewards():
          status_code=status.HTTP_201_CREATED,
          tags=["Instancias de Retos"],
          summary="Asignar un reto a un usuario")
-async def create_challenge_instance(instance: ChallengeInstanceCreate):
+async def create_challenge_instance(
+    instance: ChallengeInstanceCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db=Depends(get_db)
+):
     try:
         instance_data = instance.dict()
-        created_instance = assign_challenge_to_user(instance_data)
-        return created_instance
+        return await run_idempotent(
+            db, idempotency_key, "POST /instancias-retos", request_fingerprint(instance_data),
+            response, status.HTTP_201_CREATED,
+            lambda: assign_challenge_to_user(db, instance_data)
+        )
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -227,22 +518,47 @@ async def create_challenge_instance(instance: ChallengeInstanceCreate):
             detail=f"Error interno al asignar challenge: {str(e)}"
         )
 
+# Endpoint para asignar un challenge a una cohorte de usuarios
+
+@app.post("/instancias-retos/lote",
+         tags=["Instancias de Retos"],
+         summary="Asignar un reto a muchos usuarios",
+         response_description="NDJSON con una línea de avance por bloque y una final con los totales")
+async def create_challenge_instances_bulk(request: BulkAssignmentRequest, db=Depends(get_db)):
+    if (request.user_ids is None) == (request.user_filter is None):
+        raise HTTPException(status_code=400, detail="Indique 'user_ids' o 'user_filter', pero no ambos")
+    user_filters = request.user_filter.dict(exclude_none=True) if request.user_filter else None
+
+    try:
+        progress = await assign_challenge_to_users(db, request.challenge_id, request.user_ids, user_filters)
+        progress = _timed_stream(progress, "assign_challenge_to_users")
+        return StreamingResponse(_ndjson_lines(progress), media_type="application/x-ndjson")
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error interno al asignar challenge en lote: {str(e)}"
+        )
+
 # Endpoint para obtener los challenges asignados a un usuario específico
 
 @app.get("/usuarios/{user_id}/retos-asignados",
          response_model=UserAssignedChallengesResponse,
          tags=["Retos de Usuario"],
          summary="Obtener los retos asignados a un usuario")
-def get_user_assigned_challenges_endpoint(
-    user_id: str = Path(..., description="ID del usuario para obtener sus challenges asignados", min_length=1)
+async def get_user_assigned_challenges_endpoint(
+    user_id: str = Path(..., description="ID del usuario para obtener sus challenges asignados", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        challenges = get_user_assigned_challenges(user_id)
+        result = await get_user_assigned_challenges(db, user_id)
         return {
             "success": True,
             "user_id": user_id,
-            "challenges": challenges,
-            "count": len(challenges)
+            "challenges": result["challenges"],
+            "count": len(result["challenges"]),
+            "round_trips_saved": result["round_trips_saved"]
         }
     except HTTPException as he:
         raise he
@@ -257,16 +573,18 @@ def get_user_assigned_challenges_endpoint(
          response_model=UserAssignedChallengesResponse,
          tags=["Retos de Usuario"],
          summary="Obtener los retos completados de un usuario")
-def get_user_completed_challenges_endpoint(
-    user_id: str = Path(..., description="ID del usuario para obtener sus challenges completados", min_length=1)
+async def get_user_completed_challenges_endpoint(
+    user_id: str = Path(..., description="ID del usuario para obtener sus challenges completados", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        challenges = get_user_completed_challenges(user_id)
+        result = await get_user_completed_challenges(db, user_id)
         return {
             "success": True,
             "user_id": user_id,
-            "challenges": challenges,
-            "count": len(challenges)
+            "challenges": result["challenges"],
+            "count": len(result["challenges"]),
+            "round_trips_saved": result["round_trips_saved"]
         }
     except HTTPException as he:
         raise he
@@ -277,16 +595,54 @@ def get_user_completed_challenges_endpoint(
         )
 
 
+# Declarado antes de /progreso-reto/{instance_id} para que "lote" no se tome como ID
+
+@app.post("/progreso-reto/lote",
+         response_model=BulkProgressResponse,
+         response_model_exclude_none=True,
+         tags=["Instancias de Retos"],
+         summary="Actualizar el progreso de muchas instancias en una sola solicitud")
+async def bulk_progress_endpoint(request: BulkProgressRequest, db=Depends(get_db)):
+    try:
+        result = await update_challenge_progress_bulk(
+            db, [(event.instance_id, event.count) for event in request.events]
+        )
+        # Con un fallo parcial se informa qué quedó sin aplicar en vez de
+        # responder 500: reenviar todo repetiría los batches ya confirmados
+        return {"success": result["error"] is None, **result}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al actualizar el progreso en lote: {str(e)}"
+        )
+
+
 @app.post("/progreso-reto/{instance_id}",
          response_model=ChallengeProgressResponse,
          tags=["Instancias de Retos"],
          summary="Actualizar progreso en un reto")
 async def progress_in_challenge_endpoint(
-    instance_id: str = Path(..., description="ID de la instancia del challenge")
+    response: Response,
+    instance_id: str = Path(..., description="ID de la instancia del challenge"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db=Depends(get_db)
 ):
-    try:
-        result = update_challenge_progress(instance_id)
+    async def apply_progress():
+        if PROGRESS_WRITE_BEHIND:
+            progress_buffer.add(instance_id)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"success": True, "message": "Progreso recibido, se aplicará en segundo plano"}
+
+        result = await update_challenge_progress(db, instance_id)
         return {"success": True, "message": result.get("message")}
+
+    try:
+        return await run_idempotent(
+            db, idempotency_key, f"POST /progreso-reto/{instance_id}", "",
+            response, status.HTTP_200_OK, apply_progress
+        )
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -296,15 +652,118 @@ async def progress_in_challenge_endpoint(
         )
 
 
+# Endpoints del ranking servidos desde la foto en memoria
+
+def _leaderboard_snapshot():
+    snapshot = current_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="El ranking aún no está disponible, intenta de nuevo en unos segundos")
+    return snapshot
+
+
+def _leaderboard_response(snapshot, entries: list, **extra) -> dict:
+    staleness = (datetime.now(timezone.utc) - snapshot.built_at).total_seconds()
+    return {
+        "success": True,
+        "entries": entries,
+        "count": len(entries),
+        "generated_at": snapshot.built_at,
+        "staleness_seconds": round(staleness, 3),
+        "stale": staleness > LEADERBOARD_SNAPSHOT_MAX_STALENESS_SECONDS,
+        **extra
+    }
+
+
+def _leaderboard_neighbors(user_id: str, radius: int, scope_field: str = None) -> dict:
+    snapshot = _leaderboard_snapshot()
+    entries = snapshot.around(user_id, radius, scope_field)
+    if entries is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"El usuario con ID {user_id} no aparece en el ranking"
+        )
+    rank = next(entry["rank"] for entry in entries if entry["user_id"] == user_id)
+    return _leaderboard_response(snapshot, entries, user_id=user_id, rank=rank)
+
+
+@app.get("/ranking/top",
+         response_model=LeaderboardResponse,
+         tags=["Ranking"],
+         summary="Obtener los primeros usuarios del ranking global")
+async def get_leaderboard_top(
+    limit: int = Query(10, ge=1, le=100, description="Cantidad de usuarios a devolver")
+):
+    snapshot = _leaderboard_snapshot()
+    return _leaderboard_response(snapshot, snapshot.top(limit))
+
+
+@app.get("/ranking/ciudad/top",
+         response_model=LeaderboardResponse,
+         tags=["Ranking"],
+         summary="Obtener los primeros usuarios del ranking de una ciudad")
+async def get_leaderboard_top_by_city(
+    ciudad: str = Query(..., min_length=1, description="Ciudad a consultar"),
+    limit: int = Query(10, ge=1, le=100, description="Cantidad de usuarios a devolver")
+):
+    snapshot = _leaderboard_snapshot()
+    return _leaderboard_response(snapshot, snapshot.top(limit, "city", ciudad))
+
+
+@app.get("/ranking/departamento/top",
+         response_model=LeaderboardResponse,
+         tags=["Ranking"],
+         summary="Obtener los primeros usuarios del ranking de un departamento")
+async def get_leaderboard_top_by_state(
+    departamento: str = Query(..., min_length=1, description="Departamento a consultar"),
+    limit: int = Query(10, ge=1, le=100, description="Cantidad de usuarios a devolver")
+):
+    snapshot = _leaderboard_snapshot()
+    return _leaderboard_response(snapshot, snapshot.top(limit, "state", departamento))
+
+
+@app.get("/ranking/{user_id}/vecinos",
+         response_model=LeaderboardNeighborsResponse,
+         tags=["Ranking"],
+         summary="Obtener los usuarios alrededor de un usuario en el ranking global")
+async def get_leaderboard_neighbors(
+    user_id: str = Path(..., description="ID del usuario", min_length=1),
+    radius: int = Query(5, ge=1, le=50, description="Posiciones antes y después del usuario")
+):
+    return _leaderboard_neighbors(user_id, radius)
+
+
+@app.get("/ranking/ciudad/{user_id}/vecinos",
+         response_model=LeaderboardNeighborsResponse,
+         tags=["Ranking"],
+         summary="Obtener los usuarios alrededor de un usuario en el ranking de su ciudad")
+async def get_leaderboard_neighbors_by_city(
+    user_id: str = Path(..., description="ID del usuario", min_length=1),
+    radius: int = Query(5, ge=1, le=50, description="Posiciones antes y después del usuario")
+):
+    return _leaderboard_neighbors(user_id, radius, "city")
+
+
+@app.get("/ranking/departamento/{user_id}/vecinos",
+         response_model=LeaderboardNeighborsResponse,
+         tags=["Ranking"],
+         summary="Obtener los usuarios alrededor de un usuario en el ranking de su departamento")
+async def get_leaderboard_neighbors_by_state(
+    user_id: str = Path(..., description="ID del usuario", min_length=1),
+    radius: int = Query(5, ge=1, le=50, description="Posiciones antes y después del usuario")
+):
+    return _leaderboard_neighbors(user_id, radius, "state")
+
+
 @app.get("/ranking/{user_id}",
          response_model=UserRankingResponse,
          tags=["Ranking"],
          summary="Obtener el ranking de un usuario")
 async def get_user_ranking(
-    user_id: str = Path(..., description="ID del usuario para consultar su ranking", min_length=1)
+    user_id: str = Path(..., description="ID del usuario para consultar su ranking", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        rank = get_user_rank(user_id)
+        rank = await get_user_rank(db, user_id)
         return {
             "success": True,
             "user_id": user_id,
@@ -324,10 +783,11 @@ async def get_user_ranking(
          tags=["Ranking"],
          summary="Obtener el ranking de un usuario por ciudad")
 async def get_user_ranking_by_city(
-    user_id: str = Path(..., description="ID del usuario para consultar su ranking por ciudad", min_length=1)
+    user_id: str = Path(..., description="ID del usuario para consultar su ranking por ciudad", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        rank = get_user_rank_by_city(user_id)
+        rank = await get_user_rank_by_city(db, user_id)
         return {
             "success": True,
             "user_id": user_id,
@@ -348,10 +808,11 @@ async def get_user_ranking_by_city(
          tags=["Ranking"],
          summary="Obtener el ranking de un usuario por departamento")
 async def get_user_ranking_by_state(
-    user_id: str = Path(..., description="ID del usuario para consultar su ranking por departamento", min_length=1)
+    user_id: str = Path(..., description="ID del usuario para consultar su ranking por departamento", min_length=1),
+    db=Depends(get_db)
 ):
     try:
-        rank = get_user_rank_by_state(user_id)
+        rank = await get_user_rank_by_state(db, user_id)
         return {
             "success": True,
             "user_id": user_id,
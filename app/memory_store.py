@@ -0,0 +1,1161 @@
+"""Motor de almacenamiento en memoria compatible con el cliente de Firestore.
+
+Implementa el subconjunto de la API de ``google.cloud.firestore`` que usa
+``app/crud.py``: colecciones y subcolecciones, documentos, consultas con
+filtros, orden, cursores, límites y proyecciones, agregaciones ``count()``,
+``get_all``, batches, transacciones compatibles con
+``firestore.transactional`` y ``on_snapshot`` sobre consultas. Así CI y los benchmarks ejecutan el mismo
+código de crud sin red ni credenciales (``STORAGE_BACKEND=memory``).
+``AsyncMemoryClient`` ofrece la misma interfaz que ``firestore.AsyncClient``
+(y ``firestore.async_transactional``) sobre los mismos datos.
+
+Cada colección mantiene índices de igualdad sobre ``INDEXED_FIELDS`` y un
+índice ordenado sobre ``RANGE_INDEXED_FIELDS`` para no recorrer toda la
+colección en las consultas más comunes. Todas las operaciones están
+protegidas por un lock, por lo que el cliente es seguro entre hilos.
+"""
+import asyncio
+import bisect
+import queue
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1._helpers import ExistsOption, LastUpdateOption, encode_value
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+from google.cloud.firestore_v1.base_client import BaseClient
+from google.cloud.firestore_v1.base_collection import _auto_id
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+from app.firestore_ops import aggregation_reads, record_operation
+
+# Campos con índice de igualdad (==, in) en todas las colecciones
+INDEXED_FIELDS = ("user_id", "completed", "status", "max_date", "city", "state")
+
+# Campos con índice ordenado para filtros de rango (<, <=, >, >=)
+RANGE_INDEXED_FIELDS = ("max_date",)
+
+# Límite de escrituras por batch o transacción de Firestore
+MAX_WRITES_PER_COMMIT = 500
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+_MISSING = object()
+_INEQUALITY_OPS = ("<", "<=", ">", ">=", "!=", "not-in")
+
+# Como en Firestore, transform_results trae el valor final de cada
+# transformación (Increment, SERVER_TIMESTAMP...) ordenado por campo
+MemoryWriteResult = namedtuple("MemoryWriteResult", ["update_time", "transform_results"])
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# --- Valores ---------------------------------------------------------------
+
+def _normalize(value):
+    # Firestore guarda los datetime en UTC y trata los "naive" como UTC
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _value_key(value):
+    """Llave comparable que respeta el orden entre tipos de Firestore."""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, MemoryDocumentReference):
+        return (6, value._path)
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(_value_key(item) for item in value))
+    if isinstance(value, dict):
+        return (9, tuple(sorted((key, _value_key(item)) for key, item in value.items())))
+    return (10, repr(value))
+
+
+class _Descending:
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _get_field(data: dict, field_path: str):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_field(data: dict, field_path: str, value) -> None:
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        child = data.get(part)
+        if not isinstance(child, dict):
+            child = data[part] = {}
+        data = child
+    data[parts[-1]] = value
+
+
+def _delete_field(data: dict, field_path: str) -> None:
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def _apply_value(data: dict, field_path: str, value, now: datetime, results: list = None) -> None:
+    """Escribe un valor resolviendo los centinelas y transformaciones.
+
+    Si se pasa ``results`` se le agregan (campo, valor) de cada transformación.
+    """
+    if value is transforms.DELETE_FIELD:
+        _delete_field(data, field_path)
+    elif value is transforms.SERVER_TIMESTAMP:
+        _set_field(data, field_path, now)
+        if results is not None:
+            results.append((field_path, now))
+    elif isinstance(value, transforms.Increment):
+        current = _get_field(data, field_path)
+        if isinstance(current, bool) or not isinstance(current, (int, float)):
+            current = 0
+        _set_field(data, field_path, current + value.value)
+        if results is not None:
+            results.append((field_path, current + value.value))
+    elif isinstance(value, transforms.ArrayUnion):
+        current = _get_field(data, field_path)
+        current = list(current) if isinstance(current, list) else []
+        for item in _normalize(value.values):
+            if item not in current:
+                current.append(item)
+        _set_field(data, field_path, current)
+        if results is not None:
+            results.append((field_path, None))
+    elif isinstance(value, transforms.ArrayRemove):
+        current = _get_field(data, field_path)
+        current = list(current) if isinstance(current, list) else []
+        removed = _normalize(value.values)
+        _set_field(data, field_path, [item for item in current if item not in removed])
+        if results is not None:
+            results.append((field_path, None))
+    elif isinstance(value, dict):
+        # Los mapas pueden contener transformaciones anidadas
+        if not isinstance(_get_field(data, field_path), dict):
+            _set_field(data, field_path, {})
+        for key, item in value.items():
+            _apply_value(data, f"{field_path}.{key}", item, now, results)
+    else:
+        _set_field(data, field_path, _normalize(value))
+
+
+# --- Almacenamiento ----------------------------------------------------------
+
+class _StoredDocument:
+    __slots__ = ("data", "create_time", "update_time", "version")
+
+    def __init__(self, data, create_time, update_time, version):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.version = version
+
+
+class _Collection:
+    def __init__(self):
+        self.docs = {}
+        self.eq_index = {field: {} for field in INDEXED_FIELDS}
+        self.range_index = {field: [] for field in RANGE_INDEXED_FIELDS}
+
+    def _index(self, doc_id: str, data: dict, add: bool) -> None:
+        for field, index in self.eq_index.items():
+            value = data.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            key = _value_key(value)
+            if add:
+                index.setdefault(key, set()).add(doc_id)
+            else:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del index[key]
+        for field, index in self.range_index.items():
+            value = data.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            entry = (_value_key(value), doc_id)
+            if add:
+                bisect.insort(index, entry)
+            else:
+                position = bisect.bisect_left(index, entry)
+                if position < len(index) and index[position] == entry:
+                    index.pop(position)
+
+    def put(self, doc_id: str, data: dict, now: datetime, version: int) -> None:
+        current = self.docs.get(doc_id)
+        if current is None:
+            self.docs[doc_id] = _StoredDocument(data, now, now, version)
+        else:
+            self._index(doc_id, current.data, add=False)
+            current.data = data
+            current.update_time = now
+            current.version = version
+        self._index(doc_id, data, add=True)
+
+    def remove(self, doc_id: str) -> None:
+        current = self.docs.pop(doc_id, None)
+        if current is not None:
+            self._index(doc_id, current.data, add=False)
+
+    def candidates(self, filters):
+        """IDs a evaluar para los filtros usando los índices disponibles."""
+        candidates = None
+        for field, op, value in filters:
+            index = self.eq_index.get(field)
+            if index is None:
+                continue
+            if op == "==":
+                ids = index.get(_value_key(value), set())
+            elif op == "in":
+                ids = set()
+                for item in value:
+                    ids |= index.get(_value_key(item), set())
+            else:
+                continue
+            candidates = set(ids) if candidates is None else candidates & ids
+        if candidates is not None:
+            return candidates
+
+        for field, op, value in filters:
+            index = self.range_index.get(field)
+            if index is None or op not in ("<", "<=", ">", ">="):
+                continue
+            key = _value_key(value)
+            if op in (">", ">="):
+                start = bisect.bisect_right(index, (key, "￿")) if op == ">" else bisect.bisect_left(index, (key,))
+                return {doc_id for _, doc_id in index[start:]}
+            end = bisect.bisect_left(index, (key,)) if op == "<" else bisect.bisect_right(index, (key, "￿"))
+            return {doc_id for _, doc_id in index[:end]}
+
+        return self.docs.keys()
+
+
+class MemoryDocumentSnapshot:
+    __slots__ = ("_reference", "_data", "_exists", "_version", "create_time", "update_time", "read_time")
+
+    def __init__(self, reference, data, exists, create_time=None, update_time=None,
+                 read_time=None, version=None):
+        self._reference = reference
+        self._data = data
+        self._exists = exists
+        self._version = version
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self) -> str:
+        return self._reference.id
+
+    @property
+    def reference(self):
+        return self._reference
+
+    @property
+    def exists(self) -> bool:
+        return self._exists
+
+    def to_dict(self):
+        if not self._exists:
+            return None
+        return _copy(self._data)
+
+    def get(self, field_path: str):
+        if not self._exists:
+            return None
+        value = _get_field(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(f"No se encontró el campo {field_path}")
+        return _copy(value)
+
+
+# --- Referencias y consultas -------------------------------------------------
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection_path: str, doc_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+        self._path = tuple(self.path.split("/"))
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<MemoryDocumentReference {self.path}>"
+
+    @property
+    def parent(self):
+        return self._client._collection_class(self._client, self._collection_path)
+
+    def collection(self, collection_id: str):
+        return self._client._collection_class(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        started = time.perf_counter()
+        self._client._round_trip()
+        return self._finish_get(self._client._read(self, field_paths), transaction, started)
+
+    @staticmethod
+    def _finish_get(snapshot, transaction, started: float):
+        record_operation("batch_get_documents", reads=1, rpcs=1, seconds=time.perf_counter() - started)
+        if transaction is not None:
+            transaction._record_read(snapshot)
+        return snapshot
+
+    def create(self, document_data: dict):
+        return self._client._commit_writes([("create", self, document_data, None)])[0]
+
+    def set(self, document_data: dict, merge: bool = False):
+        op = "merge" if merge else "set"
+        return self._client._commit_writes([(op, self, document_data, None)])[0]
+
+    def update(self, field_updates: dict, option=None):
+        return self._client._commit_writes([("update", self, field_updates, option)])[0]
+
+    def delete(self, option=None):
+        return self._client._commit_writes([("delete", self, None, option)])[0].update_time
+
+
+class MemoryQuery:
+    DESCENDING = DESCENDING
+    ASCENDING = ASCENDING
+
+    def __init__(self, client, collection_path: str, filters=(), orders=(), limit=None,
+                 offset=0, projection=None, start=None, end=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._projection = projection
+        self._start = start
+        self._end = end
+
+    def _copy_with(self, **changes):
+        params = {
+            "filters": self._filters, "orders": self._orders, "limit": self._limit,
+            "offset": self._offset, "projection": self._projection,
+            "start": self._start, "end": self._end,
+        }
+        params.update(changes)
+        return self._client._query_class(self._client, self._collection_path, **params)
+
+    def _document(self, doc_id: str):
+        return self._client._document_class(self._client, self._collection_path, doc_id)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if field_path == "__name__":
+            if isinstance(value, str):
+                value = self._document(value)
+            elif op_string in ("in", "not-in"):
+                value = [self._document(item) if isinstance(item, str) else item for item in value]
+        else:
+            value = _normalize(value)
+        return self._copy_with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING):
+        return self._copy_with(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy_with(limit=count)
+
+    def offset(self, num_to_skip: int):
+        return self._copy_with(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy_with(projection=tuple(field_paths))
+
+    def _cursor(self, document_fields, before: bool):
+        return (document_fields, before)
+
+    def start_at(self, document_fields):
+        return self._copy_with(start=self._cursor(document_fields, True))
+
+    def start_after(self, document_fields):
+        return self._copy_with(start=self._cursor(document_fields, False))
+
+    def end_before(self, document_fields):
+        return self._copy_with(end=self._cursor(document_fields, True))
+
+    def end_at(self, document_fields):
+        return self._copy_with(end=self._cursor(document_fields, False))
+
+    def count(self, alias: str = None):
+        return self._client._aggregation_class(self, alias or "field_1")
+
+    def sum(self, field_ref: str, alias: str = None):
+        return self._client._aggregation_class(self, alias or "field_1", field_ref)
+
+    def _normalized_orders(self):
+        orders = list(self._orders)
+        if not orders:
+            for field, op, _ in self._filters:
+                if op in _INEQUALITY_OPS:
+                    orders.append((field, ASCENDING))
+                    break
+        if "__name__" not in [field for field, _ in orders]:
+            orders.append(("__name__", orders[-1][1] if orders else ASCENDING))
+        return orders
+
+    def _cursor_key(self, cursor, orders):
+        document_fields, _ = cursor
+        if isinstance(document_fields, MemoryDocumentSnapshot):
+            values = []
+            for field, _ in orders:
+                if field == "__name__":
+                    values.append(document_fields.reference)
+                else:
+                    values.append(document_fields.get(field))
+        elif isinstance(document_fields, dict):
+            values = []
+            for field, _ in orders:
+                if field not in document_fields:
+                    break
+                value = document_fields[field]
+                if field == "__name__" and isinstance(value, str):
+                    value = self._document(value)
+                values.append(value)
+        else:
+            values = list(document_fields)
+        return tuple(
+            _Descending(_value_key(_normalize(value))) if direction == DESCENDING else _value_key(_normalize(value))
+            for value, (_, direction) in zip(values, orders)
+        )
+
+    def _matches(self, doc_id: str, data: dict) -> bool:
+        for field, op, value in self._filters:
+            if field == "__name__":
+                actual = self._document(doc_id)
+            else:
+                actual = _get_field(data, field)
+                if actual is _MISSING:
+                    return False
+            actual_key = _value_key(actual)
+            if op == "==":
+                ok = actual_key == _value_key(value)
+            elif op == "!=":
+                ok = actual_key != _value_key(value)
+            elif op == "<":
+                ok = actual_key[0] == _value_key(value)[0] and actual_key < _value_key(value)
+            elif op == "<=":
+                ok = actual_key[0] == _value_key(value)[0] and actual_key <= _value_key(value)
+            elif op == ">":
+                ok = actual_key[0] == _value_key(value)[0] and actual_key > _value_key(value)
+            elif op == ">=":
+                ok = actual_key[0] == _value_key(value)[0] and actual_key >= _value_key(value)
+            elif op == "in":
+                ok = actual_key in {_value_key(item) for item in value}
+            elif op == "not-in":
+                ok = actual_key not in {_value_key(item) for item in value}
+            elif op == "array-contains":
+                ok = isinstance(actual, list) and _value_key(value) in {_value_key(item) for item in actual}
+            elif op == "array-contains-any":
+                ok = isinstance(actual, list) and bool(
+                    {_value_key(item) for item in actual} & {_value_key(item) for item in value}
+                )
+            else:
+                raise ValueError(f"Operador no soportado: {op}")
+            if not ok:
+                return False
+        return True
+
+    def _run(self):
+        """Documentos (doc_id, almacenado) que cumplen la consulta, en orden."""
+        collection = self._client._collections.get(self._collection_path)
+        if collection is None:
+            return []
+
+        orders = self._normalized_orders()
+        rows = []
+        for doc_id in collection.candidates(self._filters):
+            stored = collection.docs.get(doc_id)
+            if stored is None or not self._matches(doc_id, stored.data):
+                continue
+            sort_key = []
+            for field, direction in orders:
+                if field == "__name__":
+                    value = self._document(doc_id)
+                else:
+                    value = _get_field(stored.data, field)
+                    if value is _MISSING:
+                        break
+                key = _value_key(value)
+                sort_key.append(_Descending(key) if direction == DESCENDING else key)
+            else:
+                rows.append((tuple(sort_key), doc_id, stored))
+
+        rows.sort(key=lambda row: row[0])
+
+        if self._start is not None:
+            cursor = self._cursor_key(self._start, orders)
+            before = self._start[1]
+            rows = [
+                row for row in rows
+                if cursor < row[0][:len(cursor)] or (before and row[0][:len(cursor)] == cursor)
+            ]
+        if self._end is not None:
+            cursor = self._cursor_key(self._end, orders)
+            before = self._end[1]
+            rows = [
+                row for row in rows
+                if row[0][:len(cursor)] < cursor or (not before and row[0][:len(cursor)] == cursor)
+            ]
+
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return [(doc_id, stored) for _, doc_id, stored in rows]
+
+    def _snapshots(self, started: float) -> list:
+        with self._client._lock:
+            read_time = _now()
+            snapshots = [
+                self._client._snapshot(self._document(doc_id), stored, self._projection, read_time)
+                for doc_id, stored in self._run()
+            ]
+        # Como en Firestore, una consulta sin resultados cuesta una lectura
+        record_operation("run_query", reads=max(1, len(snapshots)), queries=1, rpcs=1, seconds=time.perf_counter() - started)
+        return snapshots
+
+    def stream(self, transaction=None, **kwargs):
+        started = time.perf_counter()
+        self._client._round_trip()
+        for snapshot in self._snapshots(started):
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        return MemoryWatch(self, callback)
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, collection_path: str):
+        super().__init__(client, collection_path)
+        self.id = collection_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: str = None):
+        return self._document(document_id or _auto_id())
+
+    def add(self, document_data: dict, document_id: str = None):
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def _list_documents(self, started: float) -> list:
+        with self._client._lock:
+            collection = self._client._collections.get(self._collection_path)
+            doc_ids = list(collection.docs) if collection else []
+        record_operation("list_documents", reads=len(doc_ids), rpcs=1, seconds=time.perf_counter() - started)
+        return [self._document(doc_id) for doc_id in doc_ids]
+
+    def list_documents(self, page_size=None):
+        started = time.perf_counter()
+        self._client._round_trip()
+        return self._list_documents(started)
+
+
+class MemoryAggregationQuery:
+    """count() o, si se indica un campo, sum() sobre los resultados de la consulta."""
+
+    def __init__(self, query: MemoryQuery, alias: str, sum_field: str = None):
+        self._query = query
+        self._alias = alias
+        self._sum_field = sum_field
+
+    def get(self, transaction=None, **kwargs):
+        started = time.perf_counter()
+        self._query._client._round_trip()
+        return self._result(started)
+
+    def _result(self, started: float) -> list:
+        with self._query._client._lock:
+            rows = self._query._run()
+            if self._sum_field is None:
+                total = len(rows)
+            else:
+                # Como Firestore, se ignoran los valores que no son numéricos
+                values = [_get_field(stored.data, self._sum_field) for _, stored in rows]
+                total = sum(
+                    value for value in values
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)
+                )
+        record_operation(
+            "run_aggregation_query", reads=aggregation_reads(len(rows)), queries=1, rpcs=1,
+            seconds=time.perf_counter() - started
+        )
+        return [[AggregationResult(alias=self._alias, value=total, read_time=_now())]]
+
+
+# --- Listeners ---------------------------------------------------------------
+
+class MemoryWatch:
+    """Equivalente de ``Watch`` para ``on_snapshot``.
+
+    Como en Firestore, el primer llamado trae todos los documentos como
+    ADDED y los siguientes solo los cambios de cada commit. Los callbacks
+    se ejecutan en un hilo propio, fuera del lock del cliente. Se ignoran
+    el orden, el límite y los cursores de la consulta.
+    """
+
+    def __init__(self, query: MemoryQuery, callback):
+        self._query = query
+        self._callback = callback
+        self._queue = queue.Queue()
+        self._docs = {}
+        self._active = True
+        client = query._client
+        with client._lock:
+            read_time = _now()
+            changes = []
+            for doc_id, stored in query._run():
+                snapshot = client._snapshot(query._document(doc_id), stored, None, read_time)
+                self._docs[doc_id] = snapshot
+                changes.append(DocumentChange(ChangeType.ADDED, snapshot, -1, -1))
+            self._queue.put((list(self._docs.values()), changes, read_time))
+            client._watches.append(self)
+        self._thread = threading.Thread(target=self._deliver, name="memory-watch", daemon=True)
+        self._thread.start()
+
+    @property
+    def is_active(self) -> bool:
+        return self._active
+
+    def _on_commit(self, staged, read_time) -> None:
+        # Se llama con el lock del cliente tomado, después de aplicar el commit
+        client = self._query._client
+        changes = []
+        for reference, new_data in staged:
+            if reference._collection_path != self._query._collection_path:
+                continue
+            doc_id = reference.id
+            was_matching = doc_id in self._docs
+            stored = client._stored(reference)
+            matches = new_data is not None and stored is not None and self._query._matches(doc_id, stored.data)
+            if matches:
+                snapshot = client._snapshot(reference, stored, None, read_time)
+                self._docs[doc_id] = snapshot
+                change_type = ChangeType.MODIFIED if was_matching else ChangeType.ADDED
+                changes.append(DocumentChange(change_type, snapshot, -1, -1))
+            elif was_matching:
+                snapshot = self._docs.pop(doc_id)
+                changes.append(DocumentChange(ChangeType.REMOVED, snapshot, -1, -1))
+        if changes:
+            self._queue.put((list(self._docs.values()), changes, read_time))
+
+    def _deliver(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None or not self._active:
+                return
+            self._callback(*item)
+
+    def close(self, reason=None) -> None:
+        """Detiene el listener; para quien lo usa equivale a una desconexión"""
+        client = self._query._client
+        with client._lock:
+            if self in client._watches:
+                client._watches.remove(self)
+        self._active = False
+        self._queue.put(None)
+
+    def unsubscribe(self) -> None:
+        self.close()
+
+
+# --- Escrituras --------------------------------------------------------------
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(("create", reference, document_data, None))
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._writes.append(("merge" if merge else "set", reference, document_data, None))
+
+    def update(self, reference, field_updates: dict, option=None):
+        self._writes.append(("update", reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference, None, option))
+
+    def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return self._client._commit_writes(writes)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """Transacción optimista: al confirmar verifica que ningún documento
+    leído haya cambiado y, si cambió, lanza ``Aborted`` para que
+    ``firestore.transactional`` la reintente como lo haría Firestore."""
+
+    def __init__(self, client, max_attempts: int = 5, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _record_read(self, snapshot) -> None:
+        self._reads.setdefault(snapshot.reference.path, snapshot._version)
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:
+        if self.in_progress:
+            raise ValueError("La transacción ya está en curso")
+        started = time.perf_counter()
+        self._client._round_trip()
+        self._start(started)
+
+    def _start(self, started: float) -> None:
+        self._id = uuid.uuid4().bytes
+        record_operation("begin_transaction", transactions=1, rpcs=1, seconds=time.perf_counter() - started)
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def _commit(self) -> list:
+        if not self.in_progress:
+            raise ValueError("La transacción no está en curso")
+        try:
+            return self._client._commit_writes(self._writes, self._reads)
+        finally:
+            self._clean_up()
+
+    def commit(self, **kwargs):
+        return self._commit()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references, transaction=self, **kwargs)
+
+
+# --- Cliente -----------------------------------------------------------------
+
+class MemoryClient:
+    """Cliente en memoria con la misma interfaz que ``firestore.Client``."""
+
+    def __init__(self, latency: float = 0.0):
+        self._lock = threading.RLock()
+        # Segundos que tarda cada RPC simulado, para medir la aplicación
+        # como si hablara con Firestore por la red
+        self._latency = latency
+        self._collections = {}
+        # Cada commit recibe un número de versión y una hora estrictamente crecientes
+        self._version = 0
+        self._last_commit_time = None
+        self._watches = []
+
+    # Clases de las referencias, consultas y escrituras que crea el cliente;
+    # el cliente asíncrono usa sus variantes con corutinas
+    _document_class = MemoryDocumentReference
+    _collection_class = MemoryCollectionReference
+    _query_class = MemoryQuery
+    _aggregation_class = MemoryAggregationQuery
+    _batch_class = MemoryWriteBatch
+    _transaction_class = MemoryTransaction
+
+    def collection(self, *collection_path: str) -> MemoryCollectionReference:
+        return self._collection_class(self, "/".join(collection_path))
+
+    def document(self, *document_path: str) -> MemoryDocumentReference:
+        path = "/".join(document_path)
+        collection_path, doc_id = path.rsplit("/", 1)
+        return self._document_class(self, collection_path, doc_id)
+
+    def batch(self) -> MemoryWriteBatch:
+        return self._batch_class(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> MemoryTransaction:
+        return self._transaction_class(self, max_attempts=max_attempts, read_only=read_only)
+
+    write_option = staticmethod(BaseClient.write_option)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        started = time.perf_counter()
+        self._round_trip()
+        for snapshot in self._read_all(references, field_paths, started):
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    def close(self) -> None:
+        pass
+
+    # --- Internos ---
+
+    def _round_trip(self) -> None:
+        if self._latency:
+            time.sleep(self._latency)
+
+    def _read_all(self, references, field_paths, started: float) -> list:
+        with self._lock:
+            snapshots = [self._read(reference, field_paths) for reference in dict.fromkeys(references)]
+        record_operation("batch_get_documents", reads=len(snapshots), rpcs=1, seconds=time.perf_counter() - started)
+        return snapshots
+
+    def _snapshot(self, reference, stored, field_paths, read_time):
+        data = stored.data
+        if field_paths is not None:
+            data = {}
+            for field_path in field_paths:
+                value = _get_field(stored.data, field_path)
+                if value is not _MISSING:
+                    _set_field(data, field_path, value)
+        return MemoryDocumentSnapshot(
+            reference, _copy(data), True, stored.create_time, stored.update_time,
+            read_time, stored.version
+        )
+
+    def _read(self, reference, field_paths=None):
+        with self._lock:
+            collection = self._collections.get(reference._collection_path)
+            stored = collection.docs.get(reference.id) if collection else None
+            if stored is None:
+                return MemoryDocumentSnapshot(reference, None, False, read_time=_now())
+            return self._snapshot(reference, stored, field_paths, _now())
+
+    def _stored(self, reference):
+        collection = self._collections.get(reference._collection_path)
+        return collection.docs.get(reference.id) if collection else None
+
+    @staticmethod
+    def _check_option(option, exists: bool, update_time, reference) -> None:
+        # Como en Firestore, la precondición se evalúa contra el documento tal
+        # como lo dejaron las escrituras anteriores del mismo commit
+        if isinstance(option, LastUpdateOption):
+            if not exists or update_time != option._last_update_time:
+                raise exceptions.FailedPrecondition(
+                    f"El documento {reference.path} cambió desde la última lectura"
+                )
+        elif isinstance(option, ExistsOption):
+            if exists != option._exists:
+                raise exceptions.FailedPrecondition(
+                    f"Precondición de existencia fallida para {reference.path}"
+                )
+
+    def _commit_writes(self, writes, reads=None) -> list:
+        started = time.perf_counter()
+        self._round_trip()
+        try:
+            return self._apply_writes(writes, reads)
+        finally:
+            record_operation("commit", writes=len(writes), rpcs=1, seconds=time.perf_counter() - started)
+
+    def _apply_writes(self, writes, reads=None) -> list:
+        if len(writes) > MAX_WRITES_PER_COMMIT:
+            raise exceptions.InvalidArgument(
+                f"maximum {MAX_WRITES_PER_COMMIT} writes allowed per request"
+            )
+
+        with self._lock:
+            for path, version in (reads or {}).items():
+                collection_path, doc_id = path.rsplit("/", 1)
+                collection = self._collections.get(collection_path)
+                stored = collection.docs.get(doc_id) if collection else None
+                current = stored.version if stored is not None else None
+                if current != version:
+                    raise exceptions.Aborted(
+                        f"Conflicto de transacción en {path}; el documento cambió"
+                    )
+
+            now = _now()
+            if self._last_commit_time is not None and now <= self._last_commit_time:
+                now = self._last_commit_time + timedelta(microseconds=1)
+            self._last_commit_time = now
+            self._version += 1
+            # Se aplican sobre una vista temporal para que el commit sea atómico
+            staged = {}
+            write_results = []
+            for op, reference, data, option in writes:
+                if reference.path in staged:
+                    current = staged[reference.path][1]
+                    # Escrito antes en este commit: su hora de actualización es la del commit
+                    update_time = now if current is not None else None
+                else:
+                    stored = self._stored(reference)
+                    current = _copy(stored.data) if stored is not None else None
+                    update_time = stored.update_time if stored is not None else None
+
+                self._check_option(option, current is not None, update_time, reference)
+                results = []
+                if op == "create":
+                    if current is not None:
+                        raise exceptions.AlreadyExists(f"El documento {reference.path} ya existe")
+                    new_data = {}
+                    for key, value in data.items():
+                        _apply_value(new_data, key, value, now, results)
+                elif op == "set":
+                    new_data = {}
+                    for key, value in data.items():
+                        _apply_value(new_data, key, value, now, results)
+                elif op == "merge":
+                    new_data = current if current is not None else {}
+                    for key, value in data.items():
+                        _apply_value(new_data, key, value, now, results)
+                elif op == "update":
+                    if current is None:
+                        raise exceptions.NotFound(f"No document to update: {reference.path}")
+                    new_data = current
+                    for field_path, value in data.items():
+                        if isinstance(value, dict):
+                            # update reemplaza los mapas completos
+                            _delete_field(new_data, field_path)
+                        _apply_value(new_data, field_path, value, now, results)
+                else:
+                    new_data = None
+                staged[reference.path] = (reference, new_data)
+                write_results.append(MemoryWriteResult(
+                    update_time=now,
+                    transform_results=[encode_value(value) for _, value in sorted(results, key=lambda r: r[0])],
+                ))
+
+            for reference, new_data in staged.values():
+                collection = self._collections.get(reference._collection_path)
+                if new_data is None:
+                    if collection is not None:
+                        collection.remove(reference.id)
+                    continue
+                if collection is None:
+                    collection = self._collections[reference._collection_path] = _Collection()
+                collection.put(reference.id, new_data, now, self._version)
+
+            for watch in self._watches:
+                watch._on_commit(staged.values(), now)
+
+        return write_results
+
+
+# --- Cliente asíncrono -------------------------------------------------------
+#
+# Mismas operaciones que el cliente síncrono con la interfaz de
+# ``firestore.AsyncClient``: las RPC son corutinas y ``stream``,
+# ``get_all`` y ``list_documents`` son generadores asíncronos. El trabajo en
+# memoria se hace bajo el lock sin ceder el event loop; solo la latencia
+# simulada se espera con ``asyncio.sleep``.
+
+class AsyncMemoryDocumentReference(MemoryDocumentReference):
+    async def get(self, field_paths=None, transaction=None, **kwargs):
+        started = time.perf_counter()
+        await self._client._round_trip()
+        return self._finish_get(self._client._read(self, field_paths), transaction, started)
+
+    async def create(self, document_data: dict):
+        return (await self._client._commit_writes([("create", self, document_data, None)]))[0]
+
+    async def set(self, document_data: dict, merge: bool = False):
+        op = "merge" if merge else "set"
+        return (await self._client._commit_writes([(op, self, document_data, None)]))[0]
+
+    async def update(self, field_updates: dict, option=None):
+        return (await self._client._commit_writes([("update", self, field_updates, option)]))[0]
+
+    async def delete(self, option=None):
+        return (await self._client._commit_writes([("delete", self, None, option)]))[0].update_time
+
+
+class AsyncMemoryQuery(MemoryQuery):
+    async def stream(self, transaction=None, **kwargs):
+        started = time.perf_counter()
+        await self._client._round_trip()
+        for snapshot in self._snapshots(started):
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    async def get(self, transaction=None, **kwargs):
+        return [snapshot async for snapshot in self.stream(transaction=transaction)]
+
+
+class AsyncMemoryCollectionReference(AsyncMemoryQuery, MemoryCollectionReference):
+    async def add(self, document_data: dict, document_id: str = None):
+        reference = self.document(document_id)
+        result = await reference.create(document_data)
+        return result.update_time, reference
+
+    async def list_documents(self, page_size=None):
+        started = time.perf_counter()
+        await self._client._round_trip()
+        for reference in self._list_documents(started):
+            yield reference
+
+
+class AsyncMemoryAggregationQuery(MemoryAggregationQuery):
+    async def get(self, transaction=None, **kwargs):
+        started = time.perf_counter()
+        await self._query._client._round_trip()
+        return self._result(started)
+
+
+class AsyncMemoryWriteBatch(MemoryWriteBatch):
+    async def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return await self._client._commit_writes(writes)
+
+
+class AsyncMemoryTransaction(MemoryTransaction):
+    """Transacción para ``firestore.async_transactional``."""
+
+    async def _begin(self, retry_id=None) -> None:
+        if self.in_progress:
+            raise ValueError("La transacción ya está en curso")
+        started = time.perf_counter()
+        await self._client._round_trip()
+        self._start(started)
+
+    async def _rollback(self) -> None:
+        self._clean_up()
+
+    async def _commit(self) -> list:
+        if not self.in_progress:
+            raise ValueError("La transacción no está en curso")
+        try:
+            return await self._client._commit_writes(self._writes, self._reads)
+        finally:
+            self._clean_up()
+
+    async def commit(self, **kwargs):
+        return await self._commit()
+
+    async def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return self._client.get_all([ref_or_query], transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+    async def get_all(self, references, **kwargs):
+        return self._client.get_all(references, transaction=self, **kwargs)
+
+
+class AsyncMemoryClient(MemoryClient):
+    """Cliente en memoria con la misma interfaz que ``firestore.AsyncClient``.
+
+    Comparte los datos con un ``MemoryClient`` (``_to_sync_copy``), que
+    sirve para ``on_snapshot`` y para cargar datos desde código síncrono,
+    igual que la copia síncrona de ``AsyncClient``.
+    """
+
+    _document_class = AsyncMemoryDocumentReference
+    _collection_class = AsyncMemoryCollectionReference
+    _query_class = AsyncMemoryQuery
+    _aggregation_class = AsyncMemoryAggregationQuery
+    _batch_class = AsyncMemoryWriteBatch
+    _transaction_class = AsyncMemoryTransaction
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self._sync_copy = MemoryClient(latency)
+        # Mismos documentos, lock y listeners; los números de versión los
+        # asigna la copia síncrona en _apply_writes
+        self._lock = self._sync_copy._lock
+        self._collections = self._sync_copy._collections
+        self._watches = self._sync_copy._watches
+
+    async def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        started = time.perf_counter()
+        await self._round_trip()
+        for snapshot in self._read_all(references, field_paths, started):
+            if transaction is not None:
+                transaction._record_read(snapshot)
+            yield snapshot
+
+    def _to_sync_copy(self) -> MemoryClient:
+        return self._sync_copy
+
+    async def _round_trip(self) -> None:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+    async def _commit_writes(self, writes, reads=None) -> list:
+        started = time.perf_counter()
+        await self._round_trip()
+        try:
+            return self._apply_writes(writes, reads)
+        finally:
+            record_operation("commit", writes=len(writes), rpcs=1, seconds=time.perf_counter() - started)
+
+    def _apply_writes(self, writes, reads=None) -> list:
+        return self._sync_copy._apply_writes(writes, reads)
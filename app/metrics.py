@@ -0,0 +1,175 @@
+"""Métricas en formato de exposición de Prometheus.
+
+Cada hilo escribe en sus propios contadores sin tomar ningún lock; el
+scrape de /metrics suma los de todos los hilos. Así registrar una métrica
+cuesta lo mismo que actualizar un diccionario y puede quedar activo con la
+aplicación a plena carga.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+# Límites (en segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    """Valores registrados por un hilo; solo ese hilo los modifica."""
+
+    __slots__ = ("values", "histograms")
+
+    def __init__(self):
+        # (métrica, etiquetas) -> valor de contadores y gauges
+        self.values = {}
+        # (métrica, etiquetas) -> [conteo por bucket..., suma, total]
+        self.histograms = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        # métrica -> (tipo, ayuda, buckets)
+        self._definitions = {}
+
+    def _define(self, kind: str, name: str, documentation: str, buckets=None) -> None:
+        self._definitions[name] = (kind, documentation, tuple(buckets) if buckets else None)
+
+    def counter(self, name: str, documentation: str) -> None:
+        self._define("counter", name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> None:
+        self._define("gauge", name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets=LATENCY_BUCKETS) -> None:
+        self._define("histogram", name, documentation, buckets)
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Solo la primera métrica de cada hilo toma el lock
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Suma a un contador o, con un valor negativo, resta a un gauge"""
+        values = self._shard().values
+        key = (name, tuple(sorted(labels.items())))
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, name: str, amount: float = 1, **labels) -> None:
+        self.inc(name, -amount, **labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = self._definitions[name][2]
+        histograms = self._shard().histograms
+        key = (name, tuple(sorted(labels.items())))
+        series = histograms.get(key)
+        if series is None:
+            series = histograms[key] = [0] * (len(buckets) + 3)
+        # Cada observación cuenta solo en el primer bucket que la contiene;
+        # los acumulados de Prometheus se calculan al exponer
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def _collect(self) -> Tuple[Dict, Dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        values = {}
+        histograms = {}
+        for shard in shards:
+            # Copiar un dict o una lista es atómico con el GIL
+            for key, value in shard.values.copy().items():
+                values[key] = values.get(key, 0) + value
+            for key, series in shard.histograms.copy().items():
+                series = list(series)
+                total = histograms.get(key)
+                histograms[key] = series if total is None else [a + b for a, b in zip(total, series)]
+        return values, histograms
+
+    def render(self) -> str:
+        """Texto del formato de exposición 0.0.4"""
+        values, histograms = self._collect()
+        lines = []
+        for name, (kind, documentation, buckets) in self._definitions.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), series):
+                    cumulative += count
+                    bucket_labels = labels + (("le", "+Inf" if bound == float("inf") else _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def timed(self, name: str, **labels) -> Callable:
+        """Decorador que registra la duración de cada llamada en el histograma `name`.
+
+        Con una corutina se mide hasta que termina, no hasta que se crea.
+        """
+        def decorator(function):
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await function(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - started, **labels)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
+
+metrics.counter("http_requests_total", "Solicitudes HTTP atendidas por ruta y código de estado")
+metrics.counter("http_request_errors_total", "Solicitudes HTTP con código de estado 4xx o 5xx")
+metrics.gauge("http_requests_in_progress", "Solicitudes HTTP en curso")
+metrics.histogram("http_request_duration_seconds", "Duración de las solicitudes HTTP hasta enviar el cuerpo completo")
+metrics.histogram("crud_function_duration_seconds", "Duración de las funciones públicas de app.crud")
+metrics.histogram(
+    "progress_update_attempts",
+    "Intentos por actualización de progreso (transacción o escritura condicional de cierre)",
+    buckets=(1, 2, 3, 4, 5, 10),
+)
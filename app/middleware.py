@@ -0,0 +1,84 @@
+"""Middleware ASGI que mide cada solicitud HTTP.
+
+Una sola capa cuenta las operaciones de Firestore (cabeceras X-Firestore-*
+y Server-Timing, acumulado por ruta), registra las métricas de Prometheus
+y abre el span de OpenTelemetry. Al ser ASGI puro no envuelve la respuesta
+ni el cuerpo de las respuestas en streaming: las cabeceras se agregan al
+empezar a enviarla y lo demás se registra cuando termina el cuerpo.
+"""
+import time
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.firestore_ops import begin_request, end_request, operation_metrics
+from app.metrics import metrics
+from app.tracing import server_span
+
+
+def route_path(scope) -> str:
+    # Plantilla de la ruta (/usuarios/{user_id}) para no crear una serie por ID
+    route = scope.get("route")
+    return route.path if route is not None else "(sin ruta)"
+
+
+class RequestInstrumentation:
+    def __init__(self, app, op_accounting: bool = True, metrics_enabled: bool = True):
+        self.app = app
+        self.op_accounting = op_accounting
+        self.metrics_enabled = metrics_enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        stats, token = begin_request() if self.op_accounting else (None, None)
+        if self.metrics_enabled:
+            metrics.inc("http_requests_in_progress", method=method)
+        # Si la aplicación falla antes de responder, Starlette envía un 500
+        status_code = 500
+
+        async def send_with_operations(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if stats is not None:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    headers = MutableHeaders(scope=message)
+                    headers["Server-Timing"] = (
+                        f'firestore;dur={stats.rpc_seconds * 1000:.1f};desc="{stats.rpcs} rpc", app;dur={elapsed_ms:.1f}'
+                    )
+                    headers["X-Firestore-Reads"] = str(stats.reads)
+                    headers["X-Firestore-Writes"] = str(stats.writes)
+            await send(message)
+
+        with server_span(method, Headers(scope=scope)) as span:
+            try:
+                await self.app(scope, receive, send_with_operations)
+            finally:
+                elapsed = time.perf_counter() - started
+                route = route_path(scope)
+                if stats is not None:
+                    end_request(token)
+                    operation_metrics.record(f"{method} {route}", stats, elapsed)
+                if self.metrics_enabled:
+                    self._record_metrics(method, route, status_code, elapsed)
+                if span is not None:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.request.method", method)
+                    span.set_attribute("http.route", route)
+                    span.set_attribute("http.response.status_code", status_code)
+                    if stats is not None:
+                        span.set_attribute("firestore.reads", stats.reads)
+                        span.set_attribute("firestore.writes", stats.writes)
+
+    @staticmethod
+    def _record_metrics(method: str, route: str, status_code: int, elapsed: float) -> None:
+        metrics.dec("http_requests_in_progress", method=method)
+        status = str(status_code)
+        metrics.inc("http_requests_total", method=method, route=route, status=status)
+        if status_code >= 400:
+            metrics.inc("http_request_errors_total", method=method, route=route, status=status)
+        metrics.observe("http_request_duration_seconds", elapsed, method=method, route=route)
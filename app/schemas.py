@@ -15,6 +15,7 @@ class User(BaseModel):
 class UsersResponse(BaseModel):
     users: List[User]
     count: int
+    next_cursor: Optional[str] = None
 
 class UserPoints(BaseModel):
     user_id: str
@@ -44,10 +45,25 @@ class ChallengeResponse(ChallengeBase):
     date_creation: datetime
     puntos: int = 0
 ##################################### en listar challenges 
+# En los listados todos los campos son opcionales: con 'fields' solo llegan
+# los pedidos y la respuesta se serializa sin los que no vinieron
+class ChallengeListItem(BaseModel):
+    challenge_id: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    max_limit: Optional[int] = None
+    reward_id: Optional[str] = None
+    max_users: Optional[int] = None
+    status: Optional[str] = None
+    max_date: Optional[datetime] = None
+    date_creation: Optional[datetime] = None
+    puntos: Optional[int] = None
+
 class ChallengesResponse(BaseModel):
     success: bool
-    challenges: List[ChallengeResponse]
+    challenges: List[ChallengeListItem]
     count: int
+    next_cursor: Optional[str] = None
 
 ######################################
 
@@ -60,6 +76,13 @@ class RewardResponse(RewardCreate):
     reward_id: str
     created_at: datetime
 
+class RewardListItem(BaseModel):
+    reward_id: str
+    type: Optional[str] = None
+    value: Optional[str] = None
+    metadata: Optional[Dict] = None
+    created_at: Optional[datetime] = None
+
 
 ######################################
 
@@ -73,6 +96,15 @@ class ChallengeInstanceResponse(ChallengeInstanceCreate):
     completed: bool = False
     date_started: datetime
 
+class BulkAssignmentUserFilter(BaseModel):
+    city: Optional[str] = Field(None, min_length=1)
+    state: Optional[str] = Field(None, min_length=1)
+
+class BulkAssignmentRequest(BaseModel):
+    challenge_id: str = Field(..., min_length=1, description="ID del challenge")
+    user_ids: Optional[List[str]] = Field(None, min_length=1, max_length=100000, description="IDs de los usuarios")
+    user_filter: Optional[BulkAssignmentUserFilter] = Field(None, description="Asignar a los usuarios que cumplan estos filtros")
+
 
 ###################################
 
@@ -81,6 +113,7 @@ class UserAssignedChallengesResponse(BaseModel):
     user_id: str
     challenges: List[dict]
     count: int
+    round_trips_saved: int = 0
     
     
 ###################################
@@ -88,17 +121,77 @@ class ChallengeProgressResponse(BaseModel):
     success: bool
     message: str
 
+class ProgressEvent(BaseModel):
+    instance_id: str = Field(..., min_length=1)
+    count: int = Field(1, gt=0, description="Cantidad de avances de la instancia")
+
+class BulkProgressRequest(BaseModel):
+    events: List[ProgressEvent] = Field(..., min_length=1, max_length=10000)
+
+class BulkProgressResult(BaseModel):
+    instance_id: str
+    status: str
+    events: int
+    applied: int
+    progress: Optional[int] = None
+    error: Optional[str] = None
+    message: str
+
+class PendingPointsCredit(BaseModel):
+    instance_id: str
+    user_id: str
+    points: int
+
+class BulkProgressResponse(BaseModel):
+    success: bool
+    results: List[BulkProgressResult]
+    events: int
+    instances: int
+    completed: int
+    users_credited: int
+    pending_credits: List[PendingPointsCredit] = []
+    error: Optional[str] = None
+
 class ChallengeStatusResponse(BaseModel):
     success: bool
     message: str
 
+class ExpiredChallengesChunk(BaseModel):
+    chunk: int
+    size: int
+    first_id: str
+    last_id: str
+    seconds: float
+    error: Optional[str] = None
+
 class ExpiredChallengesResponse(BaseModel):
     success: bool
     message: str
     disabled_count: int
+    failed_count: int = 0
+    seconds: Optional[float] = None
+    chunks: List[ExpiredChallengesChunk] = []
 
 class UserRankingResponse(BaseModel):
     success: bool
     rank: int
     user_id: str
-    message: str = "Ranking obtenido exitosamente"
\ No newline at end of file
+    message: str = "Ranking obtenido exitosamente"
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    points: int
+
+class LeaderboardResponse(BaseModel):
+    success: bool
+    entries: List[LeaderboardEntry]
+    count: int
+    generated_at: datetime
+    staleness_seconds: float
+    stale: bool
+    message: str = "Ranking obtenido exitosamente"
+
+class LeaderboardNeighborsResponse(LeaderboardResponse):
+    user_id: str
+    rank: int
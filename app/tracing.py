@@ -0,0 +1,146 @@
+"""Trazas opcionales con OpenTelemetry.
+
+Con TRACING_ENABLED=true cada solicitud abre un span, cada función pública
+de crud uno hijo y cada operación de Firestore otro con la cantidad de
+documentos leídos y escritos. Requiere ``opentelemetry-sdk`` (y
+``opentelemetry-exporter-otlp`` para exportar por OTLP); si no están
+instalados las trazas quedan deshabilitadas y la aplicación sigue igual.
+"""
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+
+from app.config import (
+    TRACING_ENABLED,
+    TRACING_EXPORTER,
+    TRACING_FILE_PATH,
+    TRACING_SAMPLE_RATIO,
+    TRACING_SERVICE_NAME,
+)
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:
+    propagate = trace = None
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+_provider = None
+
+
+def _create_exporter():
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        # Destino y credenciales con las variables estándar OTEL_EXPORTER_OTLP_*
+        return OTLPSpanExporter()
+    if TRACING_EXPORTER == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        # Un span por línea en JSON, para analizarlos sin colector
+        return ConsoleSpanExporter(
+            out=open(TRACING_FILE_PATH, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    if TRACING_EXPORTER == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    raise ValueError(f"TRACING_EXPORTER inválido: {TRACING_EXPORTER}. Opciones: otlp, file, console")
+
+
+def setup_tracing() -> bool:
+    """Configura el proveedor de trazas; devuelve si quedaron activas"""
+    global _tracer, _provider
+    if not TRACING_ENABLED or _tracer is not None:
+        return _tracer is not None
+    try:
+        if trace is None:
+            raise ImportError("opentelemetry-api")
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        exporter = _create_exporter()
+    except ImportError as e:
+        logger.warning("TRACING_ENABLED=true pero falta una dependencia de OpenTelemetry (%s); trazas deshabilitadas", e)
+        return False
+
+    # Se muestrea una fracción de las solicitudes nuevas; las que llegan con
+    # un traceparent respetan la decisión de quien las originó
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    # El procesador por lotes descarta spans si su cola se llena en vez de frenar las solicitudes
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    # Proveedor propio, sin registrarlo como global: así solo se exportan los
+    # spans de esta aplicación y no los que otras librerías crean por su cuenta
+    _tracer = _provider.get_tracer("user-rewards")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Envía los spans pendientes al apagar la aplicación"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = None
+    _provider = None
+
+
+def is_active() -> bool:
+    return _tracer is not None
+
+
+@contextmanager
+def server_span(name: str, headers):
+    """Span de una solicitud HTTP, hijo del traceparent recibido si lo hay"""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, context=propagate.extract(headers), kind=trace.SpanKind.SERVER) as span:
+        yield span
+
+
+def traced(name: str):
+    """Decorador que abre un span por llamada si las trazas están activas"""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await function(*args, **kwargs)
+                with _tracer.start_as_current_span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.start_as_current_span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name: str, seconds: float, attributes: dict, kind: str = "CLIENT") -> None:
+    """Registra un span ya terminado que duró `seconds` hasta ahora.
+
+    Las operaciones de Firestore se cuentan al terminar (los streams al
+    consumirse), así que el span se crea con sus tiempos de inicio y fin.
+    Solo se crea dentro de una traza muestreada.
+    """
+    if _tracer is None:
+        return
+    if not trace.get_current_span().is_recording():
+        return
+    end = time.time_ns()
+    span = _tracer.start_span(
+        name,
+        kind=trace.SpanKind[kind],
+        start_time=end - int(seconds * 1e9),
+        attributes=attributes,
+    )
+    span.end(end_time=end)
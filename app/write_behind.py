@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import threading
+import time
+
+from app.config import PROGRESS_BUFFER_FLUSH_INTERVAL_SECONDS, PROGRESS_BUFFER_FLUSH_SIZE
+from app.crud import credit_completed_instances, update_challenge_progress_bulk
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBuffer:
+    """Cola write-behind de eventos de progreso.
+
+    Los eventos se confirman al cliente apenas se encolan y se acumulan como
+    un delta por instancia. Una tarea en segundo plano los aplica con
+    update_challenge_progress_bulk (batches de hasta 500 escrituras y un
+    Increment de puntos por usuario) cuando hay `flush_size` instancias
+    pendientes o pasan `flush_interval` segundos.
+
+    Si un flush falla a mitad de camino solo vuelven a la cola los eventos de
+    las instancias que no se aplicaron; los créditos de puntos que faltaron
+    se guardan aparte, por instancia, y se reintentan en el siguiente flush.
+    """
+
+    def __init__(self, flush_size: int, flush_interval: float):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._events = 0
+        # Créditos pendientes por instancia completada: {instance_id: (user_id, puntos)}
+        self._credits = {}
+        # Momento (monotonic) en que se encoló el evento pendiente más antiguo
+        self._oldest = None
+        self._loop = None
+        self._wakeup = None
+        self._flushes = 0
+        self._flush_errors = 0
+        self._applied_events = 0
+        self._discarded_events = 0
+        self._last_flush_seconds = None
+        self._max_flush_seconds = 0.0
+        self._last_lag_seconds = None
+        self._max_lag_seconds = 0.0
+
+    def add(self, instance_id: str, count: int = 1) -> None:
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._deltas[instance_id] = self._deltas.get(instance_id, 0) + count
+            self._events += count
+            size_reached = len(self._deltas) >= self.flush_size
+
+        if size_reached and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take(self):
+        with self._lock:
+            deltas, events, oldest, credits = self._deltas, self._events, self._oldest, self._credits
+            self._deltas, self._events, self._oldest, self._credits = {}, 0, None, {}
+        return deltas, events, oldest, credits
+
+    def _restore(self, deltas: dict, events: int, oldest: float, credits: dict) -> None:
+        # Devuelve a la cola lo que un flush no llegó a aplicar
+        with self._lock:
+            for instance_id, count in deltas.items():
+                self._deltas[instance_id] = self._deltas.get(instance_id, 0) + count
+            self._events += events
+            if deltas:
+                self._oldest = oldest if self._oldest is None else min(self._oldest, oldest)
+            self._credits.update(credits)
+
+    def _failed(self, deltas: dict, events: int, oldest: float, credits: dict) -> None:
+        self._restore(deltas, events, oldest, credits)
+        with self._lock:
+            self._flush_errors += 1
+
+    async def flush(self, db) -> int:
+        """Aplica en Firestore todo lo pendiente; devuelve cuántos eventos se aplicaron"""
+        deltas, events, oldest, credits = self._take()
+        if not deltas and not credits:
+            return 0
+
+        started = time.monotonic()
+        if credits:
+            # Las instancias ya acreditadas se saltan, así que reintentar es seguro
+            try:
+                await credit_completed_instances(
+                    db, [(instance_id, user_id, points) for instance_id, (user_id, points) in credits.items()]
+                )
+            except Exception:
+                self._failed(deltas, events, oldest, credits)
+                raise
+        if not deltas:
+            return 0
+
+        try:
+            result = await update_challenge_progress_bulk(db, list(deltas.items()))
+        except Exception:
+            # Falló antes de escribir: se devuelve todo
+            self._failed(deltas, events, oldest, {})
+            raise
+
+        finished = time.monotonic()
+        if result['error']:
+            # Solo vuelven a la cola los eventos que no se confirmaron y los créditos que faltaron
+            unapplied = {r['instance_id']: r['events'] for r in result['results'] if r.get('error') == 'not_applied'}
+            self._failed(unapplied, sum(unapplied.values()), oldest, {
+                credit['instance_id']: (credit['user_id'], credit['points']) for credit in result['pending_credits']
+            })
+            events -= sum(unapplied.values())
+        # Se descartan los eventos de instancias inválidas o ya completadas
+        applied = sum(r['applied'] for r in result['results'])
+        discarded = events - applied
+        with self._lock:
+            self._flushes += 1
+            self._applied_events += applied
+            self._discarded_events += discarded
+            self._last_flush_seconds = finished - started
+            self._max_flush_seconds = max(self._max_flush_seconds, finished - started)
+            self._last_lag_seconds = finished - oldest
+            self._max_lag_seconds = max(self._max_lag_seconds, finished - oldest)
+        if discarded:
+            logger.info("Flush de progreso: %d de %d eventos descartados", discarded, events)
+        if result['error']:
+            raise RuntimeError(f"Flush de progreso incompleto: {result['error']}")
+        return applied
+
+    async def run(self, db) -> None:
+        """Tarea de fondo que vacía la cola por tamaño o por tiempo"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush(db)
+            except Exception:
+                logger.exception("No se pudo aplicar el progreso pendiente; se reintentará")
+
+    async def drain(self, db) -> int:
+        """Vacía la cola al apagar la aplicación"""
+        self._loop = None
+        applied = 0
+        while self.depth:
+            applied += await self.flush(db)
+        return applied
+
+    @property
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._deltas) + len(self._credits)
+
+    def stats(self) -> dict:
+        with self._lock:
+            oldest_age = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+            return {
+                "pending_instances": len(self._deltas),
+                "pending_events": self._events,
+                "pending_credits": len(self._credits),
+                "oldest_pending_seconds": round(oldest_age, 3),
+                "flushes": self._flushes,
+                "flush_errors": self._flush_errors,
+                "applied_events": self._applied_events,
+                "discarded_events": self._discarded_events,
+                "last_flush_seconds": self._last_flush_seconds,
+                "max_flush_seconds": self._max_flush_seconds,
+                "last_lag_seconds": self._last_lag_seconds,
+                "max_lag_seconds": self._max_lag_seconds,
+            }
+
+
+progress_buffer = ProgressBuffer(PROGRESS_BUFFER_FLUSH_SIZE, PROGRESS_BUFFER_FLUSH_INTERVAL_SECONDS)
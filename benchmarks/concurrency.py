@@ -0,0 +1,154 @@
+"""Prueba de carga: throughput y latencia de la API al subir la concurrencia.
+
+Lanza peticiones concurrentes contra una instancia en ejecución y reporta,
+por nivel de concurrencia, peticiones por segundo y latencias p50/p95/p99.
+Para comparar antes y después de un cambio se ejecuta contra cada versión
+con los mismos parámetros, guardando la primera con --output y pasando ese
+archivo a la segunda con --compare:
+
+    MEMORY_STORE_LATENCY_MS=20 python -m benchmarks.serve --preset small --port 8000
+    python -m benchmarks.concurrency --base-url http://localhost:8000 \\
+        --path /ranking/bench-user-00000007 --path /usuarios/bench-user-00000007/retos-asignados \\
+        --concurrency 1 8 32 64 --requests 500 --output antes.json
+    # ... se cambia de versión y se vuelve a levantar la API ...
+    python -m benchmarks.concurrency --base-url http://localhost:8000 \\
+        --path /ranking/bench-user-00000007 --path /usuarios/bench-user-00000007/retos-asignados \\
+        --concurrency 1 8 32 64 --requests 500 --compare antes.json
+
+Requiere httpx.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_level(client: httpx.AsyncClient, paths, concurrency: int, total: int) -> dict:
+    targets = itertools.cycle(paths)
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            path = next(targets)
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    # Si el propio generador de carga se acerca a un núcleo completo, el
+    # límite medido es el del cliente y no el de la API
+    client_cpu = (time.process_time() - cpu_started) / elapsed
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "client_cpu": client_cpu,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(current: float, previous: float) -> str:
+    if not previous:
+        return "-"
+    return f"{(current - previous) / previous * 100:+.0f}%"
+
+
+def print_comparison(results: list, baseline: dict) -> None:
+    """Tabla de cada nivel de concurrencia frente al mismo nivel de `baseline`"""
+    previous_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"\nComparación con {baseline.get('git_commit') or 'el resultado anterior'}:")
+    print(f"{'conc.':>6} {'req/s antes':>12} {'req/s ahora':>12} {'cambio':>7} "
+          f"{'p95 antes':>10} {'p95 ahora':>10} {'cambio':>7}")
+    for result in results:
+        previous = previous_levels.get(result["concurrency"])
+        if previous is None:
+            continue
+        print(f"{result['concurrency']:>6} {previous['throughput_rps']:>12.1f} {result['throughput_rps']:>12.1f} "
+              f"{_change(result['throughput_rps'], previous['throughput_rps']):>7} "
+              f"{previous['p95_ms']:>10.1f} {result['p95_ms']:>10.1f} "
+              f"{_change(result['p95_ms'], previous['p95_ms']):>7}")
+
+
+async def main_async(args) -> None:
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        print(f"{'conc.':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>8} {'cpu cliente':>12}")
+        for concurrency in args.concurrency:
+            result = await run_level(client, args.path, concurrency, args.requests)
+            results.append(result)
+            print(f"{result['concurrency']:>6} {result['throughput_rps']:>9.1f} "
+                  f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+                  f"{result['p99_ms']:>9.1f} {result['errors']:>8} {result['client_cpu']:>12.0%}")
+
+    if args.output:
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "base_url": args.base_url,
+            "paths": args.path,
+            "requests": args.requests,
+            "levels": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", action="append", required=True,
+                        help="Ruta GET a consultar; se puede repetir")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultado JSON anterior (de --output) con el que comparar")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Dataset reproducible para los benchmarks de endpoints.
+
+Crea usuarios (con sus puntos), recompensas, retos e instancias de retos
+con IDs deterministas, así el runner puede armar las peticiones sabiendo
+qué documentos existen sin consultarlos. La misma semilla y los mismos
+tamaños generan siempre los mismos datos.
+
+Para cargarlo en el emulador de Firestore (nunca contra un proyecto real):
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python -m benchmarks.dataset --preset large --workers 16
+
+`benchmarks.endpoints` lo carga por su cuenta en el motor en memoria.
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+# Escrituras por commit permitidas por Firestore
+BATCH_SIZE = 500
+
+# (usuarios, retos, instancias, recompensas)
+PRESETS = {
+    "small": (1_000, 50, 5_000, 10),
+    "medium": (100_000, 1_000, 500_000, 50),
+    "large": (1_000_000, 10_000, 5_000_000, 100),
+}
+
+LOCATIONS = [
+    ("Bogotá", "Cundinamarca"), ("Medellín", "Antioquia"), ("Cali", "Valle del Cauca"),
+    ("Barranquilla", "Atlántico"), ("Cartagena", "Bolívar"), ("Bucaramanga", "Santander"),
+    ("Pereira", "Risaralda"), ("Manizales", "Caldas"), ("Santa Marta", "Magdalena"),
+    ("Cúcuta", "Norte de Santander"),
+]
+
+REWARD_TYPES = ("points", "badge", "item")
+
+
+def user_id(i: int) -> str:
+    return f"bench-user-{i:08d}"
+
+
+def reward_id(i: int) -> str:
+    return f"bench-reward-{i:04d}"
+
+
+def challenge_id(i: int) -> str:
+    return f"bench-challenge-{i:06d}"
+
+
+def instance_id(i: int) -> str:
+    return f"bench-instance-{i:09d}"
+
+
+def location(i: int) -> tuple:
+    return LOCATIONS[i % len(LOCATIONS)]
+
+
+class Dataset:
+    """Tamaños del dataset y cómo se reparten los retos.
+
+    Los retos se dividen en tres grupos: los regulares (con las instancias),
+    los que el benchmark desactiva y reactiva, y los que ya vencieron para
+    que haya trabajo en la desactivación de vencidos.
+    """
+
+    def __init__(self, users: int, challenges: int, instances: int, rewards: int, seed: int = 42):
+        if min(users, challenges, rewards) < 1 or instances < 0:
+            raise ValueError("Se necesita al menos un usuario, un reto y una recompensa")
+        self.users = users
+        self.challenges = challenges
+        self.instances = instances
+        self.rewards = rewards
+        self.seed = seed
+        reserved = challenges // 10
+        self.toggle_challenges = max(0, reserved // 2)
+        self.expired_challenges = max(0, reserved - self.toggle_challenges)
+        self.regular_challenges = challenges - reserved
+        # Cada usuario recibe a lo sumo una instancia de cada reto regular
+        if instances > users * self.regular_challenges:
+            raise ValueError("Hay más instancias que pares (usuario, reto regular) distintos")
+
+    @classmethod
+    def from_preset(cls, name: str, seed: int = 42) -> "Dataset":
+        return cls(*PRESETS[name], seed=seed)
+
+    def instance_owner(self, i: int) -> tuple:
+        """(índice de usuario, índice de reto) de la instancia i"""
+        user = i % self.users
+        return user, (user + i // self.users) % self.regular_challenges
+
+    def toggle_challenge_ids(self) -> list:
+        start = self.regular_challenges
+        return [challenge_id(i) for i in range(start, start + self.toggle_challenges)]
+
+    def as_dict(self) -> dict:
+        return {
+            "users": self.users,
+            "challenges": self.challenges,
+            "instances": self.instances,
+            "rewards": self.rewards,
+            "seed": self.seed,
+        }
+
+
+class _BatchWriter:
+    """Agrupa escrituras en batches y limita los commits en vuelo."""
+
+    def __init__(self, db, workers: int):
+        self._db = db
+        self._batch = db.batch()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._workers = workers
+        self._in_flight = set()
+        self.writes = 0
+
+    def set(self, collection: str, doc_id: str, data: dict) -> None:
+        self._batch.set(self._db.collection(collection).document(doc_id), data)
+        self._pending += 1
+        if self._pending >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._batch = self._batch, self._db.batch()
+        self.writes += self._pending
+        self._pending = 0
+        if self._executor is None:
+            batch.commit()
+            return
+        if len(self._in_flight) >= self._workers:
+            done, self._in_flight = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self._in_flight.add(self._executor.submit(batch.commit))
+
+    def close(self) -> None:
+        self._flush()
+        if self._executor is not None:
+            for future in self._in_flight:
+                future.result()
+            self._executor.shutdown()
+
+
+def seed(db, dataset: Dataset, workers: int = 1, progress=None) -> dict:
+    """Escribe el dataset en `db`; devuelve la cantidad de escrituras y segundos"""
+    rng = random.Random(dataset.seed)
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    writer = _BatchWriter(db, workers)
+
+    def report(collection: str, done: int, total: int) -> None:
+        if progress is not None and (done % 100_000 == 0 or done == total):
+            progress(collection, done, total)
+
+    for i in range(dataset.rewards):
+        writer.set("rewards", reward_id(i), {
+            "reward_id": reward_id(i),
+            "type": REWARD_TYPES[i % len(REWARD_TYPES)],
+            "value": str(rng.randint(1, 100) * 100),
+            "metadata": {"origen": "benchmark"},
+            "created_at": now,
+        })
+
+    for i in range(dataset.users):
+        city, state = location(i)
+        uid = user_id(i)
+        writer.set("users", uid, {
+            "user_id": uid, "email": f"{uid}@example.com", "name": uid, "city": city, "state": state,
+        })
+        writer.set("user_points", uid, {
+            "user_id": uid, "points": rng.randint(0, 10_000), "last_updated": now, "city": city, "state": state,
+        })
+        report("users", i + 1, dataset.users)
+
+    # Cupos de cada reto según las instancias que se le asignan
+    assigned = [0] * dataset.regular_challenges
+    max_limits = [rng.randint(50, 500) for _ in range(dataset.challenges)]
+    for i in range(dataset.instances):
+        user, challenge = dataset.instance_owner(i)
+        assigned[challenge] += 1
+        max_limit = max_limits[challenge]
+        # Una parte de las instancias ya avanzó y unas pocas se completaron
+        progress_left = max_limit if rng.random() < 0.5 else rng.randint(0, max_limit)
+        writer.set("challenge_instances", instance_id(i), {
+            "instance_id": instance_id(i),
+            "user_id": user_id(user),
+            "challenge_id": challenge_id(challenge),
+            "progress": progress_left,
+            "completed": progress_left == 0,
+            "date_started": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+        })
+        report("challenge_instances", i + 1, dataset.instances)
+
+    for i in range(dataset.challenges):
+        if i < dataset.regular_challenges:
+            max_date = now + timedelta(days=rng.randint(30, 365))
+        elif i < dataset.regular_challenges + dataset.toggle_challenges:
+            max_date = None
+        else:
+            max_date = now - timedelta(days=rng.randint(1, 30))
+        writer.set("challenges", challenge_id(i), {
+            "challenge_id": challenge_id(i),
+            "name": f"Reto {i}",
+            "description": f"Reto de benchmark número {i}",
+            "max_limit": max_limits[i],
+            "reward_id": reward_id(i % dataset.rewards),
+            "max_users": dataset.users + 1_000_000,
+            "status": "active",
+            "max_date": max_date,
+            "puntos": rng.randint(1, 100),
+            "date_creation": now,
+            "assigned_count": assigned[i] if i < dataset.regular_challenges else 0,
+        })
+
+    writer.close()
+    return {"writes": writer.writes, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--users", type=int, help="Reemplaza la cantidad de usuarios del preset")
+    parser.add_argument("--challenges", type=int, help="Reemplaza la cantidad de retos del preset")
+    parser.add_argument("--instances", type=int, help="Reemplaza la cantidad de instancias del preset")
+    parser.add_argument("--rewards", type=int, help="Reemplaza la cantidad de recompensas del preset")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def dataset_from_args(args) -> Dataset:
+    users, challenges, instances, rewards = PRESETS[args.preset]
+    return Dataset(
+        args.users or users,
+        args.challenges or challenges,
+        args.instances if args.instances is not None else instances,
+        args.rewards or rewards,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_arguments(parser)
+    parser.add_argument("--workers", type=int, default=8, help="Commits simultáneos")
+    args = parser.parse_args()
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        parser.error("Defina FIRESTORE_EMULATOR_HOST; el dataset solo se carga en el emulador")
+
+    from google.cloud import firestore
+
+    dataset = dataset_from_args(args)
+    db = firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "benchmark"))
+    result = seed(db, dataset, workers=args.workers,
+                  progress=lambda collection, done, total: print(f"{collection}: {done}/{total}"))
+    print(f"{result['writes']} escrituras en {result['seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""Benchmark de todos los endpoints con mezclas de tráfico reproducibles.
+
+Carga un dataset (ver benchmarks.dataset) y ejecuta una o más mezclas:
+
+- progreso: avances de retos, sueltos y en lote, con lecturas de puntos
+- ranking: top, posiciones y vecinos global, por ciudad y por departamento
+- listados: páginas de usuarios, retos, recompensas y retos por usuario
+- completa: todas las rutas de app/main.py, incluidas las de escritura y métricas
+
+Por mezcla y por ruta reporta latencia p50/p95/p99, throughput y las
+operaciones de Firestore por petición (de GET /metricas/firestore, que
+cuenta también lo leído mientras se envían las respuestas en streaming).
+
+Sin --base-url la aplicación corre en el mismo proceso con el motor en
+memoria y el dataset se carga antes de iniciarla; la latencia no incluye
+red. Contra el emulador se carga el dataset con benchmarks.dataset, se
+levanta la API apuntando a él y se usan los mismos parámetros:
+
+    python -m benchmarks.endpoints --preset small --mix progreso ranking \\
+        --requests 2000 --concurrency 16 --output resultados.json
+    python -m benchmarks.endpoints --preset small --compare resultados.json
+
+Las mezclas se ejecutan en orden sobre los mismos datos, así que la misma
+semilla, preset y orden de mezclas generan las mismas peticiones. Con
+--compare se compara contra un resultado anterior y el proceso termina
+con código 1 si alguna métrica empeoró más que --tolerance.
+
+Requiere httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from benchmarks.concurrency import percentile
+from benchmarks.dataset import (
+    LOCATIONS,
+    REWARD_TYPES,
+    add_dataset_arguments,
+    challenge_id,
+    dataset_from_args,
+    instance_id,
+    reward_id,
+    seed,
+    user_id,
+)
+
+# Eventos por petición de POST /progreso-reto/lote y usuarios por asignación en lote
+BULK_PROGRESS_EVENTS = 50
+BULK_ASSIGN_USERS = 20
+
+
+class RequestFactory:
+    """Arma peticiones sobre documentos que existen en el dataset."""
+
+    def __init__(self, dataset, rng: random.Random):
+        self.dataset = dataset
+        self.rng = rng
+        self.created = 0
+        self._inactive = set()
+
+    def user(self) -> str:
+        return user_id(self.rng.randrange(self.dataset.users))
+
+    def instance(self) -> str:
+        return instance_id(self.rng.randrange(max(1, self.dataset.instances)))
+
+    def regular_challenge(self) -> str:
+        return challenge_id(self.rng.randrange(self.dataset.regular_challenges))
+
+    def toggle_challenge(self, deactivate: bool) -> str:
+        # Se desactivan retos activos y se reactivan los desactivados antes
+        toggle_ids = self.dataset.toggle_challenge_ids()
+        candidates = [cid for cid in toggle_ids if (cid in self._inactive) != deactivate] or toggle_ids
+        if not candidates:
+            return self.regular_challenge()
+        chosen = self.rng.choice(candidates)
+        if deactivate:
+            self._inactive.add(chosen)
+        else:
+            self._inactive.discard(chosen)
+        return chosen
+
+    def location(self) -> tuple:
+        return self.rng.choice(LOCATIONS)
+
+    def cursor(self, id_fn, size: int) -> dict:
+        # La mitad de los listados pide la primera página y el resto una intermedia
+        return {"start_after": id_fn(self.rng.randrange(size))} if self.rng.random() < 0.5 else {}
+
+
+def _users_page(f):
+    params = {"limit": 100, **f.cursor(user_id, f.dataset.users)}
+    if f.rng.random() < 0.2:
+        params.update(stream="true", limit=500)
+    return "GET", "/usuarios", {"params": params}
+
+
+def _new_challenge(f):
+    f.created += 1
+    max_date = datetime.now(timezone.utc) + timedelta(days=f.rng.randint(1, 90))
+    return "POST", "/retos", {"json": {
+        "name": f"Reto benchmark {f.created}",
+        "description": "Reto creado durante el benchmark de endpoints",
+        "max_limit": f.rng.randint(10, 100),
+        "reward_id": reward_id(f.rng.randrange(f.dataset.rewards)),
+        "max_users": 1000,
+        "puntos": f.rng.randint(1, 100),
+        "max_date": max_date.isoformat(),
+    }}
+
+
+def _challenges_page(f):
+    params = {"limit": 50, **f.cursor(challenge_id, f.dataset.challenges)}
+    if f.rng.random() < 0.3:
+        params["status"] = "active"
+    if f.rng.random() < 0.3:
+        params["fields"] = "name,status,max_date"
+    return "GET", "/retos", {"params": params}
+
+
+def _new_reward(f):
+    f.created += 1
+    return "POST", "/recompensas", {"json": {
+        "type": f.rng.choice(REWARD_TYPES),
+        "value": str(f.rng.randint(1, 100) * 100),
+        "metadata": {"origen": "benchmark", "n": f.created},
+    }}
+
+
+def _rewards_page(f):
+    params = {"limit": 50, **f.cursor(reward_id, f.dataset.rewards)}
+    if f.rng.random() < 0.3:
+        params["type"] = f.rng.choice(REWARD_TYPES)
+    return "GET", "/recompensas", {"params": params}
+
+
+def _bulk_assign(f):
+    user_ids = sorted({f.user() for _ in range(BULK_ASSIGN_USERS)})
+    return "POST", "/instancias-retos/lote", {"json": {"challenge_id": f.regular_challenge(), "user_ids": user_ids}}
+
+
+def _bulk_progress(f):
+    events = [{"instance_id": f.instance(), "count": 1} for _ in range(BULK_PROGRESS_EVENTS)]
+    return "POST", "/progreso-reto/lote", {"json": {"events": events}}
+
+
+# Ruta (método y plantilla, como en GET /metricas/firestore) -> constructor de la petición
+ROUTES = {
+    "GET /usuarios": _users_page,
+    "GET /usuarios/{user_id}/puntos": lambda f: ("GET", f"/usuarios/{f.user()}/puntos", {}),
+    "POST /usuarios/{user_id}/puntos/iniciar": lambda f: ("POST", f"/usuarios/{f.user()}/puntos/iniciar", {}),
+    "POST /usuarios/{user_id}/puntos/sincronizar-ubicacion":
+        lambda f: ("POST", f"/usuarios/{f.user()}/puntos/sincronizar-ubicacion", {}),
+    "POST /retos": _new_challenge,
+    "GET /retos": _challenges_page,
+    "POST /retos/deshabilitar-expirados": lambda f: ("POST", "/retos/deshabilitar-expirados", {}),
+    "PUT /retos/{challenge_id}/desactivar": lambda f: ("PUT", f"/retos/{f.toggle_challenge(True)}/desactivar", {}),
+    "PUT /retos/{challenge_id}/reactivar": lambda f: ("PUT", f"/retos/{f.toggle_challenge(False)}/reactivar", {}),
+    "GET /metricas/cache": lambda f: ("GET", "/metricas/cache", {}),
+    "GET /metricas/progreso": lambda f: ("GET", "/metricas/progreso", {}),
+    "GET /metrics": lambda f: ("GET", "/metrics", {}),
+    "GET /metricas/firestore": lambda f: ("GET", "/metricas/firestore", {}),
+    "GET /metricas/ranking": lambda f: ("GET", "/metricas/ranking", {}),
+    "POST /recompensas": _new_reward,
+    "GET /recompensas": _rewards_page,
+    "POST /instancias-retos": lambda f: ("POST", "/instancias-retos", {
+        "json": {"user_id": f.user(), "challenge_id": f.regular_challenge()}}),
+    "POST /instancias-retos/lote": _bulk_assign,
+    "GET /usuarios/{user_id}/retos-asignados": lambda f: ("GET", f"/usuarios/{f.user()}/retos-asignados", {}),
+    "GET /usuarios/{user_id}/retos-completados": lambda f: ("GET", f"/usuarios/{f.user()}/retos-completados", {}),
+    "POST /progreso-reto/lote": _bulk_progress,
+    "POST /progreso-reto/{instance_id}": lambda f: ("POST", f"/progreso-reto/{f.instance()}", {}),
+    "GET /ranking/top": lambda f: ("GET", "/ranking/top", {"params": {"limit": 10}}),
+    "GET /ranking/ciudad/top": lambda f: ("GET", "/ranking/ciudad/top", {"params": {"ciudad": f.location()[0]}}),
+    "GET /ranking/departamento/top":
+        lambda f: ("GET", "/ranking/departamento/top", {"params": {"departamento": f.location()[1]}}),
+    "GET /ranking/{user_id}/vecinos": lambda f: ("GET", f"/ranking/{f.user()}/vecinos", {}),
+    "GET /ranking/ciudad/{user_id}/vecinos": lambda f: ("GET", f"/ranking/ciudad/{f.user()}/vecinos", {}),
+    "GET /ranking/departamento/{user_id}/vecinos":
+        lambda f: ("GET", f"/ranking/departamento/{f.user()}/vecinos", {}),
+    "GET /ranking/{user_id}": lambda f: ("GET", f"/ranking/{f.user()}", {}),
+    "GET /ranking/ciudad/{user_id}": lambda f: ("GET", f"/ranking/ciudad/{f.user()}", {}),
+    "GET /ranking/departamento/{user_id}": lambda f: ("GET", f"/ranking/departamento/{f.user()}", {}),
+}
+
+# Peso de cada ruta en cada mezcla
+MIXES = {
+    "progreso": {
+        "POST /progreso-reto/{instance_id}": 60,
+        "POST /progreso-reto/lote": 5,
+        "GET /usuarios/{user_id}/puntos": 15,
+        "GET /ranking/{user_id}": 10,
+        "GET /usuarios/{user_id}/retos-asignados": 10,
+    },
+    "ranking": {
+        "GET /ranking/top": 15,
+        "GET /ranking/ciudad/top": 10,
+        "GET /ranking/departamento/top": 5,
+        "GET /ranking/{user_id}": 25,
+        "GET /ranking/ciudad/{user_id}": 10,
+        "GET /ranking/departamento/{user_id}": 5,
+        "GET /ranking/{user_id}/vecinos": 15,
+        "GET /ranking/ciudad/{user_id}/vecinos": 10,
+        "GET /ranking/departamento/{user_id}/vecinos": 5,
+    },
+    "listados": {
+        "GET /usuarios": 20,
+        "GET /retos": 20,
+        "GET /recompensas": 15,
+        "GET /usuarios/{user_id}/retos-asignados": 25,
+        "GET /usuarios/{user_id}/retos-completados": 20,
+    },
+    # Todas las rutas; las de administración y métricas con poco peso
+    "completa": {
+        **{route: 1 for route in ROUTES},
+        "POST /progreso-reto/{instance_id}": 20,
+        "GET /usuarios/{user_id}/puntos": 8,
+        "GET /ranking/{user_id}": 8,
+        "GET /ranking/top": 6,
+        "GET /usuarios/{user_id}/retos-asignados": 6,
+        "GET /retos": 4,
+        "POST /instancias-retos": 4,
+    },
+}
+
+
+def build_requests(dataset, mix: str, total: int, rng: random.Random) -> list:
+    """Secuencia fija de (ruta, método, url, kwargs) para la mezcla"""
+    weights = MIXES[mix]
+    routes = list(weights)
+    factory = RequestFactory(dataset, rng)
+    chosen = rng.choices(routes, weights=[weights[route] for route in routes], k=total)
+    return [(route, *ROUTES[route](factory)) for route in chosen]
+
+
+async def run_requests(client: httpx.AsyncClient, requests: list, concurrency: int) -> tuple:
+    pending = iter(requests)
+    samples = []
+
+    async def worker():
+        for route, method, url, kwargs in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            samples.append((route, (time.perf_counter() - started) * 1000, status))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def _latency(values) -> dict:
+    return {
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+    }
+
+
+async def _firestore_routes(client: httpx.AsyncClient) -> dict:
+    try:
+        response = await client.get("/metricas/firestore")
+        response.raise_for_status()
+        return response.json()["routes"]
+    except (httpx.HTTPError, KeyError, ValueError):
+        return {}
+
+
+def _operations_delta(before: dict, after: dict, route: str):
+    current = after.get(route)
+    if current is None:
+        return None
+    previous = before.get(route, {})
+    requests = current["requests"] - previous.get("requests", 0)
+    if requests <= 0:
+        return None
+    return {
+        field: round((current[field] - previous.get(field, 0)) / requests, 2)
+        for field in ("reads", "writes", "queries", "transactions", "rpcs")
+    }
+
+
+def summarize(samples: list, seconds: float, before: dict, after: dict) -> dict:
+    routes = {}
+    for route, latency, status in samples:
+        routes.setdefault(route, []).append((latency, status))
+
+    def counts(entries) -> dict:
+        statuses = {}
+        for _, status in entries:
+            key = "error" if status is None else f"{status // 100}xx"
+            statuses[key] = statuses.get(key, 0) + 1
+        return statuses
+
+    def errors(entries) -> int:
+        return sum(1 for _, status in entries if status is None or status >= 500)
+
+    return {
+        "requests": len(samples),
+        "errors": errors([(latency, status) for _, latency, status in samples]),
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(samples) / seconds, 2),
+        **_latency([latency for _, latency, _ in samples]),
+        "routes": {
+            route: {
+                "requests": len(entries),
+                "errors": errors(entries),
+                "status": counts(entries),
+                **_latency([latency for latency, _ in entries]),
+                "firestore_per_request": _operations_delta(before, after, route),
+            }
+            for route, entries in sorted(routes.items())
+        },
+    }
+
+
+async def run_mixes(client: httpx.AsyncClient, dataset, args) -> dict:
+    results = {}
+    rng = random.Random(args.seed)
+    for mix in args.mix:
+        if args.warmup:
+            await run_requests(client, build_requests(dataset, mix, args.warmup, rng), args.concurrency)
+        requests = build_requests(dataset, mix, args.requests, rng)
+        before = await _firestore_routes(client)
+        samples, seconds = await run_requests(client, requests, args.concurrency)
+        after = await _firestore_routes(client)
+        results[mix] = summarize(samples, seconds, before, after)
+        _print_mix(mix, results[mix])
+    return results
+
+
+async def run_in_process(dataset, args) -> tuple:
+    # La configuración se lee al importar la aplicación
+    os.environ["STORAGE_BACKEND"] = "memory"
+    from app import config
+    from app.database import close_client, get_sync_client, init_client
+    from app.main import app
+
+    init_client()
+    print(f"Cargando dataset {dataset.as_dict()} en memoria...")
+    seeded = seed(get_sync_client(), dataset)
+    print(f"{seeded['writes']} escrituras en {seeded['seconds']} s")
+
+    settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout) as client:
+                results = await run_mixes(client, dataset, args)
+    finally:
+        close_client()
+    return results, {"mode": "in-process", "config": settings}
+
+
+async def run_remote(dataset, args) -> tuple:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        results = await run_mixes(client, dataset, args)
+    return results, {"mode": "remote", "base_url": args.base_url}
+
+
+def _print_mix(mix: str, result: dict) -> None:
+    print(f"\n== {mix}: {result['requests']} peticiones, {result['throughput_rps']:.1f} req/s, "
+          f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+          f"{result['errors']} errores")
+    print(f"{'ruta':<56} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lect.':>7} {'escr.':>7}")
+    for route, stats in result["routes"].items():
+        ops = stats["firestore_per_request"] or {}
+        print(f"{route:<56} {stats['requests']:>6} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+              f"{stats['p99_ms']:>8.1f} {ops.get('reads', '-'):>7} {ops.get('writes', '-'):>7}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Métricas que empeoraron más que `tolerance` respecto de `baseline`"""
+    regressions = []
+
+    def check(label: str, current, previous, higher_is_worse: bool = True) -> None:
+        if current is None or previous is None:
+            return
+        if previous == 0:
+            worse = current > 0 if higher_is_worse else False
+        else:
+            change = (current - previous) / previous
+            worse = change > tolerance if higher_is_worse else change < -tolerance
+        if worse:
+            regressions.append(f"{label}: {previous} -> {current}")
+
+    for mix, result in results.items():
+        previous = baseline.get("mixes", {}).get(mix)
+        if previous is None:
+            continue
+        check(f"{mix} throughput_rps", result["throughput_rps"], previous["throughput_rps"], higher_is_worse=False)
+        check(f"{mix} p95_ms", result["p95_ms"], previous["p95_ms"])
+        for route, stats in result["routes"].items():
+            old = previous["routes"].get(route)
+            if old is None:
+                continue
+            check(f"{mix} {route} p95_ms", stats["p95_ms"], old["p95_ms"])
+            check(f"{mix} {route} errors", stats["errors"], old["errors"])
+            ops, old_ops = stats["firestore_per_request"] or {}, old["firestore_per_request"] or {}
+            for field in ("reads", "writes"):
+                check(f"{mix} {route} {field}/petición", ops.get(field), old_ops.get(field))
+    return regressions
+
+
+async def main_async(args) -> int:
+    dataset = dataset_from_args(args)
+    if args.base_url:
+        results, environment = await run_remote(dataset, args)
+    else:
+        results, environment = await run_in_process(dataset, args)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "dataset": dataset.as_dict(),
+        "parameters": {"requests": args.requests, "concurrency": args.concurrency, "warmup": args.warmup},
+        "environment": environment,
+        "mixes": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regresiones respecto de {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nSin regresiones respecto de {args.compare}")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_arguments(parser)
+    parser.add_argument("--base-url", help="API ya en ejecución; sin este parámetro corre en el mismo proceso")
+    parser.add_argument("--mix", nargs="+", choices=list(MIXES), default=list(MIXES))
+    parser.add_argument("--requests", type=int, default=1000, help="Peticiones medidas por mezcla")
+    parser.add_argument("--warmup", type=int, default=100, help="Peticiones sin medir antes de cada mezcla")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Resultado JSON anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Empeoramiento relativo permitido al comparar (0.10 = 10%%)")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compara las estrategias de ranking a medida que crece 'user_points'.
+
+Se ejecuta contra el emulador de Firestore para no generar costos:
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python -m benchmarks.rank_strategies --sizes 1000 10000 50000
+
+Por cada tamaño de colección y estrategia reporta la latencia (p50 y p95)
+y las lecturas facturables por consulta. Las lecturas se miden en cada
+llamada con el conteo de operaciones de app.firestore_ops (el mismo de
+X-Firestore-Reads): un documento leído es una lectura y una agregación
+count() cuesta una lectura por cada 1000 entradas de índice contadas
+(mínimo una).
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from google.cloud import firestore
+
+from app.crud import RANK_STRATEGIES
+from app.firestore_ops import begin_request, end_request, instrument_client
+from app.leaderboard import leaderboard_index
+
+CITIES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Cartagena",
+          "Bucaramanga", "Pereira", "Manizales", "Santa Marta", "Cúcuta"]
+
+
+def seed(db, start: int, end: int) -> None:
+    batch = db.batch()
+    pending = 0
+    for i in range(start, end):
+        user_id = f"bench-user-{i:08d}"
+        city = CITIES[i % len(CITIES)]
+        points = random.randint(0, 10000)
+        batch.set(db.collection("users").document(user_id), {
+            "user_id": user_id, "email": f"{user_id}@example.com",
+            "name": user_id, "city": city, "state": city,
+        })
+        batch.set(db.collection("user_points").document(user_id), {
+            "user_id": user_id, "points": points, "city": city, "state": city,
+        })
+        leaderboard_index.set_points(user_id, points, {"city": city, "state": city})
+        pending += 2
+        if pending >= 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+
+async def run(sizes, samples: int, strategies) -> None:
+    # Las estrategias usan el cliente asíncrono, como la API; los datos se cargan con su copia síncrona
+    db = instrument_client(firestore.AsyncClient(project=os.getenv("GOOGLE_CLOUD_PROJECT", "benchmark")))
+    sync_db = db._to_sync_copy()
+    leaderboard_index.load([])
+    seeded = 0
+
+    print(f"{'usuarios':>9} {'ámbito':>7} {'estrategia':>10} {'p50 ms':>9} {'p95 ms':>9} {'lecturas':>9}")
+    for size in sizes:
+        seed(sync_db, seeded, size)
+        seeded = size
+        user_ids = [f"bench-user-{random.randrange(size):08d}" for _ in range(samples)]
+
+        for scope in ("global", "ciudad"):
+            for strategy in strategies:
+                rank_fn = RANK_STRATEGIES[strategy]
+                latencies = []
+                reads = []
+                for user_id in user_ids:
+                    scope_args = ()
+                    if scope == "ciudad":
+                        index = int(user_id.rsplit("-", 1)[1])
+                        scope_args = ("city", CITIES[index % len(CITIES)])
+                    stats, token = begin_request()
+                    started = time.perf_counter()
+                    try:
+                        await rank_fn(db, user_id, *scope_args)
+                    finally:
+                        end_request(token)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    reads.append(stats.reads)
+
+                p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+                print(f"{size:>9} {scope:>7} {strategy:>10} "
+                      f"{statistics.median(latencies):>9.2f} {p95:>9.2f} "
+                      f"{statistics.mean(reads):>9.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--strategies", nargs="+", default=list(RANK_STRATEGIES),
+                        choices=list(RANK_STRATEGIES))
+    args = parser.parse_args()
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        parser.error("Defina FIRESTORE_EMULATOR_HOST para no ejecutar contra producción")
+
+    asyncio.run(run(sorted(args.sizes), args.samples, args.strategies))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Levanta la API con el motor en memoria y el dataset de benchmarks cargado.
+
+Sirve para ejecutar benchmarks.concurrency (o benchmarks.endpoints con
+--base-url) contra un proceso aparte con datos reproducibles. Con
+MEMORY_STORE_LATENCY_MS cada RPC del motor espera ese tiempo, como si la
+aplicación hablara con Firestore por la red:
+
+    MEMORY_STORE_LATENCY_MS=20 python -m benchmarks.serve --preset small --port 8000
+
+Requiere uvicorn.
+"""
+import argparse
+import os
+
+from benchmarks.dataset import add_dataset_arguments, dataset_from_args, seed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # La configuración se lee al importar la aplicación
+    os.environ["STORAGE_BACKEND"] = "memory"
+    import uvicorn
+
+    from app.database import get_sync_client, init_client
+    from app.main import app
+
+    dataset = dataset_from_args(args)
+    init_client()
+    print(f"Cargando dataset {dataset.as_dict()} en memoria...")
+    seeded = seed(get_sync_client(), dataset)
+    print(f"{seeded['writes']} escrituras en {seeded['seconds']} s")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
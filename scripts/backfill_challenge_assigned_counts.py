@@ -0,0 +1,37 @@
+"""Calcula el contador 'assigned_count' de los challenges existentes.
+
+Necesario una sola vez para los challenges creados antes de que se
+validara max_users con el contador. Conviene ejecutarlo con poco tráfico,
+porque una asignación simultánea puede quedar fuera de la cuenta. En los
+challenges con shards de asignación corrige la base y vuelve a repartir
+los cupos que quedan:
+
+    python -m scripts.backfill_challenge_assigned_counts
+"""
+import argparse
+import asyncio
+
+import firebase_admin
+from firebase_admin import credentials
+
+from app.crud import backfill_challenge_assigned_counts
+from app.database import init_client
+
+
+async def backfill() -> dict:
+    # El cliente asíncrono se crea dentro del event loop que lo va a usar
+    return await backfill_challenge_assigned_counts(init_client())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--credentials", default="app/firebase-key.json")
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    result = asyncio.run(backfill())
+    print(f"Challenges revisados: {result['scanned']}, actualizados: {result['updated']}")
+
+
+if __name__ == "__main__":
+    main()
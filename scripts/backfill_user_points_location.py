@@ -0,0 +1,39 @@
+"""Copia la ciudad y el departamento de 'users' en los documentos de 'user_points'.
+
+Necesario una sola vez para los registros de puntos creados antes de que
+la ubicación se guardara junto a los puntos:
+
+    python -m scripts.backfill_user_points_location --page-size 500
+"""
+import argparse
+import asyncio
+
+import firebase_admin
+from firebase_admin import credentials
+
+from app.crud import backfill_user_points_location
+from app.database import init_client
+
+
+async def backfill(page_size: int) -> dict:
+    # El cliente asíncrono se crea dentro del event loop que lo va a usar
+    return await backfill_user_points_location(init_client(), page_size=page_size)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=500,
+                        help="Documentos por página y por batch (máximo 500)")
+    parser.add_argument("--credentials", default="app/firebase-key.json")
+    args = parser.parse_args()
+
+    if not 0 < args.page_size <= 500:
+        parser.error("--page-size debe estar entre 1 y 500")
+
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    result = asyncio.run(backfill(args.page_size))
+    print(f"Documentos revisados: {result['scanned']}, actualizados: {result['updated']}")
+
+
+if __name__ == "__main__":
+    main()
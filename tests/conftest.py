@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Las pruebas nunca usan Firestore; se fija antes de importar la configuración
+os.environ["STORAGE_BACKEND"] = "memory"
+
+from app import crud
+from app.cache import challenge_cache, point_shards_cache, points_cache
+from app.counters import progress_counters
+from app.expiry import ExpiryScheduler
+from app.leaderboard import leaderboard_index
+from app.memory_store import AsyncMemoryClient
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # Las cachés, el índice, el estado de los rollups y el programador de
+    # vencimientos son globales del módulo; cada prueba empieza de cero
+    challenge_cache.clear()
+    points_cache.clear()
+    point_shards_cache.clear()
+    progress_counters.reset()
+    leaderboard_index.load([])
+    crud._last_rollup.clear()
+    crud._pending_rollups.clear()
+    monkeypatch.setattr(crud, "expiry_scheduler", ExpiryScheduler())
+    # Con algo de latencia las corutinas concurrentes se intercalan
+    return AsyncMemoryClient(latency=0.001)
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """Cliente HTTP de la aplicación sobre el motor en memoria del fixture db.
+
+    El lifespan corre sin el programador de vencimientos, que es global de
+    app.expiry y no el que el fixture db deja en crud.
+    """
+    from app import main
+    from app.database import init_client
+
+    monkeypatch.setattr(main, "CHALLENGE_EXPIRY_SCHEDULER", False)
+    init_client(db)
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def seed(db, collection: str, doc_id: str, data: dict) -> None:
+    db._to_sync_copy().collection(collection).document(doc_id).set(data)
+
+
+def get_doc(db, collection: str, doc_id: str) -> dict:
+    return db._to_sync_copy().collection(collection).document(doc_id).get().to_dict()
+
+
+def fail_commits(db, monkeypatch, *numbers: int, apply: bool = False) -> None:
+    """Hace fallar los commits indicados (1 es el primero desde la llamada).
+
+    Con apply=True el commit se aplica y aun así falla, como una respuesta
+    que se pierde en la red después de confirmar las escrituras.
+    """
+    commit_writes = db._commit_writes
+    calls = 0
+
+    async def failing_commit(writes, reads=None):
+        nonlocal calls
+        calls += 1
+        if calls in numbers:
+            if apply:
+                await commit_writes(writes, reads)
+            raise RuntimeError(f"Commit {calls} fallido")
+        return await commit_writes(writes, reads)
+
+    monkeypatch.setattr(db, "_commit_writes", failing_commit)
@@ -0,0 +1,222 @@
+"""Pruebas de la asignación de challenges sobre el motor en memoria.
+
+Cubren el límite max_users con asignaciones simultáneas, sueltas y en lote,
+el reparto de cupos entre los shards de asignación, la migración de los
+challenges anteriores a ellos, el tamaño de los bloques de la asignación
+en lote frente al límite de 500 escrituras por commit y las líneas NDJSON
+de POST /instancias-retos/lote.
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app import crud
+from tests.conftest import get_doc, seed
+
+
+@pytest.fixture
+def shards(db, monkeypatch):
+    monkeypatch.setattr(crud, "CHALLENGE_ASSIGNMENT_SHARDS", 3)
+    return db
+
+
+def _seed_users(db, count: int) -> list:
+    user_ids = [f"u{i}" for i in range(count)]
+    for user_id in user_ids:
+        seed(db, "users", user_id, {"user_id": user_id})
+    return user_ids
+
+
+def _create_challenge(db, max_users: int) -> str:
+    challenge = asyncio.run(crud.create_challenge(db, {
+        "name": "Reto", "max_limit": 5, "max_users": max_users, "puntos": 10,
+    }))
+    return challenge["challenge_id"]
+
+
+def _shards(db, challenge_id: str) -> dict:
+    shards = db._to_sync_copy().collection("challenges").document(challenge_id).collection("assignment_shards")
+    return {doc.id: doc.to_dict() for doc in shards.stream()}
+
+
+def _instances(db, challenge_id: str) -> list:
+    instances = db._to_sync_copy().collection("challenge_instances")
+    return [doc.to_dict()["user_id"] for doc in instances.where("challenge_id", "==", challenge_id).stream()]
+
+
+def _assign_all(db, challenge_id: str, user_ids) -> list:
+    async def assign(user_id):
+        try:
+            await crud.assign_challenge_to_user(db, {"user_id": user_id, "challenge_id": challenge_id})
+            return 201
+        except HTTPException as he:
+            return he.status_code
+
+    async def scenario():
+        return await asyncio.gather(*(assign(user_id) for user_id in user_ids))
+
+    return asyncio.run(scenario())
+
+
+async def _collect(lines) -> list:
+    return [line async for line in lines]
+
+
+def test_concurrent_assignments_respect_max_users(shards):
+    db = shards
+    user_ids = _seed_users(db, 12)
+    challenge_id = _create_challenge(db, 7)
+
+    statuses = _assign_all(db, challenge_id, user_ids)
+
+    assert sorted(statuses) == [201] * 7 + [409] * 5
+    assert len(_instances(db, challenge_id)) == 7
+    # Los cupos se repartieron entre los shards y el challenge no se escribió
+    assert sorted(shard["capacity"] for shard in _shards(db, challenge_id).values()) == [2, 2, 3]
+    assert sum(shard["assigned"] for shard in _shards(db, challenge_id).values()) == 7
+    assert get_doc(db, "challenges", challenge_id)["assigned_count"] == 0
+
+
+def test_full_shard_falls_back_to_the_others(shards):
+    db = shards
+    user_ids = _seed_users(db, 4)
+    challenge_id = _create_challenge(db, 3)
+
+    # Un cupo por shard: desde donde empiece, la asignación busca el libre
+    statuses = [_assign_all(db, challenge_id, [user_id])[0] for user_id in user_ids]
+
+    assert statuses == [201, 201, 201, 409]
+    assert all(shard["assigned"] == 1 for shard in _shards(db, challenge_id).values())
+
+
+def test_challenge_without_shards_is_migrated(shards):
+    db = shards
+    user_ids = _seed_users(db, 5)
+    seed(db, "challenges", "c1", {
+        "challenge_id": "c1", "status": "active", "max_limit": 5, "max_users": 10, "assigned_count": 8,
+    })
+
+    statuses = _assign_all(db, "c1", user_ids)
+
+    # Quedaban 2 cupos después de la base, así que basta con 2 shards
+    assert sorted(statuses) == [201] * 2 + [409] * 3
+    challenge = get_doc(db, "challenges", "c1")
+    assert (challenge["assigned_count"], challenge["assignment_shards"]) == (8, 2)
+    assert sorted(shard["capacity"] for shard in _shards(db, "c1").values()) == [1, 1]
+
+
+def test_concurrent_bulk_assignments_respect_max_users(shards):
+    db = shards
+    user_ids = _seed_users(db, 40)
+    challenge_id = _create_challenge(db, 25)
+
+    async def scenario():
+        first = await crud.assign_challenge_to_users(db, challenge_id, user_ids[:20])
+        second = await crud.assign_challenge_to_users(db, challenge_id, user_ids[20:])
+        return await asyncio.gather(_collect(first), _collect(second))
+
+    first, second = asyncio.run(scenario())
+
+    assert first[-1]["created"] + second[-1]["created"] == 25
+    assert first[-1]["over_capacity"] + second[-1]["over_capacity"] == 15
+    assert len(_instances(db, challenge_id)) == 25
+
+
+def test_bulk_chunks_leave_room_for_the_shard_writes(db, monkeypatch):
+    monkeypatch.setattr(crud, "CHALLENGE_ASSIGNMENT_SHARDS", 1)
+    user_ids = _seed_users(db, 700)
+    challenge_id = _create_challenge(db, 600)
+
+    async def scenario():
+        return await _collect(await crud.assign_challenge_to_users(db, challenge_id, user_ids))
+
+    lines = asyncio.run(scenario())
+
+    # Con un shard caben 499 instancias por commit de 500 escrituras
+    assert [(line["chunk"], line["requested"], line["created"]) for line in lines[:-1]] == [
+        (1, 499, 499), (2, 700, 600),
+    ]
+    assert (lines[-1]["done"], lines[-1]["over_capacity"]) == (True, 100)
+    assert len(_instances(db, challenge_id)) == 600
+
+
+def test_bulk_chunk_size_shrinks_with_more_shards(db, monkeypatch):
+    monkeypatch.setattr(crud, "CHALLENGE_ASSIGNMENT_SHARDS", 10)
+    user_ids = _seed_users(db, 500)
+    challenge_id = _create_challenge(db, 1000)
+
+    async def scenario():
+        return await _collect(await crud.assign_challenge_to_users(db, challenge_id, user_ids))
+
+    lines = asyncio.run(scenario())
+
+    assert [line["requested"] for line in lines[:-1]] == [490, 500]
+    assert lines[-1]["created"] == 500
+
+
+def test_backfill_recomputes_the_base_and_the_capacities(shards):
+    db = shards
+    user_ids = _seed_users(db, 3)
+    challenge_id = _create_challenge(db, 6)
+    _assign_all(db, challenge_id, user_ids[:2])
+    # Dos instancias creadas sin pasar por el contador
+    for instance_id in ("x1", "x2"):
+        seed(db, "challenge_instances", instance_id, {"user_id": user_ids[2], "challenge_id": challenge_id})
+
+    assert asyncio.run(crud.backfill_challenge_assigned_counts(db)) == {"scanned": 1, "updated": 1}
+
+    assert get_doc(db, "challenges", challenge_id)["assigned_count"] == 2
+    shard_docs = _shards(db, challenge_id).values()
+    # Quedan 2 cupos de 6 entre los 3 shards
+    assert sum(shard["capacity"] - shard["assigned"] for shard in shard_docs) == 2
+    statuses = _assign_all(db, challenge_id, user_ids)
+    assert sorted(statuses) == [201, 201, 409]
+
+
+def test_bulk_endpoint_streams_ndjson_progress(client, db, monkeypatch):
+    monkeypatch.setattr(crud, "CHALLENGE_ASSIGNMENT_SHARDS", 1)
+    monkeypatch.setattr(crud, "MAX_BATCH_WRITES", 4)
+    _seed_users(db, 5)
+    challenge_id = _create_challenge(db, 10)
+
+    response = client.post("/instancias-retos/lote", json={
+        "challenge_id": challenge_id, "user_ids": ["u0", "u1", "nadie", "u2", "u0", "u3"],
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    # Bloques de 3 usuarios: 4 escrituras por commit menos la del shard
+    assert [(line["chunk"], line["requested"], line["created"], line["missing_users"]) for line in lines[:-1]] == [
+        (1, 3, 2, 1), (2, 5, 4, 1),
+    ]
+    assert {key: lines[-1][key] for key in ("done", "requested", "created", "missing_users", "over_capacity")} == {
+        "done": True, "requested": 5, "created": 4, "missing_users": 1, "over_capacity": 0,
+    }
+    assert sorted(_instances(db, challenge_id)) == ["u0", "u1", "u2", "u3"]
+
+
+def test_bulk_endpoint_assigns_by_user_filter(client, db):
+    for user_id, city in (("u1", "Cali"), ("u2", "Pasto"), ("u3", "Cali")):
+        seed(db, "users", user_id, {"user_id": user_id, "city": city})
+    challenge_id = _create_challenge(db, 10)
+
+    response = client.post("/instancias-retos/lote", json={
+        "challenge_id": challenge_id, "user_filter": {"city": "Cali"},
+    })
+
+    assert json.loads(response.text.splitlines()[-1])["created"] == 2
+    assert sorted(_instances(db, challenge_id)) == ["u1", "u3"]
+
+
+def test_bulk_endpoint_rejects_invalid_requests(client, db):
+    challenge_id = _create_challenge(db, 10)
+    seed(db, "challenges", "inactive", {"challenge_id": "inactive", "status": "inactive", "max_users": 10})
+
+    both = {"challenge_id": challenge_id, "user_ids": ["u1"], "user_filter": {"city": "Cali"}}
+    assert client.post("/instancias-retos/lote", json=both).status_code == 400
+    assert client.post("/instancias-retos/lote", json={"challenge_id": challenge_id}).status_code == 400
+    assert client.post("/instancias-retos/lote", json={"challenge_id": "nada", "user_ids": ["u1"]}).status_code == 404
+    assert client.post("/instancias-retos/lote", json={"challenge_id": "inactive", "user_ids": ["u1"]}).status_code == 400
@@ -0,0 +1,97 @@
+"""Pruebas de POST /progreso-reto/lote sobre el motor en memoria.
+
+Revisan la forma de la respuesta: un resultado por instancia en el orden en
+que llegó, con los eventos recibidos y aplicados, el estado o el error de
+cada una y los totales del lote.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app import crud
+from tests.conftest import get_doc, seed
+
+
+def _seed(db) -> None:
+    seed(db, "users", "u1", {"user_id": "u1", "city": "Cali"})
+    seed(db, "users", "u2", {"user_id": "u2", "city": "Pasto"})
+    seed(db, "challenges", "c1", {"challenge_id": "c1", "status": "active", "puntos": 20})
+    seed(db, "challenges", "old", {
+        "challenge_id": "old", "status": "active", "puntos": 20,
+        "max_date": datetime.now(timezone.utc) - timedelta(days=1),
+    })
+    instances = {
+        "i1": ("u1", "c1", 5, False),
+        "i2": ("u1", "c1", 2, False),
+        "i3": ("u2", "c1", 1, False),
+        "done": ("u1", "c1", 0, True),
+        "expired": ("u2", "old", 3, False),
+    }
+    for instance_id, (user_id, challenge_id, progress, completed) in instances.items():
+        seed(db, "challenge_instances", instance_id, {
+            "instance_id": instance_id, "user_id": user_id, "challenge_id": challenge_id,
+            "progress": progress, "completed": completed,
+        })
+
+
+def test_bulk_response_has_one_result_per_instance(client, db):
+    _seed(db)
+    events = [
+        {"instance_id": "i1", "count": 2},
+        {"instance_id": "missing"},
+        {"instance_id": "i2", "count": 3},
+        {"instance_id": "i1"},
+        {"instance_id": "done"},
+        {"instance_id": "expired"},
+        {"instance_id": "i3"},
+    ]
+
+    response = client.post("/progreso-reto/lote", json={"events": events})
+
+    assert response.status_code == 200
+    body = response.json()
+    # Sin fallos 'error' no se envía y 'pending_credits' queda vacío
+    assert body == {
+        "success": True,
+        "results": [
+            {"instance_id": "i1", "status": "updated", "events": 3, "applied": 3, "progress": 2,
+             "message": "Progreso actualizado"},
+            {"instance_id": "missing", "status": "error", "events": 1, "applied": 0, "error": "not_found",
+             "message": "Instancia de challenge no encontrada"},
+            {"instance_id": "i2", "status": "completed", "events": 3, "applied": 2, "progress": 0,
+             "message": "completaste el challenge"},
+            {"instance_id": "done", "status": "error", "events": 1, "applied": 0, "error": "already_completed",
+             "message": "El challenge ya esta completado"},
+            {"instance_id": "expired", "status": "error", "events": 1, "applied": 0, "error": "challenge_expired",
+             "message": "El challenge ya expiro"},
+            {"instance_id": "i3", "status": "completed", "events": 1, "applied": 1, "progress": 0,
+             "message": "completaste el challenge"},
+        ],
+        "events": 10,
+        "instances": 6,
+        "completed": 2,
+        "users_credited": 2,
+        "pending_credits": [],
+    }
+    assert get_doc(db, "challenge_instances", "i2")["completed"] is True
+    assert [get_doc(db, "user_points", user_id)["points"] for user_id in ("u1", "u2")] == [20, 20]
+
+
+def test_bulk_credits_one_increment_per_user_across_chunks(db, monkeypatch):
+    monkeypatch.setattr(crud, "MAX_BATCH_WRITES", 2)
+    seed(db, "users", "u1", {"user_id": "u1"})
+    seed(db, "challenges", "c1", {"challenge_id": "c1", "status": "active", "puntos": 10})
+    for number in range(5):
+        seed(db, "challenge_instances", f"i{number}", {
+            "user_id": "u1", "challenge_id": "c1", "progress": 1, "completed": False,
+        })
+
+    result = asyncio.run(crud.update_challenge_progress_bulk(db, [(f"i{number}", 1) for number in range(5)]))
+
+    assert [r["status"] for r in result["results"]] == ["completed"] * 5
+    assert (result["completed"], result["users_credited"], result["error"]) == (5, 1, None)
+    assert get_doc(db, "user_points", "u1")["points"] == 50
+
+
+def test_bulk_request_is_validated(client):
+    assert client.post("/progreso-reto/lote", json={"events": []}).status_code == 422
+    assert client.post("/progreso-reto/lote", json={"events": [{"instance_id": "i1", "count": 0}]}).status_code == 422
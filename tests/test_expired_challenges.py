@@ -0,0 +1,81 @@
+"""Pruebas de la desactivación de challenges vencidos sobre el motor en memoria.
+
+disable_expired_challenges recorre la consulta por páginas con cursor y
+confirma cada una en su propio batch; el reporte trae una entrada por
+chunk y un chunk fallido no detiene a los demás.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app import crud
+from tests.conftest import fail_commits, get_doc, seed
+
+
+def _seed_challenges(db, expired: int) -> list:
+    now = datetime.now(timezone.utc)
+    challenge_ids = [f"c{number}" for number in range(expired)]
+    for number, challenge_id in enumerate(challenge_ids):
+        # La consulta ordena por max_date: c0 es el más antiguo
+        seed(db, "challenges", challenge_id, {
+            "status": "active", "max_date": now - timedelta(days=expired - number),
+        })
+        crud.expiry_scheduler.schedule(challenge_id, now - timedelta(days=expired - number))
+    seed(db, "challenges", "future", {"status": "active", "max_date": now + timedelta(days=1)})
+    seed(db, "challenges", "disabled", {"status": "disabled", "max_date": now - timedelta(days=30)})
+    return challenge_ids
+
+
+def _statuses(db, challenge_ids) -> list:
+    return [get_doc(db, "challenges", challenge_id)["status"] for challenge_id in challenge_ids]
+
+
+def test_report_has_one_entry_per_chunk(db):
+    challenge_ids = _seed_challenges(db, 7)
+
+    result = asyncio.run(crud.disable_expired_challenges(db, chunk_size=3, concurrency=2))
+
+    assert [(chunk["chunk"], chunk["size"], chunk["first_id"], chunk["last_id"], chunk["error"])
+            for chunk in result["chunks"]] == [
+        (1, 3, "c0", "c2", None), (2, 3, "c3", "c5", None), (3, 1, "c6", "c6", None),
+    ]
+    assert all(chunk["seconds"] >= 0 for chunk in result["chunks"])
+    assert (result["disabled_count"], result["failed_count"]) == (7, 0)
+    assert result["message"] == "7 challenge(s) han sido desactivados."
+    assert _statuses(db, challenge_ids) == ["disabled"] * 7
+    assert _statuses(db, ["future", "disabled"]) == ["active", "disabled"]
+    # Los desactivados salen del programador de vencimientos
+    assert len(crud.expiry_scheduler) == 0
+
+
+def test_failed_chunk_is_reported_and_retried(db, monkeypatch):
+    challenge_ids = _seed_challenges(db, 7)
+
+    fail_commits(db, monkeypatch, 2)
+    result = asyncio.run(crud.disable_expired_challenges(db, chunk_size=3, concurrency=1))
+
+    assert [chunk["error"] for chunk in result["chunks"]] == [None, "Commit 2 fallido", None]
+    assert (result["disabled_count"], result["failed_count"]) == (4, 3)
+    assert "se pueden reintentar" in result["message"]
+    assert _statuses(db, challenge_ids) == ["disabled"] * 3 + ["active"] * 3 + ["disabled"]
+    assert len(crud.expiry_scheduler) == 3
+
+    # Volver a llamar retoma solo lo que faltó
+    retry = asyncio.run(crud.disable_expired_challenges(db, chunk_size=3))
+    assert [(chunk["size"], chunk["first_id"], chunk["last_id"]) for chunk in retry["chunks"]] == [(3, "c3", "c5")]
+    assert _statuses(db, challenge_ids) == ["disabled"] * 7
+
+
+def test_endpoint_reports_success_per_run(client, db, monkeypatch):
+    _seed_challenges(db, 2)
+
+    fail_commits(db, monkeypatch, 1)
+    failed = client.post("/retos/deshabilitar-expirados").json()
+    assert (failed["success"], failed["disabled_count"], failed["failed_count"]) == (False, 0, 2)
+    assert failed["chunks"][0]["error"] == "Commit 1 fallido"
+
+    retried = client.post("/retos/deshabilitar-expirados").json()
+    assert (retried["success"], retried["disabled_count"], len(retried["chunks"])) == (True, 2, 1)
+
+    empty = client.post("/retos/deshabilitar-expirados").json()
+    assert (empty["success"], empty["chunks"]) == (True, [])
+    assert empty["message"] == "No hay challenges expirados para desactivar."
@@ -0,0 +1,74 @@
+"""Pruebas del conteo de operaciones de Firestore sobre el motor en memoria.
+
+Cada respuesta trae las lecturas y escrituras de su solicitud en las
+cabeceras X-Firestore-* y Server-Timing; /metricas/firestore acumula por
+plantilla de ruta y lo que corre fuera de una solicitud va al acumulado
+de fondo.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app import crud
+from app.firestore_ops import operation_metrics
+from tests.conftest import seed
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    operation_metrics.reset()
+
+
+def _seed_users(db, count: int) -> None:
+    for number in range(count):
+        seed(db, "users", f"u{number}", {"user_id": f"u{number}"})
+        seed(db, "user_points", f"u{number}", {
+            "user_id": f"u{number}", "points": number, "last_updated": datetime.now(timezone.utc),
+        })
+
+
+def test_headers_count_the_operations_of_each_request(client, db):
+    _seed_users(db, 5)
+
+    page = client.get("/usuarios", params={"limit": 3})
+    points = client.get("/usuarios/u1/puntos")
+    missing = client.get("/usuarios", params={"start_after": "u9"})
+    created = client.post("/recompensas", json={"type": "badge", "value": "Bono"})
+
+    # Una lectura por documento devuelto, y una como mínimo por consulta
+    assert (page.headers["X-Firestore-Reads"], page.headers["X-Firestore-Writes"]) == ("3", "0")
+    assert points.headers["X-Firestore-Reads"] == "1"
+    assert missing.headers["X-Firestore-Reads"] == "1"
+    assert (created.headers["X-Firestore-Reads"], created.headers["X-Firestore-Writes"]) == ("0", "1")
+    server_timing = page.headers["Server-Timing"]
+    assert server_timing.startswith("firestore;dur=") and 'desc="1 rpc"' in server_timing
+    assert ", app;dur=" in server_timing
+
+
+def test_routes_are_accumulated_by_template(client, db):
+    _seed_users(db, 5)
+
+    # El 404 del usuario sin puntos también se cuenta
+    assert [client.get(f"/usuarios/{user_id}/puntos").status_code for user_id in ("u1", "u2", "nadie")] == [200, 200, 404]
+    # En modo stream las lecturas ocurren mientras se envía el cuerpo
+    streamed = client.get("/usuarios", params={"stream": "true"})
+    assert len(streamed.text.splitlines()) == 5
+
+    routes = client.get("/metricas/firestore").json()["routes"]
+
+    points = routes["GET /usuarios/{user_id}/puntos"]
+    assert (points["requests"], points["reads"], points["writes"], points["max_reads"]) == (3, 3, 0, 1)
+    assert points["reads_per_request"] == 1.0
+    assert (routes["GET /usuarios"]["requests"], routes["GET /usuarios"]["reads"]) == (1, 5)
+    assert not any("u1" in route for route in routes)
+
+
+def test_operations_outside_a_request_go_to_background(db):
+    _seed_users(db, 2)
+
+    asyncio.run(crud.list_users(db, 10))
+
+    snapshot = operation_metrics.snapshot()
+    assert snapshot["routes"] == {}
+    assert (snapshot["background"]["reads"], snapshot["background"]["queries"]) == (2, 1)
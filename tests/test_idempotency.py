@@ -0,0 +1,157 @@
+"""Pruebas de run_idempotent con las llaves en memoria y en Firestore.
+
+Las mismas pruebas corren con los dos almacenes; las de Firestore usan el
+motor en memoria y dos instancias del almacén como si fueran dos workers.
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+
+from app import idempotency
+from app.idempotency import FirestoreIdempotencyStore, IdempotencyStore, run_idempotent
+
+
+def _store(kind: str):
+    if kind == "memory":
+        return IdempotencyStore(maxsize=100, ttl=60)
+    return FirestoreIdempotencyStore(ttl=60, lock_seconds=30)
+
+
+@pytest.fixture(params=["memory", "firestore"])
+def store(request, monkeypatch):
+    store = _store(request.param)
+    monkeypatch.setattr(idempotency, "idempotency_store", store)
+    return store
+
+
+class _Handler:
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result if result is not None else {"success": True}
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _run(db, handler, key="key-1", fingerprint="body-1", response=None):
+    return run_idempotent(db, key, "POST /prueba", fingerprint, response or Response(), 201, handler)
+
+
+def test_replay_returns_the_stored_response(db, store):
+    handler = _Handler({"success": True, "instance_id": "i-1"})
+
+    async def scenario():
+        first = await _run(db, handler)
+        response = Response()
+        replayed = await _run(db, handler, response=response)
+        return first, replayed, response
+
+    first, replayed, response = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert replayed == first == {"success": True, "instance_id": "i-1"}
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert store.stats()["replays"] == 1
+
+
+def test_client_errors_are_replayed(db, store):
+    handler = _Handler(error=HTTPException(status_code=404, detail="No existe"))
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as error:
+                await _run(db, handler)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert (error.status_code, error.detail) == (404, "No existe")
+    assert error.headers == {"Idempotent-Replayed": "true"}
+
+
+def test_same_key_with_another_body_returns_422(db, store):
+    handler = _Handler()
+
+    async def scenario():
+        await _run(db, handler)
+        with pytest.raises(HTTPException) as error:
+            await _run(db, handler, fingerprint="body-2")
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 422
+    assert handler.calls == 1
+
+
+def test_concurrent_duplicate_returns_409(db, store):
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def slow_handler():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return {"success": True}
+
+    async def scenario():
+        first = asyncio.create_task(_run(db, slow_handler))
+        await started.wait()
+        with pytest.raises(HTTPException) as error:
+            await _run(db, slow_handler)
+        release.set()
+        await first
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 409
+    assert calls == 1
+
+
+@pytest.mark.parametrize("error", [RuntimeError("Firestore no disponible"), HTTPException(status_code=503, detail="x")])
+def test_key_is_released_when_the_handler_fails(db, store, error):
+    failing = _Handler(error=error)
+    handler = _Handler()
+
+    async def scenario():
+        with pytest.raises(type(error)):
+            await _run(db, failing)
+        return await _run(db, handler)
+
+    assert asyncio.run(scenario()) == {"success": True}
+    assert (failing.calls, handler.calls) == (1, 1)
+
+
+def test_firestore_keys_are_shared_between_workers(db):
+    worker_a, worker_b = _store("firestore"), _store("firestore")
+    handler = _Handler({"success": True})
+
+    async def scenario():
+        assert await worker_a.claim(db, ("POST /prueba", "k"), "body-1") == (None, None)
+        state, _ = await worker_b.claim(db, ("POST /prueba", "k"), "body-1")
+        assert state == "in_progress"
+        await worker_a.complete(db, ("POST /prueba", "k"), 201, body=await handler())
+        return await worker_b.claim(db, ("POST /prueba", "k"), "body-1")
+
+    state, entry = asyncio.run(scenario())
+    assert state == "replay"
+    assert (entry.status_code, entry.body) == (201, '{"success":true}')
+
+
+def test_firestore_abandoned_or_expired_keys_can_be_taken(db):
+    async def scenario():
+        key = ("POST /prueba", "k")
+        # Un worker reservó la llave y se cayó sin completarla
+        await FirestoreIdempotencyStore(ttl=60, lock_seconds=0).claim(db, key, "body-1")
+        assert await _store("firestore").claim(db, key, "body-1") == (None, None)
+
+        # Una respuesta vencida tampoco se repite
+        expired = FirestoreIdempotencyStore(ttl=0, lock_seconds=30)
+        await expired.claim(db, ("POST /prueba", "k2"), "body-1")
+        await expired.complete(db, ("POST /prueba", "k2"), 201, body={"success": True})
+        return await _store("firestore").claim(db, ("POST /prueba", "k2"), "body-2")
+
+    assert asyncio.run(scenario()) == (None, None)
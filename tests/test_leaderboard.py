@@ -0,0 +1,298 @@
+"""Pruebas del índice de ranking contra una lista ordenada de referencia.
+
+El oráculo ordena (points, user_id) de forma descendente, igual que
+Firestore con order_by("points", DESCENDING): en empate va primero el ID
+de documento mayor.
+"""
+import random
+import threading
+
+import pytest
+
+from app.leaderboard import LeaderboardIndex, LeaderboardSnapshot, _IndexableSkipList
+
+CITIES = ["Bogotá", "Medellín", "Cali"]
+STATES = ["Cundinamarca", "Antioquia", "Valle"]
+
+
+def _oracle_ranking(points: dict, locations: dict, scope_field: str = None, scope_value: str = None) -> list:
+    return [
+        user_id
+        for user_points, user_id in sorted(((p, u) for u, p in points.items()), reverse=True)
+        if scope_field is None or locations.get(user_id, {}).get(scope_field) == scope_value
+    ]
+
+
+def _assert_matches_oracle(index: LeaderboardIndex, points: dict, locations: dict) -> None:
+    assert len(index) == len(points)
+    global_ranking = _oracle_ranking(points, locations)
+    for position, user_id in enumerate(global_ranking, start=1):
+        assert index.rank(user_id) == position
+
+    for field, values in (("city", CITIES), ("state", STATES)):
+        for value in values:
+            scoped = _oracle_ranking(points, locations, field, value)
+            for position, user_id in enumerate(scoped, start=1):
+                assert index.rank(user_id, field, value) == position
+            # Un usuario de otro ámbito no tiene posición en este
+            for user_id in set(points) - set(scoped):
+                assert index.rank(user_id, field, value) is None
+
+    snapshot = index.snapshot()
+    assert [row["user_id"] for row in snapshot.top(len(points))] == global_ranking
+
+
+def _random_location(rng: random.Random) -> dict:
+    location = {}
+    if rng.random() < 0.8:
+        location["city"] = rng.choice(CITIES)
+    if rng.random() < 0.8:
+        location["state"] = rng.choice(STATES)
+    return location
+
+
+# --- Skip list ---------------------------------------------------------------
+
+@pytest.mark.parametrize("seed", range(5))
+def test_skip_list_matches_sorted_list(seed):
+    rng = random.Random(seed)
+    skip_list = _IndexableSkipList()
+    oracle = []
+    for _ in range(2000):
+        if oracle and rng.random() < 0.4:
+            key = oracle.pop(rng.randrange(len(oracle)))
+            skip_list.remove(key)
+        else:
+            # Pocos puntos distintos para forzar empates resueltos por el ID
+            key = (rng.randrange(50), f"user-{rng.randrange(10_000):05d}")
+            if key in oracle:
+                continue
+            oracle.append(key)
+            skip_list.insert(key)
+        oracle.sort()
+
+        assert len(skip_list) == len(oracle)
+        if oracle:
+            probe = rng.choice(oracle)
+            assert skip_list.position(probe) == oracle.index(probe) + 1
+
+    assert list(skip_list) == oracle
+    for position, key in enumerate(oracle, start=1):
+        assert skip_list.position(key) == position
+
+
+def test_skip_list_missing_key():
+    skip_list = _IndexableSkipList()
+    skip_list.insert((10, "a"))
+    assert skip_list.position((10, "b")) is None
+    assert skip_list.position((5, "a")) is None
+    with pytest.raises(KeyError):
+        skip_list.remove((10, "b"))
+    assert len(skip_list) == 1
+
+
+def test_skip_list_empty():
+    skip_list = _IndexableSkipList()
+    assert len(skip_list) == 0
+    assert list(skip_list) == []
+    assert skip_list.position((0, "a")) is None
+    with pytest.raises(KeyError):
+        skip_list.remove((0, "a"))
+
+
+# --- Índice ------------------------------------------------------------------
+
+def test_ties_rank_higher_user_id_first():
+    index = LeaderboardIndex()
+    index.load([
+        ("user-a", 100, {"city": "Cali"}),
+        ("user-c", 100, {"city": "Cali"}),
+        ("user-b", 100, {"city": "Bogotá"}),
+        ("user-d", 50, {"city": "Cali"}),
+        ("user-e", 150, {}),
+    ])
+
+    assert [index.rank(u) for u in ("user-e", "user-c", "user-b", "user-a", "user-d")] == [1, 2, 3, 4, 5]
+    assert index.rank("user-c", "city", "Cali") == 1
+    assert index.rank("user-a", "city", "Cali") == 2
+    assert index.rank("user-d", "city", "Cali") == 3
+    assert index.rank("user-e", "city", "Cali") is None
+
+
+def test_updates_and_removals():
+    index = LeaderboardIndex()
+    index.load([("user-a", 10, None), ("user-b", 20, None), ("user-c", 30, None)])
+
+    index.set_points("user-a", 40)
+    assert index.rank("user-a") == 1
+    assert index.rank("user-c") == 2
+
+    index.add_points("user-b", 25)
+    assert index.rank("user-b") == 1
+    assert index.get_points("user-b") == 45
+
+    # Un usuario nuevo entra con add_points desde 0
+    index.add_points("user-d", 5)
+    assert index.rank("user-d") == 4
+
+    index.remove("user-b")
+    assert index.rank("user-b") is None
+    assert index.get_points("user-b") is None
+    assert [index.rank(u) for u in ("user-a", "user-c", "user-d")] == [1, 2, 3]
+
+    # Quitar un usuario que no está no cambia nada
+    index.remove("user-x")
+    assert len(index) == 3
+
+
+def test_set_points_without_changes_keeps_location():
+    index = LeaderboardIndex()
+    index.set_points("user-a", 10, {"city": "Cali"})
+    index.set_points("user-a", 10)
+    assert index.get_location("user-a") == {"city": "Cali"}
+    assert index.rank("user-a", "city", "Cali") == 1
+
+
+def test_city_and_state_moves():
+    index = LeaderboardIndex()
+    index.load([
+        ("user-a", 300, {"city": "Cali", "state": "Valle"}),
+        ("user-b", 200, {"city": "Cali", "state": "Valle"}),
+        ("user-c", 100, {"city": "Cali", "state": "Valle"}),
+        ("user-d", 250, {"city": "Bogotá", "state": "Cundinamarca"}),
+    ])
+
+    index.set_location("user-a", {"city": "Bogotá", "state": "Cundinamarca"})
+    assert index.rank("user-a", "city", "Cali") is None
+    assert index.rank("user-b", "city", "Cali") == 1
+    assert index.rank("user-c", "city", "Cali") == 2
+    assert index.rank("user-a", "city", "Bogotá") == 1
+    assert index.rank("user-d", "city", "Bogotá") == 2
+    assert index.rank("user-a", "state", "Cundinamarca") == 1
+    assert index.rank("user-a") == 1
+
+    # set_points con ubicación también mueve al usuario de ámbito
+    index.set_points("user-d", 250, {"city": "Cali"})
+    assert index.rank("user-d", "city", "Cali") == 1
+    assert index.rank("user-d", "state", "Cundinamarca") is None
+    assert index.rank("user-a", "city", "Bogotá") == 1
+
+    # La ubicación de un usuario sin puntos se guarda para cuando entre
+    index.set_location("user-e", {"city": "Cali"})
+    assert index.rank("user-e", "city", "Cali") is None
+    index.set_points("user-e", 1000)
+    assert index.rank("user-e", "city", "Cali") == 1
+
+
+def test_load_replaces_state_and_keeps_last_entry_per_user():
+    index = LeaderboardIndex()
+    index.set_points("user-old", 999, {"city": "Cali"})
+
+    index.load([("user-a", 10, {"city": "Cali"}), ("user-a", 30, {"city": "Bogotá"}), ("user-b", 20, None)])
+
+    assert index.ready
+    assert len(index) == 2
+    assert index.rank("user-old") is None
+    assert index.rank("user-a") == 1
+    assert index.rank("user-a", "city", "Cali") is None
+    assert index.rank("user-a", "city", "Bogotá") == 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_operations_match_oracle(seed):
+    rng = random.Random(seed)
+    user_ids = [f"user-{i:03d}" for i in range(60)]
+    points = {}
+    locations = {}
+
+    entries = []
+    for user_id in rng.sample(user_ids, 30):
+        points[user_id] = rng.randrange(20)
+        locations[user_id] = _random_location(rng)
+        entries.append((user_id, points[user_id], locations[user_id]))
+    index = LeaderboardIndex()
+    index.load(entries)
+    _assert_matches_oracle(index, points, locations)
+
+    for _ in range(400):
+        user_id = rng.choice(user_ids)
+        operation = rng.random()
+        if operation < 0.35:
+            points[user_id] = rng.randrange(20)
+            if rng.random() < 0.3:
+                locations[user_id] = _random_location(rng)
+                index.set_points(user_id, points[user_id], locations[user_id])
+            else:
+                locations.setdefault(user_id, {})
+                index.set_points(user_id, points[user_id])
+        elif operation < 0.6:
+            delta = rng.randrange(-5, 6)
+            points[user_id] = points.get(user_id, 0) + delta
+            locations.setdefault(user_id, {})
+            index.add_points(user_id, delta)
+        elif operation < 0.8:
+            # Sin puntos la ubicación queda guardada para cuando el usuario entre
+            locations[user_id] = _random_location(rng)
+            index.set_location(user_id, locations[user_id])
+        else:
+            points.pop(user_id, None)
+            locations.pop(user_id, None)
+            index.remove(user_id)
+        _assert_matches_oracle(index, points, locations)
+
+
+# --- Foto --------------------------------------------------------------------
+
+def test_snapshot_top_and_around():
+    entries = [(f"user-{i}", points, {"city": city}) for i, (points, city) in enumerate(
+        [(50, "Cali"), (40, "Bogotá"), (40, "Cali"), (30, "Cali"), (10, "Bogotá")]
+    )]
+    snapshot = LeaderboardSnapshot.from_entries(entries)
+
+    assert len(snapshot) == 5
+    assert snapshot.top(3) == [
+        {"rank": 1, "user_id": "user-0", "points": 50},
+        {"rank": 2, "user_id": "user-2", "points": 40},
+        {"rank": 3, "user_id": "user-1", "points": 40},
+    ]
+    assert [row["user_id"] for row in snapshot.top(10, "city", "Cali")] == ["user-0", "user-2", "user-3"]
+    assert [row["rank"] for row in snapshot.around("user-2", 1)] == [1, 2, 3]
+    assert [row["user_id"] for row in snapshot.around("user-3", 1, "city")] == ["user-2", "user-3"]
+    assert snapshot.around("user-x", 1) is None
+    assert snapshot.top(5, "city", "Medellín") == []
+
+
+def test_writes_proceed_while_a_snapshot_is_built():
+    index = LeaderboardIndex()
+    index.load([(f"user-{i}", i, {"city": "Cali"}) for i in range(100)])
+
+    building = threading.Event()
+    release = threading.Event()
+    scopes = LeaderboardIndex._scopes
+
+    def blocking_scopes(location):
+        # Detiene la foto a mitad de armarse, fuera del lock
+        if threading.current_thread() is snapshot_thread and not building.is_set():
+            building.set()
+            assert release.wait(5)
+        return scopes(location)
+
+    index._scopes = blocking_scopes
+    snapshots = []
+    snapshot_thread = threading.Thread(target=lambda: snapshots.append(index.snapshot()))
+    snapshot_thread.start()
+    assert building.wait(5)
+
+    writer = threading.Thread(target=index.set_points, args=("user-0", 1000))
+    writer.start()
+    writer.join(1)
+    try:
+        assert not writer.is_alive()
+        assert index.rank("user-0") == 1
+    finally:
+        release.set()
+        snapshot_thread.join(5)
+
+    # La foto es la copia tomada antes de la escritura
+    assert snapshots[0].top(1) == [{"rank": 1, "user_id": "user-99", "points": 99}]
+    assert index.snapshot().top(1) == [{"rank": 1, "user_id": "user-0", "points": 1000}]
@@ -0,0 +1,89 @@
+"""Pruebas de los listeners on_snapshot del ranking sobre el motor en memoria.
+
+El snapshot inicial carga el índice, los commits posteriores llegan como
+deltas y, si el stream se cierra, ensure_active vuelve a suscribirse y el
+nuevo snapshot inicial corrige lo que se perdió durante la desconexión.
+"""
+import time
+
+import pytest
+
+from app.leaderboard import LeaderboardIndex
+from app.listeners import LeaderboardListeners
+from tests.conftest import seed
+
+
+def _eventually(condition, timeout: float = 2.0) -> None:
+    # Los callbacks llegan en el hilo del listener
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("El listener no aplicó el cambio a tiempo")
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def listeners(db):
+    seed(db, "users", "u1", {"user_id": "u1", "city": "Cali", "state": "Valle"})
+    seed(db, "users", "u2", {"user_id": "u2", "city": "Pasto"})
+    # La copia de la ubicación en 'user_points' está vieja; manda la de 'users'
+    seed(db, "user_points", "u1", {"user_id": "u1", "points": 30, "city": "Buga"})
+    seed(db, "user_points", "u2", {"user_id": "u2", "points": 10})
+
+    index = LeaderboardIndex()
+    listeners = LeaderboardListeners(index)
+    listeners.start(db._to_sync_copy())
+    assert listeners.wait_synced(2.0)
+    yield listeners, index
+    listeners.stop()
+
+
+def test_initial_snapshot_loads_the_index(listeners):
+    listeners, index = listeners
+
+    assert (index.get_points("u1"), index.get_points("u2")) == (30, 10)
+    assert index.get_location("u1") == {"city": "Cali", "state": "Valle"}
+    assert index.rank("u1") == 1
+    stats = listeners.stats()["listeners"]
+    assert all(state["active"] and state["synced"] for state in stats.values())
+
+
+def test_changes_arrive_as_deltas(listeners, db):
+    listeners, index = listeners
+    sync_db = db._to_sync_copy()
+
+    sync_db.collection("user_points").document("u2").update({"points": 50})
+    sync_db.collection("user_points").document("u3").set({"user_id": "u3", "points": 5, "city": "Tunja"})
+    sync_db.collection("user_points").document("u1").delete()
+    sync_db.collection("users").document("u2").update({"city": "Neiva"})
+
+    _eventually(lambda: index.get_location("u2") == {"city": "Neiva"} and index.get_points("u1") is None)
+    assert (index.get_points("u2"), index.get_points("u3")) == (50, 5)
+    assert index.get_location("u3") == {"city": "Tunja"}
+    assert index.rank("u2") == 1
+    stats = listeners.stats()
+    assert stats["listeners"]["user_points"]["changes"] == 2 + 3
+    assert stats["lag"]["changes"] >= 3
+
+
+def test_reconnect_resyncs_what_was_missed(listeners, db):
+    listeners, index = listeners
+    sync_db = db._to_sync_copy()
+
+    # El stream se cierra y los cambios de mientras no llegan como deltas
+    listeners._states["user_points"].watch.close()
+    sync_db.collection("user_points").document("u1").update({"points": 99})
+    sync_db.collection("user_points").document("u2").delete()
+    time.sleep(0.05)
+    assert index.get_points("u1") == 30
+    assert listeners.stats()["listeners"]["user_points"]["active"] is False
+
+    assert listeners.ensure_active(sync_db) == 1
+    assert listeners.wait_synced(2.0)
+
+    assert (index.get_points("u1"), index.get_points("u2")) == (99, None)
+    assert index.get_location("u1") == {"city": "Cali", "state": "Valle"}
+    state = listeners.stats()["listeners"]["user_points"]
+    assert (state["active"], state["resyncs"]) == (True, 1)
+    # Con los dos listeners activos no hay nada que volver a suscribir
+    assert listeners.ensure_active(sync_db) == 0
@@ -0,0 +1,337 @@
+"""Pruebas del motor en memoria con las funciones de crud.
+
+Cada prueba ejecuta crud contra AsyncMemoryClient y revisa que se cumpla
+lo que Firestore garantiza: conflictos de transacción, transform_results,
+precondiciones last_update_time y de existencia, cursores ordenados por
+'__name__' y agregaciones count()/sum().
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from google.api_core import exceptions
+
+from app import crud
+from app.counters import progress_counters
+from app.leaderboard import leaderboard_index
+from firebase_admin import firestore
+from tests.conftest import get_doc, seed
+
+
+def _seed_progress(db, progress: int, puntos: int = 100) -> None:
+    seed(db, "users", "user-1", {"user_id": "user-1", "city": "Cali", "state": "Valle"})
+    seed(db, "challenges", "challenge-1", {
+        "challenge_id": "challenge-1", "status": "active", "puntos": puntos, "max_limit": progress,
+    })
+    seed(db, "challenge_instances", "instance-1", {
+        "instance_id": "instance-1", "user_id": "user-1", "challenge_id": "challenge-1",
+        "progress": progress, "completed": False,
+    })
+
+
+# --- Transacciones -----------------------------------------------------------
+
+def test_transaction_aborts_when_a_read_document_changes(db):
+    async def scenario():
+        ref = db.collection("counters").document("c")
+        await ref.set({"value": 1})
+
+        transaction = db.transaction()
+        await transaction._begin()
+        snapshot = await ref.get(transaction=transaction)
+        # Otra escritura entre la lectura y el commit
+        await ref.update({"value": 5})
+        transaction.update(ref, {"value": snapshot.get("value") + 1})
+        with pytest.raises(exceptions.Aborted):
+            await transaction._commit()
+        return (await ref.get()).get("value")
+
+    assert asyncio.run(scenario()) == 5
+
+
+def test_async_transactional_retries_until_consistent(db):
+    async def scenario():
+        ref = db.collection("counters").document("c")
+        await ref.set({"value": 0})
+
+        @firestore.async_transactional
+        async def increment(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            await asyncio.sleep(0)
+            transaction.update(ref, {"value": snapshot.get("value") + 1})
+
+        await asyncio.gather(*(increment(db.transaction(max_attempts=50)) for _ in range(10)))
+        return (await ref.get()).get("value")
+
+    assert asyncio.run(scenario()) == 10
+
+
+def test_concurrent_progress_updates_complete_once(db):
+    _seed_progress(db, progress=3, puntos=100)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(crud.update_challenge_progress(db, "instance-1") for _ in range(5)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    # Las llamadas que llegan con el challenge ya completado responden 400
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert [error.status_code for error in rejected] == [400, 400]
+    statuses = sorted(result["status"] for result in results if isinstance(result, dict))
+    assert statuses == ["completed", "updated", "updated"]
+    assert get_doc(db, "challenge_instances", "instance-1")["completed"] is True
+    assert get_doc(db, "challenge_instances", "instance-1")["progress"] == 0
+    # Los puntos se acreditan una sola vez y el registro nuevo lleva la ubicación
+    points = get_doc(db, "user_points", "user-1")
+    assert points["points"] == 100
+    assert points["city"] == "Cali"
+    # Las llamadas leyeron la misma instancia, así que hubo conflictos reintentados
+    assert progress_counters.snapshot()["transaction"]["retries"] > 0
+
+
+# --- transform_results -------------------------------------------------------
+
+def test_transform_results_follow_field_order(db):
+    async def scenario():
+        ref = db.collection("user_points").document("user-1")
+        await ref.set({"points": 10, "bonus": 1})
+        write_result = await ref.update({
+            "points": firestore.Increment(5),
+            "bonus": firestore.Increment(-1),
+            "last_updated": firestore.SERVER_TIMESTAMP,
+        })
+        return crud._transform_values(db, write_result, ["points", "bonus", "last_updated"]), write_result
+
+    values, write_result = asyncio.run(scenario())
+    assert values["points"] == 15
+    assert values["bonus"] == 0
+    assert values["last_updated"] == write_result.update_time
+
+
+def test_progress_with_increments_completes_once(db):
+    _seed_progress(db, progress=2, puntos=40)
+
+    async def scenario():
+        ref = db.collection("challenge_instances").document("instance-1")
+        return await asyncio.gather(*(crud._update_progress_with_increments(db, ref) for _ in range(4)))
+
+    results = asyncio.run(scenario())
+
+    assert sum(result.get("status") == "completed" for result in results) == 1
+    assert sum(result.get("status") == "updated" for result in results) == 1
+    instance = get_doc(db, "challenge_instances", "instance-1")
+    assert instance["completed"] is True
+    # Los incrementos que pasaron de 0 no dejan el progreso negativo
+    assert instance["progress"] == 0
+    assert get_doc(db, "user_points", "user-1")["points"] == 40
+
+
+# --- Precondiciones ----------------------------------------------------------
+
+def test_last_update_time_precondition(db):
+    async def scenario():
+        ref = db.collection("challenges").document("challenge-1")
+        await ref.set({"status": "active"})
+        stale = (await ref.get()).update_time
+        await ref.update({"status": "disabled"})
+
+        with pytest.raises(exceptions.FailedPrecondition):
+            await ref.update({"status": "active"}, option=db.write_option(last_update_time=stale))
+
+        fresh = (await ref.get()).update_time
+        await ref.update({"status": "active"}, option=db.write_option(last_update_time=fresh))
+        return (await ref.get()).get("status")
+
+    assert asyncio.run(scenario()) == "active"
+
+
+def test_preconditions_see_earlier_writes_in_the_same_batch(db):
+    async def scenario():
+        ref = db.collection("challenges").document("challenge-1")
+        await ref.set({"status": "active"})
+        read_time = (await ref.get()).update_time
+
+        # La segunda escritura espera la versión leída, pero la primera ya la cambió
+        batch = db.batch()
+        batch.update(ref, {"status": "disabled"})
+        batch.update(ref, {"puntos": 1}, option=db.write_option(last_update_time=read_time))
+        with pytest.raises(exceptions.FailedPrecondition):
+            await batch.commit()
+        # El commit es atómico: no se aplicó ninguna escritura
+        assert (await ref.get()).to_dict() == {"status": "active"}
+
+        # Un documento borrado antes en el batch ya no existe
+        batch = db.batch()
+        batch.delete(ref)
+        batch.delete(ref, option=db.write_option(exists=True))
+        with pytest.raises(exceptions.FailedPrecondition):
+            await batch.commit()
+
+        # Un documento creado antes en el batch ya existe
+        new_ref = db.collection("challenges").document("challenge-2")
+        batch = db.batch()
+        batch.create(new_ref, {"status": "active"})
+        batch.update(new_ref, {"status": "disabled"}, option=db.write_option(exists=True))
+        await batch.commit()
+        return (await new_ref.get()).get("status")
+
+    assert asyncio.run(scenario()) == "disabled"
+
+
+def test_expire_challenges_disables_only_expired(db):
+    now = datetime.now(timezone.utc)
+    seed(db, "challenges", "challenge-1", {"status": "active", "max_date": now - timedelta(days=1)})
+    seed(db, "challenges", "challenge-2", {"status": "active", "max_date": now + timedelta(days=1)})
+    seed(db, "challenges", "challenge-3", {"status": "disabled", "max_date": now - timedelta(days=1)})
+
+    disabled = asyncio.run(crud.expire_challenges(db, ["challenge-1", "challenge-2", "challenge-3", "missing"]))
+
+    assert disabled == ["challenge-1"]
+    assert get_doc(db, "challenges", "challenge-1")["status"] == "disabled"
+    assert get_doc(db, "challenges", "challenge-2")["status"] == "active"
+
+
+def test_expire_challenges_reschedules_a_later_deadline(db):
+    now = datetime.now(timezone.utc)
+    # Programado con la fecha vieja; otra instancia la movió un día después
+    seed(db, "challenges", "challenge-1", {"status": "active", "max_date": now + timedelta(days=1)})
+    seed(db, "challenges", "challenge-2", {"status": "disabled", "max_date": now + timedelta(days=1)})
+
+    assert asyncio.run(crud.expire_challenges(db, ["challenge-1", "challenge-2"])) == []
+
+    assert len(crud.expiry_scheduler) == 1
+    assert crud.expiry_scheduler.pop_due(now.timestamp() + 3600) == []
+    assert crud.expiry_scheduler.pop_due((now + timedelta(days=2)).timestamp()) == ["challenge-1"]
+
+
+def test_expire_challenges_does_not_overwrite_a_concurrent_change(db, monkeypatch):
+    now = datetime.now(timezone.utc)
+    seed(db, "challenges", "challenge-1", {"status": "active", "max_date": now - timedelta(days=1)})
+
+    is_past_deadline = crud._is_past_deadline
+
+    def extended_meanwhile(challenge_data):
+        # La fecha se extiende después de la lectura y antes del commit
+        db._to_sync_copy().collection("challenges").document("challenge-1").update(
+            {"max_date": now + timedelta(days=1)}
+        )
+        return is_past_deadline(challenge_data)
+
+    monkeypatch.setattr(crud, "_is_past_deadline", extended_meanwhile)
+    with pytest.raises(exceptions.FailedPrecondition):
+        asyncio.run(crud.expire_challenges(db, ["challenge-1"]))
+    assert get_doc(db, "challenges", "challenge-1")["status"] == "active"
+
+
+# --- Cursores ----------------------------------------------------------------
+
+def test_list_users_pages_follow_document_name(db):
+    user_ids = ["user-07", "user-02", "user-10", "user-01", "user-05", "user-03", "user-08"]
+    for user_id in user_ids:
+        seed(db, "users", user_id, {"user_id": user_id})
+
+    async def all_pages():
+        pages = []
+        cursor = None
+        while True:
+            page = await crud.list_users(db, limit=3, start_after=cursor)
+            pages.append([user["user_id"] for user in page["users"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(all_pages())
+    assert [user_id for page in pages for user_id in page] == sorted(user_ids)
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+    # El cursor no tiene que ser un documento existente
+    page = asyncio.run(crud.list_users(db, limit=2, start_after="user-04"))
+    assert [user["user_id"] for user in page["users"]] == ["user-05", "user-07"]
+
+
+def test_list_challenges_cursor_with_date_range(db):
+    base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    # Fechas repetidas: el orden dentro de la misma fecha es por ID
+    dates = {"c-5": 0, "c-1": 1, "c-4": 1, "c-2": 1, "c-3": 2, "c-6": 5}
+    for challenge_id, days in dates.items():
+        seed(db, "challenges", challenge_id, {
+            "challenge_id": challenge_id, "status": "active", "max_date": base + timedelta(days=days),
+        })
+
+    async def all_pages():
+        items = []
+        cursor = None
+        while True:
+            page = await crud.list_challenges(
+                db, limit=2, start_after=cursor, max_date_from=base, max_date_to=base + timedelta(days=2)
+            )
+            items.extend(challenge["challenge_id"] for challenge in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return items
+
+    assert asyncio.run(all_pages()) == ["c-5", "c-1", "c-2", "c-4", "c-3"]
+
+
+def test_list_challenges_catalog_and_filtered_pages_agree(db):
+    for i in (3, 1, 2, 5, 4):
+        status = "active" if i % 2 else "disabled"
+        seed(db, "challenges", f"c-{i}", {"challenge_id": f"c-{i}", "status": status})
+
+    async def pages(**filters):
+        items = []
+        cursor = None
+        while True:
+            page = await crud.list_challenges(db, limit=2, start_after=cursor, **filters)
+            items.extend(challenge["challenge_id"] for challenge in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return items
+
+    assert asyncio.run(pages()) == ["c-1", "c-2", "c-3", "c-4", "c-5"]
+    assert asyncio.run(pages(status="active")) == ["c-1", "c-3", "c-5"]
+
+
+# --- Agregaciones ------------------------------------------------------------
+
+def test_count_and_sum_aggregations(db):
+    for i, points in enumerate([10, 20, 20, 5]):
+        seed(db, "user_points", f"user-{i}", {"points": points, "city": "Cali" if i < 3 else "Bogotá"})
+    shards = db._to_sync_copy().collection("user_points").document("user-0").collection("shards")
+    shards.document("0").set({"points": 7})
+    shards.document("1").set({"points": 8})
+    # Como en Firestore, sum() ignora los valores no numéricos
+    shards.document("2").set({"points": "9"})
+
+    async def scenario():
+        points = db.collection("user_points")
+        return (
+            await crud._count(points.where("points", ">", 5)),
+            await crud._count(points.where("city", "==", "Cali").where("points", "==", 20)),
+            await crud._count(points.where("city", "==", "Medellín")),
+            await crud._sum_point_shards(db, "user-0"),
+        )
+
+    assert asyncio.run(scenario()) == (3, 2, 0, 15)
+
+
+def test_rank_by_count_matches_index(db):
+    entries = [("user-a", 50, "Cali"), ("user-b", 30, "Cali"), ("user-c", 30, "Bogotá"), ("user-d", 10, "Cali")]
+    for user_id, points, city in entries:
+        seed(db, "user_points", user_id, {"user_id": user_id, "points": points, "city": city})
+    leaderboard_index.load([(user_id, points, {"city": city}) for user_id, points, city in entries])
+
+    async def ranks():
+        return [
+            (await crud._rank_by_count(db, user_id), await crud._rank_by_count(db, user_id, "city", city))
+            for user_id, _, city in entries
+        ]
+
+    expected = [
+        (leaderboard_index.rank(user_id), leaderboard_index.rank(user_id, "city", city))
+        for user_id, _, city in entries
+    ]
+    assert asyncio.run(ranks()) == expected == [(1, 1), (3, 2), (2, 1), (4, 3)]
@@ -0,0 +1,129 @@
+"""Pruebas de las métricas de Prometheus y de GET /metrics.
+
+El registro es global y acumula entre pruebas, así que las del endpoint
+comparan los valores antes y después de las solicitudes.
+"""
+import threading
+from datetime import datetime, timezone
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.metrics import MetricsRegistry, metrics
+from app.middleware import RequestInstrumentation
+from tests.conftest import seed
+
+
+def _sample(text: str, name: str, **labels) -> float:
+    """Valor de la serie `name` con exactamente esas etiquetas (0 si no está)"""
+    expected = "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}" if labels else ""
+    for line in text.splitlines():
+        if line.startswith(f"{name}{expected} "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_registry_renders_the_exposition_format():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Trabajos")
+    registry.gauge("jobs_running", "Trabajos en curso")
+    registry.histogram("job_seconds", "Duración", buckets=(0.1, 1.0))
+
+    registry.inc("jobs_total", queue='a"b')
+    registry.inc("jobs_running", 2)
+    registry.dec("jobs_running")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        registry.observe("job_seconds", value, queue="a")
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Trabajos",
+        "# TYPE jobs_total counter",
+        'jobs_total{queue="a\\"b"} 1',
+        "# HELP jobs_running Trabajos en curso",
+        "# TYPE jobs_running gauge",
+        "jobs_running 1",
+        "# HELP job_seconds Duración",
+        "# TYPE job_seconds histogram",
+        'job_seconds_bucket{queue="a",le="0.1"} 1',
+        'job_seconds_bucket{queue="a",le="1"} 3',
+        'job_seconds_bucket{queue="a",le="+Inf"} 4',
+        'job_seconds_sum{queue="a"} 4.05',
+        'job_seconds_count{queue="a"} 4',
+    ]
+
+
+def test_registry_sums_the_values_of_every_thread():
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Trabajos")
+
+    def work():
+        for _ in range(1000):
+            registry.inc("jobs_total")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _sample(registry.render(), "jobs_total") == 4000
+
+
+def test_metrics_endpoint_counts_requests_by_route_and_status(client, db):
+    seed(db, "user_points", "u1", {"user_id": "u1", "points": 5, "last_updated": datetime.now(timezone.utc)})
+    route = "/usuarios/{user_id}/puntos"
+    before = client.get("/metrics").text
+
+    assert client.get("/usuarios/u1/puntos").status_code == 200
+    assert client.get("/usuarios/nadie/puntos").status_code == 404
+    after = client.get("/metrics")
+
+    assert after.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = after.text
+
+    def delta(name, **labels):
+        return _sample(text, name, **labels) - _sample(before, name, **labels)
+
+    assert delta("http_requests_total", method="GET", route=route, status="200") == 1
+    assert delta("http_requests_total", method="GET", route=route, status="404") == 1
+    assert delta("http_request_errors_total", method="GET", route=route, status="404") == 1
+    assert delta("http_request_errors_total", method="GET", route=route, status="200") == 0
+    assert delta("http_request_duration_seconds_count", method="GET", route=route) == 2
+    assert delta("crud_function_duration_seconds_count", function="get_user_points") == 2
+    # Durante el scrape solo está en curso la propia solicitud a /metrics
+    assert _sample(text, "http_requests_in_progress", method="GET") == 1
+    # Las series usan la plantilla de la ruta, no el ID
+    assert "/usuarios/u1/puntos" not in text
+
+
+def test_unhandled_errors_and_streamed_bodies_are_measured():
+    app = FastAPI()
+    app.add_middleware(RequestInstrumentation)
+
+    @app.get("/falla")
+    async def fail():
+        raise RuntimeError("sin manejar")
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            yield "a"
+            yield "b"
+        return StreamingResponse(body())
+
+    client = TestClient(app, raise_server_exceptions=False)
+    before = metrics.render()
+    # Sin respuesta de la aplicación, la solicitud se cuenta como 500
+    assert client.get("/falla").status_code == 500
+    assert client.get("/stream").text == "ab"
+    text = metrics.render()
+
+    def delta(name, **labels):
+        return _sample(text, name, **labels) - _sample(before, name, **labels)
+
+    assert delta("http_requests_total", method="GET", route="/falla", status="500") == 1
+    assert delta("http_request_errors_total", method="GET", route="/falla", status="500") == 1
+    assert delta("http_requests_total", method="GET", route="/stream", status="200") == 1
+    assert delta("http_request_duration_seconds_count", method="GET", route="/stream") == 1
+    assert delta("http_requests_in_progress", method="GET") == 0
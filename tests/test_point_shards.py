@@ -0,0 +1,141 @@
+"""Pruebas de los contadores de puntos distribuidos sobre el motor en memoria.
+
+Cubren la suma de los shards, la elección y ampliación de shards, la
+migración desde un solo contador y el rollup diferido al documento padre.
+"""
+import asyncio
+import random
+
+import pytest
+
+from app import crud
+from app.cache import point_shards_cache
+from app.firestore_ops import begin_request, end_request
+from app.leaderboard import leaderboard_index
+from tests.conftest import get_doc, seed
+
+
+@pytest.fixture
+def sharded(db, monkeypatch):
+    monkeypatch.setattr(crud, "POINTS_COUNTER_MODE", "sharded")
+    monkeypatch.setattr(crud, "POINT_SHARDS_BY_TIER", {"default": 1, "power": 4})
+    monkeypatch.setattr(crud, "POINTS_ROLLUP_INTERVAL_SECONDS", 1000)
+    return db
+
+
+def _shards(db, user_id: str) -> dict:
+    shards = db._to_sync_copy().collection("user_points").document(user_id).collection("shards")
+    return {doc.id: doc.to_dict()["points"] for doc in shards.stream()}
+
+
+def test_credits_spread_over_shards_and_sum_to_the_total(sharded):
+    db = sharded
+    seed(db, "users", "u1", {"user_id": "u1", "tier": "power", "city": "Cali"})
+    random.seed(7)
+
+    async def scenario():
+        for _ in range(20):
+            await crud._credit_points(db, [("u1", 5)])
+        return await crud.get_user_points(db, "u1")
+
+    points = asyncio.run(scenario())
+
+    shards = _shards(db, "u1")
+    assert set(shards) <= {"0", "1", "2", "3"}
+    assert len(shards) > 1
+    assert sum(shards.values()) == 100
+    assert points["points"] == 100
+    parent = get_doc(db, "user_points", "u1")
+    assert (parent["shards"], parent["city"]) == (4, "Cali")
+
+
+def test_single_counter_is_migrated_and_shards_only_grow(sharded):
+    db = sharded
+    seed(db, "users", "u1", {"user_id": "u1"})
+    seed(db, "user_points", "u1", {"user_id": "u1", "points": 50})
+
+    asyncio.run(crud._credit_points(db, [("u1", 10)]))
+    assert get_doc(db, "user_points", "u1")["shards"] == 1
+    assert _shards(db, "u1") == {"0": 60}
+
+    # Al subir de nivel se amplía al vencer la caché; la suma no cambia
+    seed(db, "users", "u1", {"user_id": "u1", "tier": "power"})
+    point_shards_cache.clear()
+    assert asyncio.run(crud._point_shards(db, "u1")) == 4
+    # Al bajar de nivel se conservan los shards para no dejar puntos fuera de rango
+    seed(db, "users", "u1", {"user_id": "u1"})
+    point_shards_cache.clear()
+    assert asyncio.run(crud._point_shards(db, "u1")) == 4
+    assert asyncio.run(crud._sum_point_shards(db, "u1")) == 60
+
+
+def test_bulk_credit_reads_shard_counts_together(sharded, monkeypatch):
+    db = sharded
+    for i in range(150):
+        seed(db, "users", f"u{i}", {"user_id": f"u{i}"})
+        seed(db, "user_points", f"u{i}", {"user_id": f"u{i}", "points": 0, "shards": 1})
+    seed(db, "users", "new", {"user_id": "new", "tier": "power"})
+
+    point_shards = crud._point_shards
+    prepared = []
+
+    async def tracking_point_shards(db, user_id):
+        prepared.append(user_id)
+        return await point_shards(db, user_id)
+
+    monkeypatch.setattr(crud, "_point_shards", tracking_point_shards)
+    stats, token = begin_request()
+    try:
+        asyncio.run(crud._resolve_point_shards(db, [f"u{i}" for i in range(150)] + ["new"]))
+    finally:
+        end_request(token)
+
+    # Solo el usuario sin contador distribuido pasa por la transacción
+    assert prepared == ["new"]
+    assert stats.transactions == 1
+    # Dos colecciones en lotes de 100 son 4 get_all; el usuario nuevo suma
+    # su lectura, el inicio de la transacción, la lectura en ella y el commit
+    assert stats.rpcs == 4 + 4
+    assert get_doc(db, "user_points", "new")["shards"] == 4
+
+
+def test_rollup_is_deferred_until_the_interval(sharded, monkeypatch):
+    db = sharded
+    seed(db, "users", "u1", {"user_id": "u1", "city": "Cali"})
+
+    # El primer crédito se lleva al padre enseguida
+    assert asyncio.run(crud._credit_points(db, [("u1", 10)])) == {"u1": 10}
+    assert get_doc(db, "user_points", "u1")["points"] == 10
+
+    # Los siguientes dentro del intervalo solo van a los shards y a la caché
+    assert asyncio.run(crud._credit_points(db, [("u1", 5)])) == {"u1": 15}
+    assert get_doc(db, "user_points", "u1")["points"] == 10
+    assert leaderboard_index.get_points("u1") == 15
+    assert asyncio.run(crud.rollup_pending_points(db)) == 0
+
+    monkeypatch.setattr(crud, "POINTS_ROLLUP_INTERVAL_SECONDS", 0)
+    leaderboard_index.set_points("u1", 0)
+    assert asyncio.run(crud.rollup_pending_points(db)) == 1
+    assert get_doc(db, "user_points", "u1")["points"] == 15
+    assert leaderboard_index.get_points("u1") == 15
+    # Ya no queda nada pendiente
+    assert asyncio.run(crud.rollup_pending_points(db)) == 0
+
+
+def test_bulk_progress_marks_instances_with_the_shard_credit(sharded):
+    db = sharded
+    seed(db, "users", "u1", {"user_id": "u1", "tier": "power"})
+    seed(db, "challenges", "c1", {"challenge_id": "c1", "status": "active", "puntos": 30})
+    for instance_id in ("i1", "i2"):
+        seed(db, "challenge_instances", instance_id, {
+            "user_id": "u1", "challenge_id": "c1", "progress": 1, "completed": False,
+        })
+
+    result = asyncio.run(crud.update_challenge_progress_bulk(db, [("i1", 1), ("i2", 1)]))
+
+    assert (result["completed"], result["users_credited"], result["error"]) == (2, 1, None)
+    assert sum(_shards(db, "u1").values()) == 60
+    assert all(get_doc(db, "challenge_instances", i)["points_credited"] for i in ("i1", "i2"))
+    # Reintentar los créditos no suma de nuevo
+    asyncio.run(crud.credit_completed_instances(db, [("i1", "u1", 30), ("i2", "u1", 30)]))
+    assert sum(_shards(db, "u1").values()) == 60
@@ -0,0 +1,102 @@
+"""Pruebas de los dos modos de actualizar el progreso sobre el motor en memoria.
+
+El modo 'increment' no usa transacciones: el evento que deja el progreso en
+0 completa la instancia con una escritura condicional y acredita los puntos;
+los que pasan de 0 se devuelven a 0. Los contadores de cada modo se publican
+en /metricas/progreso.
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from firebase_admin import firestore
+
+from app import crud
+from app.counters import progress_counters
+from app.leaderboard import leaderboard_index
+from tests.conftest import get_doc, seed
+
+
+@pytest.fixture
+def increment_mode(db, monkeypatch):
+    monkeypatch.setattr(crud, "PROGRESS_UPDATE_MODE", "increment")
+    return db
+
+
+def _seed_instance(db, progress: int, puntos: int = 50) -> None:
+    seed(db, "users", "u1", {"user_id": "u1", "city": "Cali", "state": "Valle"})
+    seed(db, "challenges", "c1", {"challenge_id": "c1", "status": "active", "puntos": puntos})
+    seed(db, "challenge_instances", "i1", {
+        "instance_id": "i1", "user_id": "u1", "challenge_id": "c1", "progress": progress, "completed": False,
+    })
+
+
+def test_increment_mode_completes_and_credits_points(increment_mode):
+    db = increment_mode
+    _seed_instance(db, progress=2)
+
+    async def scenario():
+        first = await crud.update_challenge_progress(db, "i1")
+        second = await crud.update_challenge_progress(db, "i1")
+        with pytest.raises(HTTPException) as error:
+            await crud.update_challenge_progress(db, "i1")
+        return first, second, error.value
+
+    first, second, error = asyncio.run(scenario())
+
+    assert first["status"] == "updated"
+    assert (second["status"], second["user_id"], second["points"]) == ("completed", "u1", 50)
+    assert error.status_code == 400
+    instance = get_doc(db, "challenge_instances", "i1")
+    assert (instance["progress"], instance["completed"]) == (0, True)
+    # El registro de puntos nuevo se crea con la ubicación del usuario
+    points = get_doc(db, "user_points", "u1")
+    assert (points["points"], points["city"], points["state"]) == (50, "Cali", "Valle")
+    assert leaderboard_index.get_points("u1") == 50
+    assert progress_counters.snapshot()["increment"]["requests"] == 3
+
+
+def test_concurrent_increments_clamp_the_overshoot(increment_mode):
+    db = increment_mode
+    _seed_instance(db, progress=1)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(crud.update_challenge_progress(db, "i1") for _ in range(4)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert sum(isinstance(result, dict) and result["status"] == "completed" for result in results) == 1
+    assert all(isinstance(result, dict) or result.status_code == 400 for result in results)
+    assert get_doc(db, "challenge_instances", "i1")["progress"] == 0
+    assert get_doc(db, "user_points", "u1")["points"] == 50
+    assert progress_counters.snapshot()["increment"].get("overshoots", 0) > 0
+
+
+def test_completion_retries_when_another_write_gets_in_between(db):
+    _seed_instance(db, progress=1)
+
+    async def scenario():
+        ref = db.collection("challenge_instances").document("i1")
+        write_result = await ref.update({"progress": firestore.Increment(-1)})
+        # Otra escritura después del incremento que llevó el progreso a 0
+        await ref.update({"progress": 0})
+        return await crud._mark_instance_completed(db, ref, write_result.update_time)
+
+    update_time = asyncio.run(scenario())
+
+    instance = get_doc(db, "challenge_instances", "i1")
+    assert instance["completed"] is True
+    assert db._to_sync_copy().collection("challenge_instances").document("i1").get().update_time == update_time
+    assert progress_counters.snapshot()["increment"]["retries"] == 1
+
+
+def test_progress_metrics_endpoint_reports_the_counters(client, db):
+    _seed_instance(db, progress=3)
+
+    assert client.post("/progreso-reto/i1").status_code == 200
+    body = client.get("/metricas/progreso").json()
+
+    assert body["mode"] == crud.PROGRESS_UPDATE_MODE
+    assert body["counters"][crud.PROGRESS_UPDATE_MODE]["requests"] == 1
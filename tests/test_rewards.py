@@ -0,0 +1,47 @@
+"""Pruebas de GET /recompensas sobre el motor en memoria.
+
+La respuesta es una lista, como antes de la paginación: sin `limit` trae
+todas y con `limit` una página, con el cursor en la cabecera X-Next-Cursor.
+"""
+from tests.conftest import seed
+
+
+def _seed_rewards(db) -> None:
+    for number in range(5):
+        seed(db, "rewards", f"r{number}", {
+            "reward_id": f"r{number}", "type": "badge" if number % 2 else "points", "value": str(number * 100),
+        })
+
+
+def test_without_limit_returns_every_reward_as_a_list(client, db):
+    _seed_rewards(db)
+
+    response = client.get("/recompensas")
+
+    assert response.status_code == 200
+    assert [reward["reward_id"] for reward in response.json()] == ["r0", "r1", "r2", "r3", "r4"]
+    assert response.json()[1] == {"reward_id": "r1", "type": "badge", "value": "100"}
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_pages_follow_the_cursor_header(client, db):
+    _seed_rewards(db)
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/recompensas", params=params)
+        pages.append([reward["reward_id"] for reward in response.json()])
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 2, "start_after": response.headers["X-Next-Cursor"]}
+
+    assert pages == [["r0", "r1"], ["r2", "r3"], ["r4"]]
+
+
+def test_type_filter_and_fields(client, db):
+    _seed_rewards(db)
+
+    response = client.get("/recompensas", params={"type": "badge", "fields": "value"})
+
+    assert response.json() == [{"reward_id": "r1", "value": "100"}, {"reward_id": "r3", "value": "300"}]
@@ -0,0 +1,100 @@
+"""Pruebas de las trazas de OpenTelemetry sobre el motor en memoria.
+
+Los spans van a un exportador en memoria: cada función de crud abre uno y
+cada operación de Firestore queda como hijo con sus lecturas y escrituras.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from app import crud, tracing
+from tests.conftest import seed
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(tracing, "_tracer", provider.get_tracer("pruebas"))
+    return exporter
+
+
+def _seed(db) -> None:
+    seed(db, "users", "u1", {"user_id": "u1"})
+    seed(db, "user_points", "u1", {"user_id": "u1", "points": 5, "last_updated": datetime.now(timezone.utc)})
+
+
+def test_crud_spans_have_firestore_children(db, spans):
+    _seed(db)
+
+    asyncio.run(crud.get_user_points(db, "u1"))
+    asyncio.run(crud.init_user_points(db, "u2"))
+
+    finished = {span.name: span for span in spans.get_finished_spans()}
+    parent = finished["crud.get_user_points"]
+    read = next(span for span in spans.get_finished_spans()
+                if span.name == "firestore.batch_get_documents" and span.parent.span_id == parent.context.span_id)
+    assert read.kind.name == "CLIENT"
+    assert (read.attributes["db.operation"], read.attributes["firestore.reads"]) == ("batch_get_documents", 1)
+    assert read.start_time <= read.end_time
+    commit = finished["firestore.commit"]
+    assert commit.parent.span_id == finished["crud.init_user_points"].context.span_id
+    assert commit.attributes["firestore.writes"] == 1
+
+
+def test_operations_outside_a_trace_do_not_create_spans(db, spans):
+    _seed(db)
+
+    async def scenario():
+        return await db.collection("user_points").document("u1").get()
+
+    assert asyncio.run(scenario()).exists
+    assert spans.get_finished_spans() == ()
+
+
+def test_server_span_continues_the_incoming_trace(spans):
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    headers = {"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+
+    with tracing.server_span("GET /usuarios", headers) as span:
+        tracing.record_span("firestore.run_query", 0.01, {"firestore.reads": 3})
+
+    server, = [s for s in spans.get_finished_spans() if s.name == "GET /usuarios"]
+    child, = [s for s in spans.get_finished_spans() if s.name == "firestore.run_query"]
+    assert span is not None and server.kind.name == "SERVER"
+    assert format(server.context.trace_id, "032x") == trace_id
+    assert child.parent.span_id == server.context.span_id
+    assert child.end_time - child.start_time == pytest.approx(0.01e9, rel=0.01)
+
+
+def test_disabled_tracing_is_a_no_op(db, monkeypatch):
+    monkeypatch.setattr(tracing, "_tracer", None)
+    _seed(db)
+
+    with tracing.server_span("GET /usuarios", {}) as span:
+        assert span is None
+    assert asyncio.run(crud.get_user_points(db, "u1"))["points"] == 5
+
+
+def test_requests_open_a_server_span_with_firestore_counts(client, db, spans):
+    _seed(db)
+
+    assert client.get("/usuarios/u1/puntos").status_code == 200
+
+    finished = spans.get_finished_spans()
+    server, = [span for span in finished if span.kind.name == "SERVER"]
+    assert server.name == "GET /usuarios/{user_id}/puntos"
+    assert (server.attributes["http.route"], server.attributes["http.response.status_code"]) == (
+        "/usuarios/{user_id}/puntos", 200,
+    )
+    assert (server.attributes["firestore.reads"], server.attributes["firestore.writes"]) == (1, 0)
+    crud_span, = [span for span in finished if span.name == "crud.get_user_points"]
+    assert crud_span.parent.span_id == server.context.span_id
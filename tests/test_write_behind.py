@@ -0,0 +1,147 @@
+"""Pruebas de la cola write-behind del progreso sobre el motor en memoria.
+
+Además del flush y el drain normales cubren los fallos a mitad de camino:
+solo deben volver a la cola los eventos que no se aplicaron, y los puntos
+de una instancia completada se acreditan una sola vez aunque el crédito
+se reintente.
+"""
+import asyncio
+
+import pytest
+
+from app import crud
+from app.write_behind import ProgressBuffer
+from tests.conftest import fail_commits, get_doc, seed
+
+
+def _seed_instances(db, **progress_by_instance) -> None:
+    seed(db, "users", "u1", {"user_id": "u1", "city": "Cali"})
+    seed(db, "challenges", "c1", {"challenge_id": "c1", "status": "active", "puntos": 100})
+    for instance_id, progress in progress_by_instance.items():
+        seed(db, "challenge_instances", instance_id, {
+            "user_id": "u1", "challenge_id": "c1", "progress": progress, "completed": False,
+        })
+
+
+def _buffer(**deltas) -> ProgressBuffer:
+    buffer = ProgressBuffer(flush_size=1000, flush_interval=60)
+    for instance_id, count in deltas.items():
+        buffer.add(instance_id, count)
+    return buffer
+
+
+def test_flush_applies_deltas_and_credits_points(db):
+    _seed_instances(db, i1=3, i2=1)
+    buffer = _buffer(i1=2, i2=3)
+
+    applied = asyncio.run(buffer.flush(db))
+
+    # Los dos eventos de i2 que sobran después de completarla se descartan
+    assert applied == 3
+    assert get_doc(db, "challenge_instances", "i1")["progress"] == 1
+    i2 = get_doc(db, "challenge_instances", "i2")
+    assert (i2["progress"], i2["completed"], i2["points_credited"]) == (0, True, True)
+    assert get_doc(db, "user_points", "u1")["points"] == 100
+    assert buffer.depth == 0
+    stats = buffer.stats()
+    assert (stats["flushes"], stats["applied_events"], stats["discarded_events"]) == (1, 3, 2)
+    assert asyncio.run(buffer.flush(db)) == 0
+
+
+def test_drain_empties_the_queue(db, monkeypatch):
+    monkeypatch.setattr(crud, "MAX_BATCH_WRITES", 2)
+    _seed_instances(db, i1=5, i2=5, i3=1, i4=1, i5=5)
+    buffer = _buffer(i1=1, i2=2, i3=1, i4=1, i5=4)
+
+    assert asyncio.run(buffer.drain(db)) == 9
+    assert buffer.depth == 0
+    assert [get_doc(db, "challenge_instances", i)["progress"] for i in ("i1", "i2", "i3", "i4", "i5")] == [4, 3, 0, 0, 1]
+    assert get_doc(db, "user_points", "u1")["points"] == 200
+
+
+def test_failed_credit_is_retried_without_repeating_progress(db, monkeypatch):
+    _seed_instances(db, i1=3, i2=1)
+    buffer = _buffer(i1=1, i2=1)
+
+    credit_points = crud._credit_points
+    calls = 0
+
+    async def failing_once(db, completed):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("Firestore no disponible")
+        return await credit_points(db, completed)
+
+    monkeypatch.setattr(crud, "_credit_points", failing_once)
+    with pytest.raises(RuntimeError, match="Crédito de puntos"):
+        asyncio.run(buffer.flush(db))
+
+    # El progreso ya quedó confirmado y no vuelve a la cola; solo el crédito
+    assert get_doc(db, "challenge_instances", "i1")["progress"] == 2
+    assert get_doc(db, "challenge_instances", "i2")["completed"] is True
+    assert get_doc(db, "user_points", "u1") is None
+    stats = buffer.stats()
+    assert (stats["pending_events"], stats["pending_credits"], stats["flush_errors"]) == (0, 1, 1)
+
+    asyncio.run(buffer.flush(db))
+
+    assert get_doc(db, "challenge_instances", "i1")["progress"] == 2
+    assert get_doc(db, "challenge_instances", "i2")["points_credited"] is True
+    assert get_doc(db, "user_points", "u1")["points"] == 100
+    assert buffer.depth == 0
+
+
+def test_credit_lost_after_commit_is_not_repeated(db, monkeypatch):
+    _seed_instances(db, i1=1)
+    buffer = _buffer(i1=1)
+
+    # Commit 1: el progreso; commit 2: el crédito, que se confirma pero su respuesta se pierde
+    fail_commits(db, monkeypatch, 2, apply=True)
+    with pytest.raises(RuntimeError):
+        asyncio.run(buffer.flush(db))
+    assert get_doc(db, "user_points", "u1")["points"] == 100
+
+    # El reintento ve la marca de la instancia y no acredita de nuevo
+    asyncio.run(buffer.flush(db))
+    assert get_doc(db, "user_points", "u1")["points"] == 100
+    assert buffer.depth == 0
+
+
+def test_failed_chunk_restores_only_unapplied_events(db, monkeypatch):
+    monkeypatch.setattr(crud, "MAX_BATCH_WRITES", 2)
+    _seed_instances(db, i1=5, i2=5, i3=5)
+    buffer = _buffer(i1=1, i2=1, i3=2)
+
+    # El primer chunk (i1, i2) se confirma y el segundo (i3) falla
+    fail_commits(db, monkeypatch, 2)
+    with pytest.raises(RuntimeError, match="Chunk 2 de 2"):
+        asyncio.run(buffer.flush(db))
+
+    assert [get_doc(db, "challenge_instances", i)["progress"] for i in ("i1", "i2", "i3")] == [4, 4, 5]
+    stats = buffer.stats()
+    assert (stats["pending_instances"], stats["pending_events"]) == (1, 2)
+
+    assert asyncio.run(buffer.flush(db)) == 2
+    assert [get_doc(db, "challenge_instances", i)["progress"] for i in ("i1", "i2", "i3")] == [4, 4, 3]
+
+
+def test_bulk_reports_unapplied_chunks_and_pending_credits(db, monkeypatch):
+    monkeypatch.setattr(crud, "MAX_BATCH_WRITES", 2)
+    _seed_instances(db, i1=1, i2=5, i3=5)
+
+    fail_commits(db, monkeypatch, 2, 3)
+    result = asyncio.run(crud.update_challenge_progress_bulk(db, [("i1", 1), ("i2", 1), ("i3", 1)]))
+
+    assert [(r["instance_id"], r["status"], r.get("error")) for r in result["results"]] == [
+        ("i1", "completed", None), ("i2", "updated", None), ("i3", "error", "not_applied"),
+    ]
+    assert result["error"].startswith("Chunk 2 de 2")
+    # El commit 3 era el crédito de i1
+    assert result["pending_credits"] == [{"instance_id": "i1", "user_id": "u1", "points": 100}]
+    assert result["users_credited"] == 0
+
+    credits = [(c["instance_id"], c["user_id"], c["points"]) for c in result["pending_credits"]]
+    assert asyncio.run(crud.credit_completed_instances(db, credits)) == {"u1": 100}
+    assert asyncio.run(crud.credit_completed_instances(db, credits)) == {}
+    assert get_doc(db, "user_points", "u1")["points"] == 100